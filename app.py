@@ -415,10 +415,14 @@ def check_for_export(options, suffix='', remove_surfaces=False):
         try:
             from invesalius.project import Project
 
+            # All the presets are given at once to the surface workers, each
+            # file is written as soon as its surface is done.
+            exports = []
             for threshold_name, threshold_range in Project().presets.thresh_ct.iteritems():
                 if isinstance(threshold_range[0], int):
                     path_ = u'{}-{}-{}.stl'.format(options.export_to_all, suffix, threshold_name)
-                    export(path_, threshold_range, remove_surface=True)
+                    exports.append((path_, threshold_range))
+            export_many(exports)
         except:
             traceback.print_exc()
         finally:
@@ -449,6 +453,13 @@ def export(path_, threshold_range, remove_surface=False):
         Publisher.sendMessage('Remove surfaces', [0])
 
 
+def export_many(exports):
+    import invesalius.constants as const
+
+    Publisher.sendMessage('Export surfaces from thresholds',
+                          (exports, const.FILETYPE_STL))
+
+
 def print_events(data):
     """
     Print pubsub messages
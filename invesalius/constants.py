@@ -242,6 +242,11 @@ MASK_COLOUR =  [[0.33, 1, 0.33],
                 #(0.792156862745098, 1.0, 0.66666666666666663), # too "light"
                 #(0.66666666666666663, 0.792156862745098, 1.0)]
 
+# Mask storage (see invesalius.data.mask_storage)
+MASK_STORAGE_DENSE = 'dense'
+MASK_STORAGE_BRICKS = 'bricks'
+DEFAULT_MASK_STORAGE = MASK_STORAGE_DENSE
+
 
 MEASURE_COLOUR =  itertools.cycle([[1, 0, 0],
                                    [1, 0.4, 0],
@@ -302,6 +307,19 @@ SURFACE_QUALITY_LIST = [_("Low"),_("Medium"),_("High"),_("Optimal *")]
 SURFACE_TRANSPARENCY = 0.0
 SURFACE_NAME_PATTERN = _("Surface %d")
 
+# Surface levels of detail. Surfaces with more than SURFACE_LOD_MIN_POLYS
+# polygons get up to SURFACE_LOD_MAX_LEVELS coarser copies, each one with
+# SURFACE_LOD_FACTOR times fewer polygons than the previous, shown while the
+# camera is moving. SURFACE_LOD_INTERACTIVE_POLYS is the number of polygons
+# shown while moving, shared by the visible surfaces, and
+# SURFACE_LOD_STILL_DELAY the time (ms) the camera must be still to show the
+# full surfaces again.
+SURFACE_LOD_MIN_POLYS = 200000
+SURFACE_LOD_FACTOR = 4
+SURFACE_LOD_MAX_LEVELS = 3
+SURFACE_LOD_INTERACTIVE_POLYS = 400000
+SURFACE_LOD_STILL_DELAY = 300
+
 # Imagedata - window and level presets
 WINDOW_LEVEL = {_("Abdomen"):(350,50),
                 _("Bone"):(2000, 300),
@@ -387,6 +405,25 @@ ID_TO_BMP = {VOL_FRONT: [_("Front"), os.path.join(ICON_DIR, u"view_front.png")],
 # if 1, use vtkVolumeRaycastMapper, if 0, use vtkFixedPointVolumeRayCastMapper
 TYPE_RAYCASTING_MAPPER = 0
 
+# Raycasting quality. While the camera moves the mappers raise the image
+# sample distance (up to RAYCASTING_MAX_IMAGE_SAMPLE_DISTANCE) and the ray
+# sample distance (RAYCASTING_INTERACTIVE_SAMPLE_FACTOR times the still
+# one) to render each frame in the frame time (ms) set in the preferences.
+# The full quality is rendered when the camera is still.
+RAYCASTING_IMAGE_SAMPLE_DISTANCE = 0.25
+RAYCASTING_MAX_IMAGE_SAMPLE_DISTANCE = 4.0
+RAYCASTING_INTERACTIVE_SAMPLE_FACTOR = 4.0
+DEFAULT_RAYCASTING_FRAME_TIME = 100
+RAYCASTING_FRAME_TIME_RANGE = (10, 2000)
+
+# Number of images prepared for the raycasting (one for each list of
+# convolution filters) kept in memory-mapped files.
+RAYCASTING_CACHE_SIZE = 3
+
+# While a node or a curve of the raycasting CLUT is dragged the volume is
+# rendered at most once each CLUT_RENDER_INTERVAL ms (a 60 Hz display).
+CLUT_RENDER_INTERVAL = 1000 // 60
+
 
 RAYCASTING_FILES = {_("Airways"): "Airways.plist",
                    _("Airways II"): "Airways II.plist",
@@ -624,6 +661,7 @@ RENDERING = 0
 SURFACE_INTERPOLATION = 1
 LANGUAGE = 2
 SLICE_INTERPOLATION = 3
+RAYCASTING_FRAME_TIME = 4
 
 #Correlaction extracted from pyDicom
 DICOM_ENCODING_TO_PYTHON = {
@@ -685,6 +723,10 @@ DYNAMIC_REF = 1
 DEFAULT_REF_MODE = DYNAMIC_REF
 REF_MODE = [_("Static ref."), _("Dynamic ref.")]
 
+# The tracker is read at its own rate in a thread, the newest co-registered
+# sample is shown each NAVIGATION_DISPLAY_INTERVAL ms (a 60 Hz display).
+NAVIGATION_DISPLAY_INTERVAL = 1000 // 60
+
 DEFAULT_COIL = SELECT
 COIL = [_("Select coil:"), _("Neurosoft Figure-8"),
            _("Magstim 70 mm"), _("Nexstim")]
@@ -838,12 +838,6 @@ class Controller():
         else:
             self.matrix, spacing, scalar_range, self.filename = image_utils.dcmmf2memmap(filelist[0], orientation)
 
-        self.Slice = sl.Slice()
-        self.Slice.matrix = self.matrix
-        self.Slice.matrix_filename = self.filename
-
-        self.Slice.spacing = spacing
-
         # 1(a): Fix gantry tilt, if any
         tilt_value = dicom.acquisition.tilt
         if (tilt_value) and (gui):
@@ -851,10 +845,18 @@ class Controller():
             message = _("Fix gantry tilt applying the degrees below")
             value = -1*tilt_value
             tilt_value = dialog.ShowNumberDialog(message, value)
-            image_utils.FixGantryTilt(self.matrix, self.Slice.spacing, tilt_value)
+            image_utils.FixGantryTilt(self.matrix, spacing, tilt_value)
         elif (tilt_value) and not (gui):
             tilt_value = -1*tilt_value
-            image_utils.FixGantryTilt(self.matrix, self.Slice.spacing, tilt_value)
+            image_utils.FixGantryTilt(self.matrix, spacing, tilt_value)
+
+        # The matrix is given to the slice only after it's corrected, the
+        # histogram of the matrix is counted as soon as it's set.
+        self.Slice = sl.Slice()
+        self.Slice.matrix = self.matrix
+        self.Slice.matrix_filename = self.filename
+
+        self.Slice.spacing = spacing
 
         self.Slice.window_level = wl
         self.Slice.window_width = ww
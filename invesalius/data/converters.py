@@ -62,6 +62,24 @@ def to_vtk(n_array, spacing, slice_number, orientation):
     return image_copy
 
 
+def to_vtk_view(n_array, spacing, slice_number):
+    """
+    Like to_vtk with AXIAL orientation, but the vtkImageData uses the memory
+    of n_array (it must be C contiguous and writable) instead of a copy of
+    it. n_array must be kept alive while the image is in use.
+    """
+    dz, dy, dx = n_array.shape
+    v_image = numpy_support.numpy_to_vtk(n_array.reshape(-1))
+
+    image = vtk.vtkImageData()
+    image.SetOrigin(0, 0, 0)
+    image.SetSpacing(spacing)
+    image.SetExtent(0, dx - 1, 0, dy - 1, slice_number, slice_number + dz - 1)
+    image.GetPointData().SetScalars(v_image)
+
+    return image
+
+
 def np_rgba_to_vtk(n_array, spacing=(1.0, 1.0, 1.0)):
     dy, dx, dc = n_array.shape
     v_image = numpy_support.numpy_to_vtk(n_array.reshape(dy*dx, dc))
@@ -82,3 +100,148 @@ def np_rgba_to_vtk(n_array, spacing=(1.0, 1.0, 1.0)):
     image.GetPointData().SetScalars(v_image)
 
     return image
+
+
+def polydata_to_numpy(polydata):
+    """
+    Returns the points, the polygons (in the vtkCellArray legacy layout:
+    n, id_0, ..., id_n-1, n, ...) and the point data arrays of polydata
+    as numpy arrays, in a dict that can be sent to another process and
+    turned into a vtkPolyData again with numpy_to_polydata.
+    """
+    arrays = {'points': numpy.zeros((0, 3), dtype='float32'),
+              'polys': numpy.zeros(0, dtype='int64'),
+              'ncells': 0,
+              'point_data': []}
+
+    if polydata.GetNumberOfPoints():
+        arrays['points'] = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData()).copy()
+
+    polys = polydata.GetPolys()
+    if polys.GetNumberOfCells():
+        arrays['polys'] = numpy_support.vtk_to_numpy(polys.GetData()).astype('int64')
+        arrays['ncells'] = polys.GetNumberOfCells()
+
+    point_data = polydata.GetPointData()
+    for n in range(point_data.GetNumberOfArrays()):
+        vtk_array = point_data.GetArray(n)
+        if vtk_array is None:
+            continue
+        arrays['point_data'].append((vtk_array.GetName(),
+                                     point_data.IsArrayAnAttribute(n),
+                                     numpy_support.vtk_to_numpy(vtk_array).copy()))
+    return arrays
+
+
+def _offset_cells(cells, offset):
+    """
+    Adds offset to the point ids of cells (legacy vtkCellArray layout).
+    """
+    cells = cells.copy()
+    if cells.size % 4 == 0 and (cells[::4] == 3).all():
+        # Only triangles, the common case.
+        cells.reshape(-1, 4)[:, 1:] += offset
+    else:
+        i = 0
+        while i < cells.size:
+            n = cells[i]
+            cells[i + 1:i + 1 + n] += offset
+            i += n + 1
+    return cells
+
+
+def mirror_y(arrays):
+    """
+    Mirrors, in place, the surface in arrays (from polydata_to_numpy) about
+    the plane y = 0, the same that is done by contouring an image flipped by
+    vtkImageFlip with FlipAboutOrigin on the Y axis. The order of the
+    points of each polygon is reversed, so they keep facing out, and the y
+    component of the vector point data arrays (normals, gradients) is
+    negated.
+    """
+    arrays['points'][:, 1] *= -1
+
+    cells = arrays['polys']
+    if cells.size % 4 == 0 and (cells[::4] == 3).all():
+        triangles = cells.reshape(-1, 4)
+        triangles[:, [1, 3]] = triangles[:, [3, 1]]
+    else:
+        i = 0
+        while i < cells.size:
+            n = cells[i]
+            cells[i + 1:i + 1 + n] = cells[i + 1:i + 1 + n][::-1]
+            i += n + 1
+
+    for name, attribute, array in arrays['point_data']:
+        if array.ndim == 2 and array.shape[1] == 3:
+            array[:, 1] *= -1
+
+
+def mass_properties(points, polys, chunk_size=2 ** 20):
+    """
+    Returns the signed volume and the area of the surface made by the
+    triangles polys (legacy vtkCellArray layout) over points.
+
+    The signed volume is the sum of the volumes of the tetrahedra formed by
+    the origin and each triangle, so it's additive: the volume of a closed
+    surface generated in pieces is the absolute value of the sum of the
+    signed volumes of the pieces, whatever the pieces are.
+    """
+    if polys.size % 4 or not (polys[::4] == 3).all():
+        raise ValueError("Only triangles can be measured")
+    triangles = polys.reshape(-1, 4)[:, 1:]
+
+    volume = 0.0
+    area = 0.0
+    for i in range(0, triangles.shape[0], chunk_size):
+        chunk = triangles[i:i + chunk_size]
+        p0 = points[chunk[:, 0]].astype('float64')
+        cross = numpy.cross(points[chunk[:, 1]] - p0, points[chunk[:, 2]] - p0)
+        area += numpy.sqrt((cross ** 2).sum(1)).sum() / 2.0
+        # p0 . (p1 x p2) == p0 . ((p1 - p0) x (p2 - p0))
+        volume += (p0 * cross).sum() / 6.0
+    return float(volume), float(area)
+
+
+def numpy_to_polydata(pieces):
+    """
+    Builds one vtkPolyData from a list of dicts returned by
+    polydata_to_numpy. The vtk arrays reference the (concatenated) numpy
+    arrays instead of copying them.
+    """
+    polydata = vtk.vtkPolyData()
+    pieces = [p for p in pieces if p['points'].shape[0]]
+    if not pieces:
+        return polydata
+
+    offsets = numpy.cumsum([0] + [p['points'].shape[0] for p in pieces])
+    points = numpy.ascontiguousarray(numpy.concatenate([p['points'] for p in pieces]))
+    polys = numpy.concatenate([_offset_cells(p['polys'], o)
+                               for p, o in zip(pieces, offsets)])
+    polys = numpy.ascontiguousarray(polys.astype(numpy_support.ID_TYPE_CODE))
+    ncells = sum(p['ncells'] for p in pieces)
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points))
+    polydata.SetPoints(vtk_points)
+
+    cells = vtk.vtkCellArray()
+    cells.SetCells(ncells, numpy_support.numpy_to_vtkIdTypeArray(polys))
+    polydata.SetPolys(cells)
+
+    # Only the point data arrays present in every piece are kept.
+    for i, (name, attribute, array) in enumerate(pieces[0]['point_data']):
+        try:
+            data = [p['point_data'][i][2] for p in pieces]
+        except IndexError:
+            break
+        data = numpy.ascontiguousarray(numpy.concatenate(data))
+        vtk_array = numpy_support.numpy_to_vtk(data)
+        if name:
+            vtk_array.SetName(name)
+        if attribute >= 0:
+            polydata.GetPointData().SetAttribute(vtk_array, attribute)
+        else:
+            polydata.GetPointData().AddArray(vtk_array)
+
+    return polydata
@@ -17,76 +17,112 @@
 #    detalhes.
 #--------------------------------------------------------------------------
 
+import abc
 import threading
-from time import sleep
+from time import sleep, time
 
-from numpy import asmatrix, mat, degrees, radians, identity
+from numpy import asmatrix, mat, newaxis
 import wx
+from six import with_metaclass
 from wx.lib.pubsub import pub as Publisher
 
+import invesalius.constants as const
 import invesalius.data.coordinates as dco
-import invesalius.data.transformations as tr
+import invesalius.data.navigation_math as nm
+import invesalius.utils as utils
 
-# TODO: Optimize navigation thread. Remove the infinite loop and optimize sleep.
 
-
-class CoregistrationStatic(threading.Thread):
+class LatestSample(object):
     """
-    Thread to update the coordinates with the fiducial points
-    co-registration method while the Navigation Button is pressed.
-    Sleep function in run method is used to avoid blocking GUI and
-    for better real-time navigation
+    Single slot holding the newest sample read from the tracker. The
+    acquisition thread replaces it and the GUI takes it, a sample not taken
+    before the next one arrives is dropped. Only attribute assignments are
+    used, which are atomic, so there is no lock.
     """
-
-    def __init__(self, coreg_data, nav_id, trck_info):
-        threading.Thread.__init__(self)
-        self.coreg_data = coreg_data
-        self.nav_id = nav_id
-        self.trck_info = trck_info
-        self._pause_ = False
-        self.start()
-
-    def stop(self):
-        self._pause_ = True
-
-    def run(self):
-        # m_change = self.coreg_data[0]
-        # obj_ref_mode = self.coreg_data[2]
-        #
-        # trck_init = self.trck_info[0]
-        # trck_id = self.trck_info[1]
-        # trck_mode = self.trck_info[2]
-
-        m_change, obj_ref_mode = self.coreg_data
-        trck_init, trck_id, trck_mode = self.trck_info
-
-        while self.nav_id:
-            coord_raw = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-
-            psi, theta, phi = coord_raw[obj_ref_mode, 3:]
-            t_probe_raw = asmatrix(tr.translation_matrix(coord_raw[obj_ref_mode, :3]))
-
-            t_probe_raw[2, -1] = -t_probe_raw[2, -1]
-
-            m_img = m_change * t_probe_raw
-
-            coord = m_img[0, -1], m_img[1, -1], m_img[2, -1], psi, theta, phi
-
-            wx.CallAfter(Publisher.sendMessage, 'Co-registered points', (m_img, coord))
-
-            # TODO: Optimize the value of sleep for each tracking device.
-            sleep(0.175)
-
-            if self._pause_:
-                return
-
-
-class CoregistrationDynamic(threading.Thread):
+    def __init__(self):
+        self._slot = (0, None)
+        self.written = 0
+
+    def put(self, sample):
+        self.written += 1
+        self._slot = (self.written, sample)
+
+    def take(self, last):
+        """
+        Returns (number, sample) of the newest sample, or None if it's the
+        sample number last.
+        """
+        slot = self._slot
+        if slot[0] == last:
+            return None
+        return slot
+
+
+class LatencyStats(object):
+    """
+    Time from the reading of each sample from the tracker to its display,
+    and the number of samples read, shown and dropped.
     """
-    Thread to update the coordinates with the fiducial points
-    co-registration method while the Navigation Button is pressed.
-    Sleep function in run method is used to avoid blocking GUI and
-    for better real-time navigation
+    def __init__(self):
+        self.start = time()
+        self.shown = 0
+        self.dropped = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency, dropped):
+        self.shown += 1
+        self.dropped += dropped
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def mean(self):
+        if not self.shown:
+            return 0.0
+        return self.total / self.shown
+
+    def __str__(self):
+        elapsed = max(time() - self.start, 1e-9)
+        return "Navigation: %d samples shown (%.1f Hz), %d dropped, " \
+               "latency mean %.1f ms, max %.1f ms" % \
+               (self.shown, self.shown / elapsed, self.dropped,
+                self.mean * 1000.0, self.max * 1000.0)
+
+
+class PoseDispatcher(wx.Timer):
+    """
+    Sends, in the GUI thread and at most once per display frame, the
+    messages of the newest co-registered sample.
+    """
+    def __init__(self, buffer, stats):
+        wx.Timer.__init__(self)
+        self.buffer = buffer
+        self.stats = stats
+        self.last = 0
+        self.Start(const.NAVIGATION_DISPLAY_INTERVAL)
+
+    def Notify(self):
+        slot = self.buffer.take(self.last)
+        if slot is None:
+            return
+        number, (acquired, messages) = slot
+        dropped = number - self.last - 1
+        self.last = number
+        # The time the tracker was read, for the coordinates that follow.
+        Publisher.sendMessage('Update navigation sample time', acquired)
+        for topic, data in messages:
+            Publisher.sendMessage(topic, data)
+        self.stats.add(time() - acquired, dropped)
+
+
+class Coregistration(with_metaclass(abc.ABCMeta, threading.Thread)):
+    """
+    Thread to update the coordinates with the co-registration method while
+    the Navigation Button is pressed. The tracker is read at its own rate,
+    each sample is co-registered and left in a LatestSample, from where
+    the PoseDispatcher takes the newest one to show. Nothing is sent from
+    this thread, the sensors IDs go with the sample too.
     """
 
     def __init__(self, coreg_data, nav_id, trck_info):
@@ -94,270 +130,136 @@ class CoregistrationDynamic(threading.Thread):
         self.coreg_data = coreg_data
         self.nav_id = nav_id
         self.trck_info = trck_info
+        if coreg_data is not None:
+            # The maths of the session, computed once.
+            self.maths = nm.Coregistration(coreg_data)
         self._pause_ = False
+        self.buffer = LatestSample()
+        self.stats = LatencyStats()
+        self.dispatcher = PoseDispatcher(self.buffer, self.stats)
         self.start()
 
     def stop(self):
         self._pause_ = True
+        self.dispatcher.Stop()
+        utils.debug(str(self.stats))
+
+    @abc.abstractmethod
+    def Coregister(self, coord_raw):
+        """
+        Returns the messages, a list of (topic, data), to send for the
+        tracker coordinates coord_raw.
+        """
 
     def run(self):
-        m_change, obj_ref_mode = self.coreg_data
         trck_init, trck_id, trck_mode = self.trck_info
 
-        while self.nav_id:
-            coord_raw = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-
-            psi, theta, phi = radians(coord_raw[obj_ref_mode, 3:])
-            r_probe = tr.euler_matrix(psi, theta, phi, 'rzyx')
-            t_probe = tr.translation_matrix(coord_raw[obj_ref_mode, :3])
-            m_probe = asmatrix(tr.concatenate_matrices(t_probe, r_probe))
-
-            psi_ref, theta_ref, phi_ref = radians(coord_raw[1, 3:])
-            r_ref = tr.euler_matrix(psi_ref, theta_ref, phi_ref, 'rzyx')
-            t_ref = tr.translation_matrix(coord_raw[1, :3])
-            m_ref = asmatrix(tr.concatenate_matrices(t_ref, r_ref))
-
-            m_dyn = m_ref.I * m_probe
-            m_dyn[2, -1] = -m_dyn[2, -1]
+        while self.nav_id and not self._pause_:
+            try:
+                coord_raw, sensors = dco.ReadCoordinates(trck_init, trck_id, trck_mode)
+            except Exception as err:
+                # The tracker may fail now and then, keep navigating.
+                utils.debug("Navigation: reading the tracker failed: %s" % err)
+                sleep(const.NAVIGATION_DISPLAY_INTERVAL / 1000.0)
+                continue
+            acquired = time()
+
+            messages = []
+            if sensors is not None:
+                messages.append(('Sensors ID', sensors))
+            try:
+                messages.extend(self.Coregister(coord_raw))
+            except Exception as err:
+                # E.g. no coordinates when the Claron lost the markers,
+                # only the sensors IDs are shown then.
+                utils.debug("Navigation: no co-registration: %s" % err)
+                sleep(const.NAVIGATION_DISPLAY_INTERVAL / 1000.0)
+            if messages:
+                self.buffer.put((acquired, messages))
+
+
+class CoregistrationStatic(Coregistration):
+    """
+    Co-registration with the fiducial points.
+    """
 
-            m_img = m_change * m_dyn
+    def Coregister(self, coord_raw):
+        probe = coord_raw[self.maths.obj_ref_mode][newaxis]
+        m_img, coord = self.maths.static(probe)
 
-            scale, shear, angles, trans, persp = tr.decompose_matrix(m_img)
+        return [('Co-registered points', (asmatrix(m_img[0]), tuple(coord[0])))]
 
-            coord = m_img[0, -1], m_img[1, -1], m_img[2, -1], \
-                    degrees(angles[0]), degrees(angles[1]), degrees(angles[2])
 
-            wx.CallAfter(Publisher.sendMessage, 'Co-registered points', (m_img, coord))
+class CoregistrationDynamic(Coregistration):
+    """
+    Co-registration with the fiducial points and a dynamic reference.
+    """
 
-            # TODO: Optimize the value of sleep for each tracking device.
-            sleep(0.175)
+    def Coregister(self, coord_raw):
+        probe = coord_raw[self.maths.obj_ref_mode][newaxis]
+        reference = coord_raw[1][newaxis]
+        m_img, coord = self.maths.dynamic(probe, reference)
 
-            if self._pause_:
-                return
+        return [('Co-registered points', (asmatrix(m_img[0]), tuple(coord[0])))]
 
 
-class CoregistrationDynamic_old(threading.Thread):
+class CoregistrationDynamic_old(Coregistration):
     """
-    Thread to update the coordinates with the fiducial points
-    co-registration method while the Navigation Button is pressed.
-    Sleep function in run method is used to avoid blocking GUI and
-    for better real-time navigation
+    Co-registration with the fiducial points bases and a dynamic reference.
     """
 
     def __init__(self, bases, nav_id, trck_info):
-        threading.Thread.__init__(self)
         self.bases = bases
-        self.nav_id = nav_id
-        self.trck_info = trck_info
-        self._pause_ = False
-        self.start()
-
-    def stop(self):
-        self._pause_ = True
+        Coregistration.__init__(self, None, nav_id, trck_info)
 
-    def run(self):
+    def Coregister(self, coord_raw):
         m_inv = self.bases[0]
         n = self.bases[1]
         q1 = self.bases[2]
         q2 = self.bases[3]
-        trck_init = self.trck_info[0]
-        trck_id = self.trck_info[1]
-        trck_mode = self.trck_info[2]
-
-        while self.nav_id:
-            # trck_coord, probe, reference = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-            coord_raw = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-
-            trck_coord = dco.dynamic_reference(coord_raw[0, :], coord_raw[1, :])
 
-            trck_xyz = mat([[trck_coord[0]], [trck_coord[1]], [trck_coord[2]]])
-            img = q1 + (m_inv * n) * (trck_xyz - q2)
+        # trck_coord, probe, reference = dco.GetCoordinates(trck_init, trck_id, trck_mode)
+        trck_coord = dco.dynamic_reference(coord_raw[0, :], coord_raw[1, :])
 
-            coord = (float(img[0]), float(img[1]), float(img[2]), trck_coord[3],
-                     trck_coord[4], trck_coord[5])
-            angles = coord_raw[0, 3:6]
+        trck_xyz = mat([[trck_coord[0]], [trck_coord[1]], [trck_coord[2]]])
+        img = q1 + (m_inv * n) * (trck_xyz - q2)
 
-            # Tried several combinations and different locations to send the messages,
-            # however only this one does not block the GUI during navigation.
-            wx.CallAfter(Publisher.sendMessage, 'Co-registered points', coord)
-            wx.CallAfter(Publisher.sendMessage, 'Set camera in volume', coord)
-            wx.CallAfter(Publisher.sendMessage, 'Update tracker angles', angles)
+        coord = (float(img[0]), float(img[1]), float(img[2]), trck_coord[3],
+                 trck_coord[4], trck_coord[5])
+        angles = coord_raw[0, 3:6]
 
-            # TODO: Optimize the value of sleep for each tracking device.
-            # Debug tracker is not working with 0.175 so changed to 0.2
-            # However, 0.2 is too low update frequency ~5 Hz. Need optimization URGENTLY.
-            # sleep(.3)
-            sleep(0.175)
+        return [('Co-registered points', coord),
+                ('Set camera in volume', coord),
+                ('Update tracker angles', angles)]
 
-            if self._pause_:
-                return
 
-
-class CoregistrationObjectStatic(threading.Thread):
+class CoregistrationObjectStatic(Coregistration):
     """
-    Thread to update the coordinates with the fiducial points
-    co-registration method while the Navigation Button is pressed.
-    Sleep function in run method is used to avoid blocking GUI and
-    for better real-time navigation
+    Co-registration of the tracked object with the fiducial points.
     """
 
-    def __init__(self, coreg_data, nav_id, trck_info):
-        threading.Thread.__init__(self)
-        self.coreg_data = coreg_data
-        self.nav_id = nav_id
-        self.trck_info = trck_info
-        self._pause_ = False
-        self.start()
-
-    def stop(self):
-        self._pause_ = True
-
-    def run(self):
-        # m_change = self.coreg_data[0]
-        # t_obj_raw = self.coreg_data[1]
-        # s0_raw = self.coreg_data[2]
-        # r_s0_raw = self.coreg_data[3]
-        # s0_dyn = self.coreg_data[4]
-        # m_obj_raw = self.coreg_data[5]
-        # r_obj_img = self.coreg_data[6]
-        # obj_ref_mode = self.coreg_data[7]
-        #
-        # trck_init = self.trck_info[0]
-        # trck_id = self.trck_info[1]
-        # trck_mode = self.trck_info[2]
-
-        m_change, obj_ref_mode, t_obj_raw, s0_raw, r_s0_raw, s0_dyn, m_obj_raw, r_obj_img = self.coreg_data
-        trck_init, trck_id, trck_mode = self.trck_info
-
-        while self.nav_id:
-            coord_raw = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-
-            as1, bs1, gs1 = radians(coord_raw[obj_ref_mode, 3:])
-            r_probe = asmatrix(tr.euler_matrix(as1, bs1, gs1, 'rzyx'))
-            t_probe_raw = asmatrix(tr.translation_matrix(coord_raw[obj_ref_mode, :3]))
-            t_offset_aux = r_s0_raw.I * r_probe * t_obj_raw
-            t_offset = asmatrix(identity(4))
-            t_offset[:, -1] = t_offset_aux[:, -1]
-            t_probe = s0_raw * t_offset * s0_raw.I * t_probe_raw
-            m_probe = asmatrix(tr.concatenate_matrices(t_probe, r_probe))
+    def Coregister(self, coord_raw):
+        probe = coord_raw[self.maths.obj_ref_mode][newaxis]
+        m_img, coord = self.maths.object_static(probe)
+        m_img = asmatrix(m_img[0])
+        coord = tuple(coord[0])
 
-            m_probe[2, -1] = -m_probe[2, -1]
+        return [('Co-registered points', (m_img, coord)),
+                ('Update object matrix', (m_img, coord))]
 
-            m_img = m_change * m_probe
-            r_obj = r_obj_img * m_obj_raw.I * s0_dyn.I * m_probe * m_obj_raw
 
-            m_img[:3, :3] = r_obj[:3, :3]
-
-            scale, shear, angles, trans, persp = tr.decompose_matrix(m_img)
-
-            coord = m_img[0, -1], m_img[1, -1], m_img[2, -1], \
-                    degrees(angles[0]), degrees(angles[1]), degrees(angles[2])
-
-            wx.CallAfter(Publisher.sendMessage, 'Co-registered points', (m_img, coord))
-            wx.CallAfter(Publisher.sendMessage, 'Update object matrix', (m_img, coord))
-
-            # TODO: Optimize the value of sleep for each tracking device.
-            sleep(0.175)
-
-            # Debug tracker is not working with 0.175 so changed to 0.2
-            # However, 0.2 is too low update frequency ~5 Hz. Need optimization URGENTLY.
-            # sleep(.3)
-
-            # partially working for translate and offset,
-            # but offset is kept always in same axis, have to fix for rotation
-            # M_dyn = M_reference.I * T_stylus
-            # M_dyn[2, -1] = -M_dyn[2, -1]
-            # M_dyn_ch = M_change * M_dyn
-            # ddd = M_dyn_ch[0, -1], M_dyn_ch[1, -1], M_dyn_ch[2, -1]
-            # M_dyn_ch[:3, -1] = asmatrix(db.flip_x_m(ddd)).reshape([3, 1])
-            # M_final = S0 * M_obj_trans_0 * S0.I * M_dyn_ch
-
-            # this works for static reference object rotation
-            # R_dyn = M_vtk * M_obj_rot_raw.I * S0_rot_raw.I * R_stylus * M_obj_rot_raw
-            # this works for dynamic reference in rotation but not in translation
-            # R_dyn = M_vtk * M_obj_rot_raw.I * S0_rot_dyn.I * R_reference.I * R_stylus * M_obj_rot_raw
-
-            if self._pause_:
-                return
-
-
-class CoregistrationObjectDynamic(threading.Thread):
+class CoregistrationObjectDynamic(Coregistration):
     """
-    Thread to update the coordinates with the fiducial points
-    co-registration method while the Navigation Button is pressed.
-    Sleep function in run method is used to avoid blocking GUI and
-    for better real-time navigation
+    Co-registration of the tracked object with the fiducial points and a
+    dynamic reference.
     """
 
-    def __init__(self, coreg_data, nav_id, trck_info):
-        threading.Thread.__init__(self)
-        self.coreg_data = coreg_data
-        self.nav_id = nav_id
-        self.trck_info = trck_info
-        self._pause_ = False
-        self.start()
-
-    def stop(self):
-        self._pause_ = True
-
-    def run(self):
-
-        m_change, obj_ref_mode, t_obj_raw, s0_raw, r_s0_raw, s0_dyn, m_obj_raw, r_obj_img = self.coreg_data
-        trck_init, trck_id, trck_mode = self.trck_info
-
-        while self.nav_id:
-            coord_raw = dco.GetCoordinates(trck_init, trck_id, trck_mode)
-
-            as1, bs1, gs1 = radians(coord_raw[obj_ref_mode, 3:])
-            r_probe = asmatrix(tr.euler_matrix(as1, bs1, gs1, 'rzyx'))
-            t_probe_raw = asmatrix(tr.translation_matrix(coord_raw[obj_ref_mode, :3]))
-            t_offset_aux = r_s0_raw.I * r_probe * t_obj_raw
-            t_offset = asmatrix(identity(4))
-            t_offset[:, -1] = t_offset_aux[:, -1]
-            t_probe = s0_raw * t_offset * s0_raw.I * t_probe_raw
-            m_probe = asmatrix(tr.concatenate_matrices(t_probe, r_probe))
-
-            a, b, g = radians(coord_raw[1, 3:])
-            r_ref = tr.euler_matrix(a, b, g, 'rzyx')
-            t_ref = tr.translation_matrix(coord_raw[1, :3])
-            m_ref = asmatrix(tr.concatenate_matrices(t_ref, r_ref))
-
-            m_dyn = m_ref.I * m_probe
-            m_dyn[2, -1] = -m_dyn[2, -1]
-
-            m_img = m_change * m_dyn
-            r_obj = r_obj_img * m_obj_raw.I * s0_dyn.I * m_dyn * m_obj_raw
-
-            m_img[:3, :3] = r_obj[:3, :3]
-
-            scale, shear, angles, trans, persp = tr.decompose_matrix(m_img)
-
-            coord = m_img[0, -1], m_img[1, -1], m_img[2, -1],\
-                    degrees(angles[0]), degrees(angles[1]), degrees(angles[2])
-
-            wx.CallAfter(Publisher.sendMessage, 'Co-registered points', (m_img, coord))
-            wx.CallAfter(Publisher.sendMessage, 'Update object matrix', (m_img, coord))
-
-            # TODO: Optimize the value of sleep for each tracking device.
-            sleep(0.175)
-
-            # Debug tracker is not working with 0.175 so changed to 0.2
-            # However, 0.2 is too low update frequency ~5 Hz. Need optimization URGENTLY.
-            # sleep(.3)
-
-            # partially working for translate and offset,
-            # but offset is kept always in same axis, have to fix for rotation
-            # M_dyn = M_reference.I * T_stylus
-            # M_dyn[2, -1] = -M_dyn[2, -1]
-            # M_dyn_ch = M_change * M_dyn
-            # ddd = M_dyn_ch[0, -1], M_dyn_ch[1, -1], M_dyn_ch[2, -1]
-            # M_dyn_ch[:3, -1] = asmatrix(db.flip_x_m(ddd)).reshape([3, 1])
-            # M_final = S0 * M_obj_trans_0 * S0.I * M_dyn_ch
-
-            # this works for static reference object rotation
-            # R_dyn = M_vtk * M_obj_rot_raw.I * S0_rot_raw.I * R_stylus * M_obj_rot_raw
-            # this works for dynamic reference in rotation but not in translation
-            # R_dyn = M_vtk * M_obj_rot_raw.I * S0_rot_dyn.I * R_reference.I * R_stylus * M_obj_rot_raw
+    def Coregister(self, coord_raw):
+        probe = coord_raw[self.maths.obj_ref_mode][newaxis]
+        reference = coord_raw[1][newaxis]
+        m_img, coord = self.maths.object_dynamic(probe, reference)
+        m_img = asmatrix(m_img[0])
+        coord = tuple(coord[0])
 
-            if self._pause_:
-                return
\ No newline at end of file
+        return [('Co-registered points', (m_img, coord)),
+                ('Update object matrix', (m_img, coord))]
@@ -8,18 +8,15 @@
 import sys
 import time
 cimport numpy as np
+cimport openmp
 
 from libc.math cimport sin, cos, acos, exp, sqrt, fabs, M_PI
-from libc.stdlib cimport abs as cabs
+from libc.stdlib cimport abs as cabs, malloc, free
 from cython.operator cimport dereference as deref, preincrement as inc
-from libcpp.map cimport map
-from libcpp.unordered_map cimport unordered_map
-from libcpp.set cimport set
 from libcpp.vector cimport vector
-from libcpp.pair cimport pair
 from libcpp cimport bool
-from libcpp.deque cimport deque as cdeque
 from cython.parallel import prange
+from cython.parallel cimport threadid
 
 from cy_my_types cimport vertex_t, normal_t, vertex_id_t
 
@@ -30,12 +27,61 @@ from vtk.util import numpy_support
 
 ctypedef float weight_t
 
+# Number of locks guarding the weights in calc_artifacts_weight, vertex v
+# uses the lock v % N_WEIGHT_LOCKS.
+DEF N_WEIGHT_LOCKS = 1024
+
 cdef struct Point:
     vertex_t x
     vertex_t y
     vertex_t z
 
-ctypedef pair[vertex_id_t, vertex_id_t] key
+
+def build_adjacency(faces, int nvertices):
+    """
+    Builds the adjacency of a triangle mesh in CSR form (an offsets array
+    and an ids array, the items of the vertex v are
+    ids[offsets[v]:offsets[v+1]]).
+
+    Returns the faces of each vertex, the vertices of its ring1 and a flag
+    telling if the vertex is in the border (it's part of an edge used by
+    only one face).
+    """
+    faces = np.asarray(faces)
+    id_type = faces.dtype
+    triangles = faces[:, 1:].astype('int64')
+    nfaces = triangles.shape[0]
+
+    # vertex -> faces
+    order = np.argsort(triangles.ravel(), kind='mergesort')
+    vface_ids = (order // 3).astype(id_type)
+    vface_offsets = np.zeros(nvertices + 1, dtype=id_type)
+    np.cumsum(np.bincount(triangles.ravel(), minlength=nvertices),
+              out=vface_offsets[1:])
+
+    # Edges as keys min * nvertices + max, each one appearing once per face
+    # using it.
+    a = np.concatenate((triangles[:, 0], triangles[:, 1], triangles[:, 2]))
+    b = np.concatenate((triangles[:, 1], triangles[:, 2], triangles[:, 0]))
+    edges, nfaces_edge = np.unique(np.minimum(a, b) * nvertices + np.maximum(a, b),
+                                   return_counts=True)
+    del a, b
+    lo = edges // nvertices
+    hi = edges % nvertices
+
+    border = np.zeros(nvertices, dtype='uint8')
+    border[lo[nfaces_edge == 1]] = 1
+    border[hi[nfaces_edge == 1]] = 1
+
+    # vertex -> ring1, each edge in both directions.
+    src = np.concatenate((lo, hi))
+    dst = np.concatenate((hi, lo))
+    order = np.argsort(src, kind='mergesort')
+    ring_ids = dst[order].astype(id_type)
+    ring_offsets = np.zeros(nvertices + 1, dtype=id_type)
+    np.cumsum(np.bincount(src, minlength=nvertices), out=ring_offsets[1:])
+
+    return vface_offsets, vface_ids, ring_offsets, ring_ids, border
 
 
 cdef class Mesh:
@@ -43,15 +89,16 @@ cdef class Mesh:
     cdef vertex_id_t[:, :] faces
     cdef normal_t[:, :] normals
 
-    cdef unordered_map[int, vector[vertex_id_t]] map_vface
-    cdef unordered_map[vertex_id_t, int] border_vertices
+    # Adjacency in CSR form, see build_adjacency.
+    cdef vertex_id_t[:] vface_offsets
+    cdef vertex_id_t[:] vface_ids
+    cdef vertex_id_t[:] ring_offsets
+    cdef vertex_id_t[:] ring_ids
+    cdef np.uint8_t[:] border_vertices
 
     cdef bool _initialized
 
     def __cinit__(self, pd=None, other=None):
-        cdef int i
-        cdef map[key, int] edge_nfaces
-        cdef map[key, int].iterator it
         if pd:
             self._initialized = True
             _vertices = numpy_support.vtk_to_numpy(pd.GetPoints().GetData())
@@ -67,23 +114,9 @@ cdef class Mesh:
             self.faces = _faces
             self.normals = _normals
 
-            for i in xrange(_faces.shape[0]):
-                self.map_vface[self.faces[i, 1]].push_back(i)
-                self.map_vface[self.faces[i, 2]].push_back(i)
-                self.map_vface[self.faces[i, 3]].push_back(i)
-
-                edge_nfaces[key(min(self.faces[i, 1], self.faces[i, 2]), max(self.faces[i, 1], self.faces[i, 2]))] += 1
-                edge_nfaces[key(min(self.faces[i, 2], self.faces[i, 3]), max(self.faces[i, 2], self.faces[i, 3]))] += 1
-                edge_nfaces[key(min(self.faces[i, 1], self.faces[i, 3]), max(self.faces[i, 1], self.faces[i, 3]))] += 1
-
-            it = edge_nfaces.begin()
-
-            while it != edge_nfaces.end():
-                if deref(it).second == 1:
-                    self.border_vertices[deref(it).first.first] = 1
-                    self.border_vertices[deref(it).first.second] = 1
-
-                inc(it)
+            self.vface_offsets, self.vface_ids, self.ring_offsets, \
+                    self.ring_ids, self.border_vertices = \
+                    build_adjacency(_faces, _vertices.shape[0])
 
         elif other:
             _other = <Mesh>other
@@ -91,11 +124,20 @@ cdef class Mesh:
             self.vertices = _other.vertices.copy()
             self.faces = _other.faces.copy()
             self.normals = _other.normals.copy()
-            self.map_vface = unordered_map[int, vector[vertex_id_t]](_other.map_vface)
-            self.border_vertices = unordered_map[vertex_id_t, int](_other.border_vertices)
+            self._copy_adjacency(_other)
         else:
             self._initialized = False
 
+    cdef void _copy_adjacency(self, Mesh other):
+        """
+        Copies the adjacency of other to self.
+        """
+        self.vface_offsets = other.vface_offsets.copy()
+        self.vface_ids = other.vface_ids.copy()
+        self.ring_offsets = other.ring_offsets.copy()
+        self.ring_ids = other.ring_ids.copy()
+        self.border_vertices = other.border_vertices.copy()
+
     cdef void copy_to(self, Mesh other):
         """
         Copies self content to other.
@@ -104,15 +146,11 @@ cdef class Mesh:
             other.vertices[:] = self.vertices
             other.faces[:] = self.faces
             other.normals[:] = self.normals
-            other.map_vface = unordered_map[int, vector[vertex_id_t]](self.map_vface)
-            other.border_vertices = unordered_map[vertex_id_t, int](self.border_vertices)
         else:
             other.vertices = self.vertices.copy()
             other.faces = self.faces.copy()
             other.normals = self.normals.copy()
-
-            other.map_vface = self.map_vface
-            other.border_vertices = self.border_vertices
+        other._copy_adjacency(self)
 
     def to_vtk(self):
         """
@@ -120,12 +158,12 @@ cdef class Mesh:
         """
         vertices = np.asarray(self.vertices)
         faces = np.asarray(self.faces)
-        normals = np.asarray(self.normals)
 
+        # The arrays are copied, the polydata must not depend on the mesh.
         points = vtk.vtkPoints()
-        points.SetData(numpy_support.numpy_to_vtk(vertices))
+        points.SetData(numpy_support.numpy_to_vtk(vertices, deep=1))
 
-        id_triangles = numpy_support.numpy_to_vtkIdTypeArray(faces)
+        id_triangles = numpy_support.numpy_to_vtkIdTypeArray(faces, deep=1)
         triangles = vtk.vtkCellArray()
         triangles.SetCells(faces.shape[0], id_triangles)
 
@@ -135,92 +173,63 @@ cdef class Mesh:
 
         return pd
 
-    cdef vector[vertex_id_t]* get_faces_by_vertex(self, int v_id) nogil:
-        """
-        Returns the faces whose vertex `v_id' is part.
-        """
-        return &self.map_vface[v_id]
-
-    cdef set[vertex_id_t]* get_ring1(self, vertex_id_t v_id) nogil:
-        """
-        Returns the ring1 of vertex `v_id'
-        """
-        cdef vertex_id_t f_id
-        cdef set[vertex_id_t]* ring1 = new set[vertex_id_t]()
-        cdef vector[vertex_id_t].iterator it = self.map_vface[v_id].begin()
-
-        while it != self.map_vface[v_id].end():
-            f_id = deref(it)
-            inc(it)
-            if self.faces[f_id, 1] != v_id:
-                ring1.insert(self.faces[f_id, 1])
-            if self.faces[f_id, 2] != v_id:
-                ring1.insert(self.faces[f_id, 2])
-            if self.faces[f_id, 3] != v_id:
-                ring1.insert(self.faces[f_id, 3])
-
-        return ring1
-
     cdef bool is_border(self, vertex_id_t v_id) nogil:
         """
         Check if vertex `v_id' is a vertex border.
         """
-        return self.border_vertices.find(v_id) != self.border_vertices.end()
+        return self.border_vertices[v_id] != 0
 
-    cdef vector[vertex_id_t]* get_near_vertices_to_v(self, vertex_id_t v_id, float dmax) nogil:
+    cdef void get_near_vertices_to_v(self, vertex_id_t v_id, float dmax,
+                                     vector[vertex_id_t]* near_vertices,
+                                     np.uint8_t* visited) nogil:
         """
-        Returns all vertices with distance at most `d' to the vertex `v_id'
+        Puts in near_vertices all vertices with distance at most `dmax' to
+        the vertex `v_id' and reachable from it only through such
+        vertices. `v_id' itself is the first one.
 
         Params:
             v_id: id of the vertex
             dmax: the maximun distance.
+            near_vertices: output, its previous content is discarded.
+            visited: scratch flags, one bit per vertex (vertex v is bit
+                     v % 8 of visited[v / 8]). They must be all 0 and are
+                     left all 0.
         """
-        cdef vector[vertex_id_t]* idfaces
-        cdef vector[vertex_id_t]* near_vertices = new vector[vertex_id_t]()
-
-        cdef cdeque[vertex_id_t] to_visit
-        cdef unordered_map[vertex_id_t, bool] status_v
-        cdef unordered_map[vertex_id_t, bool] status_f
-
         cdef vertex_t *vip
         cdef vertex_t *vjp
 
         cdef float distance
-        cdef int nf, nid, j
-        cdef vertex_id_t f_id, vj
+        cdef size_t head, k
+        cdef vertex_id_t vi, vj
 
         vip = &self.vertices[v_id, 0]
-        to_visit.push_back(v_id)
-        while(not to_visit.empty()):
-            v_id = to_visit.front()
-            to_visit.pop_front()
 
-            status_v[v_id] = True
-
-            idfaces = self.get_faces_by_vertex(v_id)
-            nf = idfaces.size()
-
-            for nid in xrange(nf):
-                f_id = deref(idfaces)[nid]
-                if status_f.find(f_id) == status_f.end():
-                    status_f[f_id] = True
-
-                    for j in xrange(3):
-                        vj = self.faces[f_id, j+1]
-                        if status_v.find(vj) == status_v.end():
-                            status_v[vj] = True
-                            vjp = &self.vertices[vj, 0]
-                            distance = sqrt((vip[0] - vjp[0]) * (vip[0] - vjp[0]) \
-                                          + (vip[1] - vjp[1]) * (vip[1] - vjp[1]) \
-                                          + (vip[2] - vjp[2]) * (vip[2] - vjp[2]))
-                            if distance <= dmax:
-                                near_vertices.push_back(vj)
-                                to_visit.push_back(vj)
-
-        return near_vertices
-
-
-cdef vector[weight_t]* calc_artifacts_weight(Mesh mesh, vector[vertex_id_t]& vertices_staircase, float tmax, float bmin) nogil:
+        # near_vertices is the queue of the breadth-first search as well.
+        near_vertices.clear()
+        near_vertices.push_back(v_id)
+        visited[v_id >> 3] |= 1 << (v_id & 7)
+        head = 0
+        while head < near_vertices.size():
+            vi = deref(near_vertices)[head]
+            head += 1
+
+            for k in xrange(self.ring_offsets[vi], self.ring_offsets[vi + 1]):
+                vj = self.ring_ids[k]
+                if not visited[vj >> 3] & (1 << (vj & 7)):
+                    vjp = &self.vertices[vj, 0]
+                    distance = sqrt((vip[0] - vjp[0]) * (vip[0] - vjp[0]) \
+                                  + (vip[1] - vjp[1]) * (vip[1] - vjp[1]) \
+                                  + (vip[2] - vjp[2]) * (vip[2] - vjp[2]))
+                    if distance <= dmax:
+                        visited[vj >> 3] |= 1 << (vj & 7)
+                        near_vertices.push_back(vj)
+
+        for k in xrange(near_vertices.size()):
+            vi = deref(near_vertices)[k]
+            visited[vi >> 3] = 0
+
+
+cdef weight_t[:] calc_artifacts_weight(Mesh mesh, vertex_id_t[:] vertices_staircase, float tmax, float bmin):
     """
     Calculate the artifact weight based on distance of each vertex to its
     nearest staircase artifact vertex.
@@ -232,30 +241,45 @@ cdef vector[weight_t]* calc_artifacts_weight(Mesh mesh, vector[vertex_id_t]& ver
               to considered to calculate the weight
         bmin: The minimun weight.
     """
-    cdef int vi_id, vj_id, nnv, n_ids, i, j
-    cdef vector[vertex_id_t]* near_vertices
+    cdef int vi_id, vj_id, nnv, n_ids, i, j, tid
     cdef weight_t value
     cdef float d
-    n_ids = vertices_staircase.size()
+    n_ids = vertices_staircase.shape[0]
 
     cdef vertex_t* vi
     cdef vertex_t* vj
-    cdef size_t msize
-
-    msize = mesh.vertices.shape[0]
-    cdef vector[weight_t]* weights = new vector[weight_t](msize)
-    weights.assign(msize, bmin)
-
-    for i in prange(n_ids, nogil=True):
+    cdef int msize = mesh.vertices.shape[0]
+    cdef int nthreads = openmp.omp_get_max_threads()
+
+    # Each thread has its own scratch buffers (visited is a bitset, so
+    # they're small), the weights are shared. A weight only grows, so it
+    # is only locked when the new value is bigger than the one read.
+    cdef vector[vector[vertex_id_t]] near_vertices = vector[vector[vertex_id_t]](nthreads)
+    cdef np.uint8_t[:, :] visited = np.zeros((nthreads, msize // 8 + 1), dtype='uint8')
+    _weights = np.empty(msize, dtype='float32')
+    _weights[:] = bmin
+    cdef weight_t[:] weights = _weights
+    cdef openmp.omp_lock_t *locks = <openmp.omp_lock_t*> malloc(N_WEIGHT_LOCKS * sizeof(openmp.omp_lock_t))
+    if locks == NULL:
+        raise MemoryError()
+    for i in xrange(N_WEIGHT_LOCKS):
+        openmp.omp_init_lock(&locks[i])
+
+    # 1.0 is the biggest weight.
+    for i in xrange(n_ids):
+        weights[vertices_staircase[i]] = 1.0
+
+    for i in prange(n_ids, nogil=True, num_threads=nthreads):
+        tid = threadid()
         vi_id = vertices_staircase[i]
-        deref(weights)[vi_id] = 1.0
 
         vi = &mesh.vertices[vi_id, 0]
-        near_vertices = mesh.get_near_vertices_to_v(vi_id, tmax)
-        nnv = near_vertices.size()
+        mesh.get_near_vertices_to_v(vi_id, tmax, &near_vertices[tid],
+                                    &visited[tid, 0])
+        nnv = near_vertices[tid].size()
 
-        for j in xrange(nnv):
-            vj_id = deref(near_vertices)[j]
+        for j in xrange(1, nnv):
+            vj_id = near_vertices[tid][j]
             vj = &mesh.vertices[vj_id, 0]
 
             d = sqrt((vi[0] - vj[0]) * (vi[0] - vj[0])\
@@ -263,82 +287,52 @@ cdef vector[weight_t]* calc_artifacts_weight(Mesh mesh, vector[vertex_id_t]& ver
                    + (vi[2] - vj[2]) * (vi[2] - vj[2]))
             value = (1.0 - d/tmax) * (1.0 - bmin) + bmin
 
-            if value > deref(weights)[vj_id]:
-                deref(weights)[vj_id] = value
-
-        del near_vertices
+            if value > weights[vj_id]:
+                openmp.omp_set_lock(&locks[vj_id % N_WEIGHT_LOCKS])
+                if value > weights[vj_id]:
+                    weights[vj_id] = value
+                openmp.omp_unset_lock(&locks[vj_id % N_WEIGHT_LOCKS])
 
-    #  for i in xrange(msize):
-        #  if mesh.is_border(i):
-            #  deref(weights)[i] = 0.0
-
-    #  cdef vertex_id_t v0, v1, v2
-    #  for i in xrange(mesh.faces.shape[0]):
-        #  for j in xrange(1, 4):
-            #  v0 = mesh.faces[i, j]
-            #  vi = &mesh.vertices[v0, 0]
-            #  if mesh.is_border(v0):
-                #  deref(weights)[v0] = 0.0
-                #  v1 = mesh.faces[i, (j + 1) % 3 + 1]
-                #  if mesh.is_border(v1):
-                    #  vi = &mesh.vertices[v1, 0]
-                    #  deref(weights)[v0] = 0.0
+    for i in xrange(N_WEIGHT_LOCKS):
+        openmp.omp_destroy_lock(&locks[i])
+    free(locks)
 
     return weights
 
 
 cdef inline Point calc_d(Mesh mesh, vertex_id_t v_id) nogil:
     cdef Point D
-    cdef int nf, f_id, nid
     cdef float n=0
-    cdef int i
     cdef vertex_t* vi
     cdef vertex_t* vj
-    cdef set[vertex_id_t]* vertices
-    cdef set[vertex_id_t].iterator it
-    cdef vertex_id_t vj_id
+    cdef vertex_id_t vj_id, k
+    cdef bool border = mesh.is_border(v_id)
 
     D.x = 0.0
     D.y = 0.0
     D.z = 0.0
 
-    vertices = mesh.get_ring1(v_id)
     vi = &mesh.vertices[v_id, 0]
 
-    if mesh.is_border(v_id):
-        it = vertices.begin()
-        while it != vertices.end():
-            vj_id = deref(it)
-            if mesh.is_border(vj_id):
-                vj = &mesh.vertices[vj_id, 0]
-
-                D.x = D.x + (vi[0] - vj[0])
-                D.y = D.y + (vi[1] - vj[1])
-                D.z = D.z + (vi[2] - vj[2])
-                n += 1.0
-
-            inc(it)
-    else:
-        it = vertices.begin()
-        while it != vertices.end():
-            vj_id = deref(it)
-            vj = &mesh.vertices[vj_id, 0]
-
-            D.x = D.x + (vi[0] - vj[0])
-            D.y = D.y + (vi[1] - vj[1])
-            D.z = D.z + (vi[2] - vj[2])
-            n += 1.0
-
-            inc(it)
-
-    del vertices
-
-    D.x = D.x / n
-    D.y = D.y / n
-    D.z = D.z / n
+    # A border vertex is only moved along the border.
+    for k in xrange(mesh.ring_offsets[v_id], mesh.ring_offsets[v_id + 1]):
+        vj_id = mesh.ring_ids[k]
+        if border and not mesh.is_border(vj_id):
+            continue
+        vj = &mesh.vertices[vj_id, 0]
+
+        D.x = D.x + (vi[0] - vj[0])
+        D.y = D.y + (vi[1] - vj[1])
+        D.z = D.z + (vi[2] - vj[2])
+        n += 1.0
+
+    if n > 0:
+        D.x = D.x / n
+        D.y = D.y / n
+        D.z = D.z / n
     return D
 
-cdef vector[vertex_id_t]* find_staircase_artifacts(Mesh mesh, double[3] stack_orientation, double T) nogil:
+cdef vertex_id_t[:] find_staircase_artifacts(Mesh mesh, double[3] stack_orientation, double T):
     """
     This function is used to find vertices at staircase artifacts, which are
     those vertices whose incident faces' orientation differences are
@@ -350,17 +344,19 @@ cdef vector[vertex_id_t]* find_staircase_artifacts(Mesh mesh, double[3] stack_or
         T: Min angle (between vertex faces and stack_orientation) to consider a
            vertex a staircase artifact.
     """
-    cdef int nv, nf, f_id, v_id
+    cdef int nv, f_id, v_id
+    cdef vertex_id_t k
     cdef double of_z, of_y, of_x, min_z, max_z, min_y, max_y, min_x, max_x;
-    cdef vector[vertex_id_t]* f_ids
     cdef normal_t* normal
-
-    cdef vector[vertex_id_t]* output = new vector[vertex_id_t]()
-    cdef int i
+    cdef double sx = stack_orientation[0]
+    cdef double sy = stack_orientation[1]
+    cdef double sz = stack_orientation[2]
 
     nv = mesh.vertices.shape[0]
+    _is_staircase = np.zeros(nv, dtype='uint8')
+    cdef np.uint8_t[:] is_staircase = _is_staircase
 
-    for v_id in xrange(nv):
+    for v_id in prange(nv, nogil=True):
         max_z = -10000
         min_z = 10000
         max_y = -10000
@@ -368,14 +364,11 @@ cdef vector[vertex_id_t]* find_staircase_artifacts(Mesh mesh, double[3] stack_or
         max_x = -10000
         min_x = 10000
 
-        f_ids = mesh.get_faces_by_vertex(v_id)
-        nf = deref(f_ids).size()
-
-        for i in xrange(nf):
-            f_id = deref(f_ids)[i]
+        for k in xrange(mesh.vface_offsets[v_id], mesh.vface_offsets[v_id + 1]):
+            f_id = mesh.vface_ids[k]
             normal = &mesh.normals[f_id, 0]
 
-            of_z = 1 - fabs(normal[0]*stack_orientation[0] + normal[1]*stack_orientation[1] + normal[2]*stack_orientation[2]);
+            of_z = 1 - fabs(normal[0]*sx + normal[1]*sy + normal[2]*sz);
             of_y = 1 - fabs(normal[0]*0 + normal[1]*1 + normal[2]*0);
             of_x = 1 - fabs(normal[0]*1 + normal[1]*0 + normal[2]*0);
 
@@ -399,12 +392,13 @@ cdef vector[vertex_id_t]* find_staircase_artifacts(Mesh mesh, double[3] stack_or
 
 
             if ((fabs(max_z - min_z) >= T) or (fabs(max_y - min_y) >= T) or (fabs(max_x - min_x) >= T)):
-                output.push_back(v_id)
+                is_staircase[v_id] = 1
                 break
-    return output
+
+    return np.nonzero(_is_staircase)[0].astype(np.asarray(mesh.faces).dtype)
 
 
-cdef void taubin_smooth(Mesh mesh, vector[weight_t]& weights, float l, float m, int steps):
+cdef void taubin_smooth(Mesh mesh, weight_t[:] weights, float l, float m, int steps):
     """
     Implementation of Taubin's smooth algorithm described in the paper "A
     Signal Processing Approach To Fair Surface Design". His benefeat is it
@@ -412,8 +406,9 @@ cdef void taubin_smooth(Mesh mesh, vector[weight_t]& weights, float l, float m,
     """
     cdef int s, i, nvertices
     nvertices = mesh.vertices.shape[0]
-    cdef vector[Point] D = vector[Point](nvertices)
-    cdef vertex_t* vi
+    cdef Point[:] D = np.empty(nvertices, dtype=[('x', 'float32'),
+                                                 ('y', 'float32'),
+                                                 ('z', 'float32')])
     for s in xrange(steps):
         for i in prange(nvertices, nogil=True):
             D[i] = calc_d(mesh, i)
@@ -446,21 +441,25 @@ def ca_smoothing(Mesh mesh, double T, double tmax, double bmin, int n_iters):
               to considered to calculate the weight
         bmin: The minimun weight
         n_iters: Number of iterations.
+
+    Returns the smoothed mesh as a vtkPolyData.
     """
     cdef double[3] stack_orientation = [0.0, 0.0, 1.0]
 
     t0 = time.time()
-    cdef vector[vertex_id_t]* vertices_staircase =  find_staircase_artifacts(mesh, stack_orientation, T)
+    cdef vertex_id_t[:] vertices_staircase =  find_staircase_artifacts(mesh, stack_orientation, T)
     print "vertices staircase", time.time() - t0
 
     t0 = time.time()
-    cdef vector[weight_t]* weights = calc_artifacts_weight(mesh, deref(vertices_staircase), tmax, bmin)
+    cdef weight_t[:] weights = calc_artifacts_weight(mesh, vertices_staircase, tmax, bmin)
     print "Weights", time.time() - t0
 
     del vertices_staircase
 
     t0 = time.time()
-    taubin_smooth(mesh, deref(weights), 0.5, -0.53, n_iters)
+    taubin_smooth(mesh, weights, 0.5, -0.53, n_iters)
     print "taubin", time.time() - t0
 
     del weights
+
+    return mesh.to_vtk()
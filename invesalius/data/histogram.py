@@ -0,0 +1,171 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Histogram of the slice matrix, shared by the CLUT widgets (the raycasting
+one and the slice one).
+
+The histogram has one bin per grey level, from the minimum to the maximum
+of the matrix, and is kept for the current matrix generation (see
+Slice.matrix_generation). While the full histogram is not ready a coarse
+one, counting one voxel in each COARSE_STEP in each axis, is given. The
+full one is counted with numpy.bincount, slab by slab, in a thread and
+'Update histogram' is sent when it's done.
+"""
+
+import threading
+
+import numpy as np
+import wx
+from six import with_metaclass
+from wx.lib.pubsub import pub as Publisher
+
+import invesalius.utils as utils
+
+# Number of voxels counted at once.
+SLAB_SIZE = 2 ** 22
+
+# The coarse histogram counts one voxel in each COARSE_STEP in each axis.
+COARSE_STEP = 4
+
+
+def coarse_histogram(matrix, step=COARSE_STEP):
+    """
+    Returns the histogram of one voxel in each step in each axis of matrix,
+    as (counts, (init, end)). Each voxel counted stands for step**3 voxels.
+    """
+    sample = np.asarray(matrix[::step, ::step, ::step], dtype='int64')
+    init = int(sample.min())
+    end = int(sample.max())
+    counts = np.bincount((sample - init).ravel(), minlength=end - init + 1)
+    counts *= step ** 3
+    return counts, (init, end)
+
+
+def full_histogram(matrix, cancel=None):
+    """
+    Returns the histogram of matrix as (counts, (init, end)), or None if
+    cancel (a threading.Event) is set meanwhile.
+    """
+    slabs = list(utils.slabs(matrix.shape, SLAB_SIZE))
+
+    init = end = None
+    for zi, zf in slabs:
+        if cancel is not None and cancel.is_set():
+            return None
+        slab = matrix[zi:zf]
+        vmin = int(slab.min())
+        vmax = int(slab.max())
+        init = vmin if init is None else min(init, vmin)
+        end = vmax if end is None else max(end, vmax)
+
+    counts = np.zeros(end - init + 1, dtype='int64')
+    for zi, zf in slabs:
+        if cancel is not None and cancel.is_set():
+            return None
+        values = np.asarray(matrix[zi:zf], dtype='int64').ravel()
+        values -= init
+        counts += np.bincount(values, minlength=counts.size)
+    return counts, (init, end)
+
+
+class SliceHistogram(with_metaclass(utils.Singleton, object)):
+    """
+    Keeps the histogram of the slice matrix. Compute is called each time
+    the matrix changes, Get by the widgets showing the histogram.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel = None
+        self.key = None
+        self.counts = None
+        self.range = None
+        self.complete = False
+        Publisher.subscribe(self.OnCloseProject, 'Close project data')
+
+    def OnCloseProject(self, pubsub_evt):
+        with self._lock:
+            if self._cancel is not None:
+                self._cancel.set()
+                self._cancel = None
+            self.key = None
+            self.counts = None
+            self.range = None
+            self.complete = False
+
+    def Compute(self, matrix, key):
+        """
+        Starts counting the histogram of matrix, whose generation is key, in
+        a thread. Does nothing if it's already done or being done.
+        """
+        with self._lock:
+            if key == self.key:
+                return
+            if self._cancel is not None:
+                self._cancel.set()
+            cancel = self._cancel = threading.Event()
+            self.key = key
+            self.counts = None
+            self.range = None
+            self.complete = False
+
+        thread = threading.Thread(target=self._run, args=(matrix, key, cancel))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, matrix, key, cancel):
+        result = full_histogram(matrix, cancel)
+        if result is None:
+            return
+        counts, scalar_range = result
+        with self._lock:
+            if key != self.key:
+                return
+            self.counts = counts
+            self.range = scalar_range
+            self.complete = True
+            self._cancel = None
+        # Without GUI (running from the command line) there is no main loop
+        # to give the message to.
+        if wx.GetApp() is None:
+            Publisher.sendMessage('Update histogram', (counts, scalar_range))
+        else:
+            wx.CallAfter(Publisher.sendMessage, 'Update histogram',
+                         (counts, scalar_range))
+
+    def Get(self, matrix, key):
+        """
+        Returns the histogram of matrix, whose generation is key, as
+        (counts, (init, end)). If the full histogram is not ready a coarse
+        one is returned, the full one is sent with 'Update histogram'.
+        """
+        self.Compute(matrix, key)
+        with self._lock:
+            if self.counts is not None:
+                return self.counts, self.range
+
+        counts, scalar_range = coarse_histogram(matrix)
+        with self._lock:
+            if key != self.key:
+                return counts, scalar_range
+            # The full one may have been finished meanwhile.
+            if self.counts is None:
+                self.counts = counts
+                self.range = scalar_range
+            return self.counts, self.range
@@ -0,0 +1,241 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Automatic filling of mask holes.
+
+A hole is a connected component of the mask background (values <= 127)
+that doesn't touch the border of the region being processed. The region is
+labelled slab by slab with ndimage.label, the components split between two
+slabs are joined with a union-find and the size and border flag of each
+component are computed in the same pass.
+"""
+
+import numpy as np
+from scipy import ndimage
+
+import invesalius.data.mask_storage as mask_storage
+
+# Number of voxels labelled at once.
+SLAB_SIZE = 2 ** 24
+
+
+def _overlap(d, n):
+    """
+    Returns the slices a and b such that a[i] + d == b[i] with both inside
+    0:n.
+    """
+    return slice(max(0, -d), n - max(0, d)), slice(max(0, d), n + min(0, d))
+
+
+def _boundary_pairs(prev, cur, plane):
+    """
+    Returns the pairs of labels of prev (the last plane of a slab) and cur
+    (the first plane of the next slab) that are connected according to
+    plane, the part of the structuring element linking two planes.
+    """
+    cy = plane.shape[0] // 2
+    cx = plane.shape[1] // 2
+    a = []
+    b = []
+    for dy, dx in zip(*np.nonzero(plane)):
+        sy_cur, sy_prev = _overlap(int(dy) - cy, cur.shape[0])
+        sx_cur, sx_prev = _overlap(int(dx) - cx, cur.shape[1])
+        lc = cur[sy_cur, sx_cur].ravel()
+        lp = prev[sy_prev, sx_prev].ravel()
+        linked = (lc > 0) & (lp > 0)
+        a.append(lp[linked])
+        b.append(lc[linked])
+    a = np.concatenate(a)
+    b = np.concatenate(b)
+    if a.size:
+        pairs = np.unique((a.astype('int64') << 32) | b.astype('int64'))
+        a = (pairs >> 32).astype(cur.dtype)
+        b = (pairs & 0xffffffff).astype(cur.dtype)
+    return a, b
+
+
+def union_find(n, a, b):
+    """
+    Returns the root of each one of the n labels after joining every a[i]
+    with b[i]. The root of a component is its smallest label.
+
+    >>> union_find(5, np.array([1, 4]), np.array([3, 3])).tolist()
+    [0, 1, 2, 1, 1]
+    """
+    parent = np.arange(n)
+    while a.size:
+        ra = parent[a]
+        rb = parent[b]
+        different = ra != rb
+        if not different.any():
+            break
+        a = a[different]
+        b = b[different]
+        ra = ra[different]
+        rb = rb[different]
+
+        # Hooks the biggest root of each pair under the smallest one ...
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        # ... and compresses the paths, so parent holds roots again.
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+class HoleFiller(object):
+    """
+    Fills the holes with at most max_size voxels inside region (a tuple of
+    slices) of matrix. bstruct is the 3D structuring element defining the
+    connectivity; an axis where it has size 1 is not connected (that's how
+    a single slice is processed) and the region faces along it are not
+    taken as border.
+    """
+    def __init__(self, matrix, region, bstruct, max_size, slab_size=SLAB_SIZE):
+        self.matrix = matrix
+        self.max_size = max_size
+
+        bstruct = np.asarray(bstruct, dtype='bool')
+        self.linked_axes = [n == 3 for n in bstruct.shape]
+        # ndimage.label wants a 3x3x3 structure.
+        self.bstruct = np.zeros((3, 3, 3), dtype='bool')
+        self.bstruct[tuple(slice(None) if linked else slice(1, 2)
+                           for linked in self.linked_axes)] = bstruct
+
+        self.ranges = [k.indices(n)[:2] for k, n in zip(region, matrix.shape)]
+        self.shape = [f - i for i, f in self.ranges]
+        dz, dy, dx = self.shape
+        self.slab_depth = max(slab_size // max(dy * dx, 1), 1)
+
+    def slabs(self):
+        dz = self.shape[0]
+        for zi in range(0, dz, self.slab_depth):
+            yield zi, min(zi + self.slab_depth, dz)
+
+    def _key(self, zi, zf):
+        (z0, z1), (y0, y1), (x0, x1) = self.ranges
+        return (slice(z0 + zi, z0 + zf), slice(y0, y1), slice(x0, x1))
+
+    def _label(self, zi, zf):
+        background = np.asarray(self.matrix[self._key(zi, zf)]) <= 127
+        labels, nlabels = ndimage.label(background, self.bstruct,
+                                        output=np.int32)
+        return background, labels, nlabels
+
+    def find_holes(self):
+        """
+        Labels the region and returns a boolean array telling which labels
+        (numbered across all slabs) are holes to be filled.
+        """
+        linked_axes = self.linked_axes
+        sizes = [np.zeros(1, dtype='int64')]
+        border = []
+        pairs_a = []
+        pairs_b = []
+
+        offset = 0
+        prev = None
+        last_slab = self.shape[0] - 1
+        for zi, zf in self.slabs():
+            background, labels, nlabels = self._label(zi, zf)
+            labels[background] += offset
+
+            sizes.append(np.bincount(labels[background].ravel() - offset,
+                                     minlength=nlabels + 1)[1:])
+
+            faces = []
+            if linked_axes[0] and zi == 0:
+                faces.append(labels[0])
+            if linked_axes[0] and zf - 1 == last_slab:
+                faces.append(labels[-1])
+            if linked_axes[1]:
+                faces.extend((labels[:, 0], labels[:, -1]))
+            if linked_axes[2]:
+                faces.extend((labels[:, :, 0], labels[:, :, -1]))
+            for face in faces:
+                border.append(np.unique(face[face > 0]))
+
+            if prev is not None and linked_axes[0]:
+                a, b = _boundary_pairs(prev, labels[0], self.bstruct[0])
+                pairs_a.append(a)
+                pairs_b.append(b)
+            prev = labels[-1].copy()
+
+            offset += nlabels
+
+        n = offset + 1
+        if pairs_a:
+            roots = union_find(n, np.concatenate(pairs_a),
+                               np.concatenate(pairs_b))
+        else:
+            roots = np.arange(n)
+
+        root_sizes = np.bincount(roots, weights=np.concatenate(sizes),
+                                 minlength=n)
+        root_border = np.zeros(n, dtype='bool')
+        if border:
+            root_border[roots[np.concatenate(border)]] = True
+
+        holes = (root_sizes <= self.max_size) & ~root_border
+        holes[0] = False
+        return holes[roots]
+
+    def fill(self, value=254):
+        """
+        Fills the holes with value. Returns the coordinates (a 3xN array,
+        in matrix coordinates) of the filled voxels and their previous
+        values, or (None, None) if there was no hole to fill.
+        """
+        holes = self.find_holes()
+        if not holes.any():
+            return None, None
+
+        origin = np.array([i for i, f in self.ranges]).reshape(3, 1)
+        coords = []
+        values = []
+        offset = 0
+        for zi, zf in self.slabs():
+            background, labels, nlabels = self._label(zi, zf)
+            labels[background] += offset
+            offset += nlabels
+
+            to_fill = holes[labels]
+            if not to_fill.any():
+                continue
+
+            with mask_storage.edit_region(self.matrix, self._key(zi, zf)) as slab:
+                values.append(slab[to_fill])
+                slab[to_fill] = value
+
+            slab_coords = np.array(np.nonzero(to_fill), dtype='int32')
+            slab_coords[0] += zi
+            coords.append(slab_coords + origin)
+
+        return np.concatenate(coords, axis=1), np.concatenate(values)
+
+
+def fill_holes(matrix, region, bstruct, max_size, value=254,
+               slab_size=SLAB_SIZE):
+    """
+    Fills the holes inside region of matrix. See HoleFiller.
+    """
+    return HoleFiller(matrix, region, bstruct, max_size, slab_size).fill(value)
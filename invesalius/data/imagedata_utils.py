@@ -18,17 +18,20 @@
 #--------------------------------------------------------------------------
 
 import math
+import multiprocessing
 import os
 import sys
 import tempfile
 
+from concurrent import futures
+
 import gdcm
 import numpy
 import vtk
 import vtkgdcm
 from wx.lib.pubsub import pub as Publisher
 
-from scipy.ndimage import shift, zoom
+from scipy.ndimage import spline_filter1d, zoom
 from vtk.util import numpy_support
 
 import invesalius.constants as const
@@ -138,18 +141,102 @@ def read_dcm_slice_as_np(filename, resolution_percentage=1.0):
     return im_array
 
 
-def FixGantryTilt(matrix, spacing, tilt):
+# Number of voxels corrected at once by each thread in FixGantryTilt.
+GANTRY_TILT_SLAB_SIZE = 2 ** 22
+
+
+def _mirror_index(index, n):
+    """
+    Mirrors the indices outside 0:n about the borders (d c b | a b c d |
+    c b a), as scipy.ndimage does with mode 'mirror'.
+    """
+    if n == 1:
+        return numpy.zeros_like(index)
+    period = 2 * (n - 1)
+    index = numpy.abs(index) % period
+    return numpy.where(index >= n, period - index, index)
+
+
+def _interpolation_weights(f, order):
+    """
+    Returns the taps (offsets from floor of the sample position) and their
+    weights to sample at the fraction f with the linear (order 1) or the
+    cubic B-spline (order 3) interpolation.
+    """
+    if order == 1:
+        return (0, 1), (1.0 - f, f)
+    return (-1, 0, 1, 2), ((1.0 - f) ** 3 / 6.0,
+                           (3.0 * f**3 - 6.0 * f**2 + 4.0) / 6.0,
+                           (-3.0 * f**3 + 3.0 * f**2 + 3.0 * f + 1.0) / 6.0,
+                           f**3 / 6.0)
+
+
+def shift_rows(slab, shifts, order=3, cval=0.0):
     """
-    Fix gantry tilt given a vtkImageData and the tilt value. Return new
-    vtkImageData.
+    Shifts each slice of slab along the Y axis by shifts[n] pixels, the
+    same shift for every column, so it's a 1-D interpolation with weights
+    computed once per slice. The positions coming from outside the slice
+    get cval. Returns a float64 array.
+    """
+    dy = slab.shape[1]
+    y = numpy.arange(dy)
+    out = numpy.empty(slab.shape, dtype='float64')
+    for n, s in enumerate(shifts):
+        src = numpy.asarray(slab[n], dtype='float64')
+        if order == 3:
+            src = spline_filter1d(src, order=3, axis=0, mode='mirror')
+
+        position = -s
+        k = int(math.floor(position))
+        taps, weights = _interpolation_weights(position - k, order)
+
+        result = out[n]
+        result[:] = 0
+        for tap, weight in zip(taps, weights):
+            result += weight * src[_mirror_index(y + k + tap, dy)]
+
+        t = y + position
+        result[(t < 0) | (t > dy - 1)] = cval
+    return out
+
+
+def FixGantryTilt(matrix, spacing, tilt, order=3, n_workers=None):
+    """
+    Fix gantry tilt shifting, in place, each slice of matrix along the Y
+    axis according to the tilt value (in degrees). order is 1 (linear) or
+    3 (cubic) interpolation. The slabs of slices are corrected in a thread
+    pool, the positions from outside the image get its minimum.
     """
     angle = numpy.radians(tilt)
-    spacing = spacing[0], spacing[1], spacing[2]
     gntan = math.tan(angle)
+    cval = float(matrix.min())
 
-    for n, slice_ in enumerate(matrix):
-        offset = gntan * n * spacing[2]
-        matrix[n] = shift(slice_, (-offset/spacing[1], 0), cval=matrix.min())
+    dz, dy, dx = matrix.shape
+    depth = max(GANTRY_TILT_SLAB_SIZE // (dy * dx), 1)
+
+    if numpy.issubdtype(matrix.dtype, numpy.integer):
+        info = numpy.iinfo(matrix.dtype)
+        limits = info.min, info.max
+    else:
+        limits = None
+
+    def fix_slab(zi, zf):
+        shifts = [-gntan * n * spacing[2] / spacing[1] for n in range(zi, zf)]
+        shifted = shift_rows(matrix[zi:zf], shifts, order, cval)
+        if limits is not None:
+            numpy.rint(shifted, out=shifted)
+            numpy.clip(shifted, limits[0], limits[1], out=shifted)
+        matrix[zi:zf] = shifted
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    with futures.ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        jobs = [executor.submit(fix_slab, zi, min(zi + depth, dz))
+                for zi in range(0, dz, depth)]
+        for job in jobs:
+            # Re-raises the exceptions raised in the threads.
+            job.result()
 
 
 def BuildEditedImage(imagedata, points):
@@ -27,11 +27,11 @@ import numpy as np
 import vtk
 
 import invesalius.constants as const
+import invesalius.data.holes as holes
 import invesalius.data.imagedata_utils as iu
+import invesalius.data.mask_storage as mask_storage
 import invesalius.session as ses
 
-from . import floodfill
-
 from wx.lib.pubsub import pub as Publisher
 from scipy import ndimage
 
@@ -72,6 +72,38 @@ class EditionHistoryNode(object):
         os.remove(self.filename)
 
 
+class EditionHistoryDeltaNode(object):
+    """
+    History node keeping only some voxels of the mask: their coordinates
+    in the mask matrix and their values.
+    """
+    def __init__(self, index, orientation, coords, values, clean=False):
+        self.index = index
+        self.orientation = orientation
+        self.filename = tempfile.mktemp(suffix='.npz')
+        self.clean = clean
+
+        np.savez(self.filename, coords=coords, values=values)
+
+    def commit_history(self, mvolume):
+        data = np.load(self.filename)
+        coords = data['coords']
+        values = data['values']
+
+        if coords.shape[1]:
+            lo = coords.min(1)
+            hi = coords.max(1) + 1
+            key = tuple(slice(i, f) for i, f in zip(lo, hi))
+            with mask_storage.edit_region(mvolume, key) as region:
+                region[tuple(coords - lo.reshape(3, 1))] = values
+
+        print("applying delta to", self.orientation, "at slice", self.index)
+
+    def __del__(self):
+        print("Removing", self.filename)
+        os.remove(self.filename)
+
+
 class EditionHistory(object):
     def __init__(self, size=50):
         self.history = []
@@ -89,6 +121,13 @@ class EditionHistory(object):
         node = EditionHistoryNode(index, orientation, array, clean)
         self.add(node)
 
+    def new_delta_node(self, index, orientation, coords, values, p_values):
+        p_node = EditionHistoryDeltaNode(index, orientation, coords, p_values)
+        self.add(p_node)
+
+        node = EditionHistoryDeltaNode(index, orientation, coords, values)
+        self.add(node)
+
     def add(self, node):
         if self.index == self.size:
             self.history.pop(0)
@@ -198,6 +237,7 @@ class Mask():
         self.is_shown = 1
         self.edited_points = {}
         self.was_edited = False
+        self.storage = const.MASK_STORAGE_DENSE
         self.__bind_events()
 
         self.history = EditionHistory()
@@ -209,6 +249,13 @@ class Mask():
     def save_history(self, index, orientation, array, p_array, clean=False):
         self.history.new_node(index, orientation, array, p_array, clean)
 
+    def save_history_delta(self, index, orientation, coords, values, p_values):
+        """
+        Saves in the history only the voxels at coords (a 3xN array in
+        matrix coordinates), that had p_values and now have values.
+        """
+        self.history.new_delta_node(index, orientation, coords, values, p_values)
+
     def undo_history(self, actual_slices):
         self.history.undo(self.matrix, actual_slices)
 
@@ -231,6 +278,7 @@ class Mask():
         filename = u'mask_%d' % self.index
         mask_filename = u'%s.dat' % filename
         mask_filepath = os.path.join(dir_temp, mask_filename)
+        self.matrix.flush()
         filelist[self.temp_file] = mask_filename
         #self._save_mask(mask_filepath)
 
@@ -243,6 +291,7 @@ class Mask():
         mask['visible'] = self.is_shown
         mask['mask_file'] = mask_filename
         mask['mask_shape'] = self.matrix.shape
+        mask['mask_storage'] = self.storage
         mask['edited'] = self.was_edited
 
         plist_filename = filename + u'.plist'
@@ -268,6 +317,7 @@ class Mask():
         mask_file = mask['mask_file']
         shape = mask['mask_shape']
         self.was_edited = mask.get('edited', False)
+        self.storage = mask.get('mask_storage', const.MASK_STORAGE_DENSE)
 
         dirpath = os.path.abspath(os.path.split(filename)[0])
         path = os.path.join(dirpath, mask_file)
@@ -275,15 +325,18 @@ class Mask():
 
     def OnFlipVolume(self, pubsub_evt):
         axis = pubsub_evt.data
-        submatrix = self.matrix[1:, 1:, 1:]
+        with mask_storage.edit_region(self.matrix, (slice(1, None),) * 3) as submatrix:
+            if axis == 0:
+                submatrix[:] = submatrix[::-1]
+            elif axis == 1:
+                submatrix[:] = submatrix[:, ::-1]
+            elif axis == 2:
+                submatrix[:] = submatrix[:, :, ::-1]
         if axis == 0:
-            submatrix[:] = submatrix[::-1]
             self.matrix[1::, 0, 0] = self.matrix[:0:-1, 0, 0]
         elif axis == 1:
-            submatrix[:] = submatrix[:, ::-1]
             self.matrix[0, 1::, 0] = self.matrix[0, :0:-1, 0]
         elif axis == 2:
-            submatrix[:] = submatrix[:, :, ::-1]
             self.matrix[0, 0, 1::] = self.matrix[0, 0, :0:-1]
 
     def OnSwapVolumeAxes(self, pubsub_evt):
@@ -296,21 +349,27 @@ class Mask():
     def _open_mask(self, filename, shape, dtype='uint8'):
         print(">>", filename, shape)
         self.temp_file = filename
-        self.matrix = np.memmap(filename, shape=shape, dtype=dtype, mode="r+")
+        self.matrix = mask_storage.open_matrix(filename, shape, self.storage, dtype)
 
     def _set_class_index(self, index):
         Mask.general_index = index
 
-    def create_mask(self, shape):
+    def create_mask(self, shape, storage=None):
         """
         Creates a new mask object. This method do not append this new mask into the project.
 
         Parameters:
             shape(int, int, int): The shape of the new mask.
+            storage: how the mask is stored (one of const.MASK_STORAGE_*).
+                If None the storage configured in the session is used.
         """
+        if storage is None:
+            storage = getattr(ses.Session(), 'mask_storage',
+                              const.DEFAULT_MASK_STORAGE)
+        self.storage = storage
         self.temp_file = tempfile.mktemp()
         shape = shape[0] + 1, shape[1] + 1, shape[2] + 1
-        self.matrix = np.memmap(self.temp_file, mode='w+', dtype='uint8', shape=shape)
+        self.matrix = mask_storage.create_matrix(self.temp_file, shape, storage)
 
     def clean(self):
         self.matrix[1:, 1:, 1:] = 0
@@ -333,8 +392,12 @@ class Mask():
         new_mask.edition_threshold_range = self.edition_threshold_range
         new_mask.is_shown = self.is_shown
 
-        new_mask.create_mask(shape=[i-1 for i in self.matrix.shape])
-        new_mask.matrix[:] = self.matrix[:]
+        new_mask.create_mask(shape=[i-1 for i in self.matrix.shape],
+                             storage=self.storage)
+        if isinstance(self.matrix, mask_storage.BrickMatrix):
+            new_mask.matrix = self.matrix.copy(new_mask.temp_file)
+        else:
+            new_mask.matrix[:] = self.matrix[:]
 
         return new_mask
 
@@ -346,45 +409,30 @@ class Mask():
         CON3D = {6: 1, 18: 2, 26: 3}
 
         if target == '3D':
-            cp_mask = self.matrix.copy()
-            matrix = self.matrix[1:, 1:, 1:]
             bstruct = ndimage.generate_binary_structure(3, CON3D[conn])
-
-            imask = (~(matrix > 127))
-            labels, nlabels = ndimage.label(imask, bstruct, output=np.uint16)
-
-            if nlabels == 0:
-                return
-
-            ret = floodfill.fill_holes_automatically(matrix, labels, nlabels, size)
-            if ret:
-                self.save_history(index, orientation, self.matrix.copy(), cp_mask)
+            region = (slice(1, None),) * 3
+            orientation = 'VOLUME'
         else:
-            bstruct = ndimage.generate_binary_structure(2, CON2D[conn])
-
+            _bstruct = ndimage.generate_binary_structure(2, CON2D[conn])
             if orientation == 'AXIAL':
-                matrix = self.matrix[index+1, 1:, 1:]
+                bstruct = _bstruct.reshape(1, 3, 3)
+                region = (slice(index+1, index+2), slice(1, None), slice(1, None))
             elif orientation == 'CORONAL':
-                matrix = self.matrix[1:, index+1, 1:]
+                bstruct = _bstruct.reshape(3, 1, 3)
+                region = (slice(1, None), slice(index+1, index+2), slice(1, None))
             elif orientation == 'SAGITAL':
-                matrix = self.matrix[1:, 1:, index+1]
-
-            cp_mask = matrix.copy()
-
-            imask = (~(matrix > 127))
-            labels, nlabels = ndimage.label(imask, bstruct, output=np.uint16)
-
-            if nlabels == 0:
-                return
-
-            labels = labels.reshape(1, labels.shape[0], labels.shape[1])
-            matrix = matrix.reshape(1, matrix.shape[0], matrix.shape[1])
+                bstruct = _bstruct.reshape(3, 3, 1)
+                region = (slice(1, None), slice(1, None), slice(index+1, index+2))
 
-            ret = floodfill.fill_holes_automatically(matrix, labels, nlabels, size)
-            if ret:
-                self.save_history(index, orientation, matrix.copy(), cp_mask)
+        coords, p_values = holes.fill_holes(self.matrix, region, bstruct, size)
+        if coords is not None:
+            values = np.empty_like(p_values)
+            values[:] = 254
+            self.save_history_delta(index, orientation, coords, values, p_values)
 
     def __del__(self):
         if self.is_shown:
             self.history._config_undo_redo(False)
-        os.remove(self.temp_file)
+        # Masks stored in bricks only write their file when flushed.
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
@@ -0,0 +1,203 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Boolean operations between masks.
+
+An expression is a tuple (op, operand, operand, ...) where op is one of
+const.BOOLEAN_* and each operand is a mask matrix or another expression,
+e.g. A union B minus C is:
+
+    (const.BOOLEAN_DIFF, (const.BOOLEAN_UNION, a, b), c)
+
+UNION, AND and XOR accept any number of operands, DIFF removes from the
+first operand all the others. The expression is evaluated in slabs of
+slices, so only a few slabs are in memory at once, and the slabs are
+processed in a thread pool (numpy releases the GIL in the ufuncs).
+
+The matrices are mask matrices, that is, their first slice, row and column
+are flags and are not part of the result.
+"""
+
+import multiprocessing
+import threading
+
+from concurrent import futures
+
+import numpy as np
+
+import invesalius.constants as const
+import invesalius.data.mask_storage as mask_storage
+
+# Size, in voxels, of the slabs processed by each thread.
+SLAB_SIZE = 2 ** 23
+
+OPERATIONS = (const.BOOLEAN_UNION, const.BOOLEAN_DIFF,
+              const.BOOLEAN_AND, const.BOOLEAN_XOR)
+
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def is_expression(operand):
+    return isinstance(operand, tuple)
+
+
+def leaves(expression):
+    """
+    Returns the operands of the expression that are not expressions, from
+    left to right.
+    """
+    result = []
+    for operand in expression[1:]:
+        if is_expression(operand):
+            result.extend(leaves(operand))
+        else:
+            result.append(operand)
+    return result
+
+
+def map_leaves(expression, function):
+    """
+    Returns a copy of expression with each leaf replaced by function(leaf).
+    """
+    operands = []
+    for operand in expression[1:]:
+        if is_expression(operand):
+            operands.append(map_leaves(operand, function))
+        else:
+            operands.append(function(operand))
+    return (expression[0],) + tuple(operands)
+
+
+def _check_expression(expression):
+    op = expression[0]
+    if op not in OPERATIONS:
+        raise ValueError("Invalid boolean operation: %r" % (op,))
+    if len(expression) < 3:
+        raise ValueError("Boolean operations need at least two operands")
+    for operand in expression[1:]:
+        if is_expression(operand):
+            _check_expression(operand)
+
+
+class BooleanEvaluator(object):
+    """
+    Evaluates an expression into the mask matrix out, setting 255 where the
+    result is true and 0 elsewhere.
+    """
+    def __init__(self, expression, out, n_workers=None, slab_size=SLAB_SIZE):
+        _check_expression(expression)
+        self.expression = expression
+        self.out = out
+
+        for matrix in leaves(expression):
+            if matrix.shape != out.shape:
+                raise ValueError("All masks must have the same shape")
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = max(n_workers, 1)
+
+        dz, dy, dx = out.shape
+        self.slab_depth = max(slab_size // ((dy - 1) * (dx - 1)), 1)
+
+        # BrickMatrix is not thread safe, reads and writes to it are
+        # serialized. The computation itself is not.
+        self._lock = threading.Lock()
+        self._no_lock = _NoLock()
+
+    def _guard(self, matrix):
+        if isinstance(matrix, mask_storage.BrickMatrix):
+            return self._lock
+        return self._no_lock
+
+    def slabs(self):
+        nz = self.out.shape[0] - 1
+        for zi in range(0, nz, self.slab_depth):
+            yield zi, min(zi + self.slab_depth, nz)
+
+    def _eval_leaf(self, matrix, key):
+        with self._guard(matrix):
+            slab = matrix[key]
+        return np.greater(slab, 2)
+
+    def _eval(self, expression, key):
+        op = expression[0]
+        operands = expression[1:]
+
+        result = None
+        rest = None
+        for operand in operands:
+            if is_expression(operand):
+                value = self._eval(operand, key)
+            else:
+                value = self._eval_leaf(operand, key)
+
+            if result is None:
+                result = value
+            elif op == const.BOOLEAN_UNION:
+                np.logical_or(result, value, out=result)
+            elif op == const.BOOLEAN_AND:
+                np.logical_and(result, value, out=result)
+            elif op == const.BOOLEAN_XOR:
+                np.logical_xor(result, value, out=result)
+            elif op == const.BOOLEAN_DIFF:
+                # result = first and not (second or third or ...)
+                if rest is None:
+                    rest = value
+                else:
+                    np.logical_or(rest, value, out=rest)
+
+        if rest is not None:
+            np.logical_not(rest, out=rest)
+            np.logical_and(result, rest, out=result)
+        return result
+
+    def do_slab(self, zi, zf):
+        key = (slice(zi + 1, zf + 1), slice(1, None), slice(1, None))
+        result = self._eval(self.expression, key)
+        with self._guard(self.out):
+            with mask_storage.edit_region(self.out, key) as out:
+                np.multiply(result, np.uint8(255), out=out)
+
+    def run(self):
+        if self.n_workers == 1:
+            for zi, zf in self.slabs():
+                self.do_slab(zi, zf)
+            return
+
+        with futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            jobs = [executor.submit(self.do_slab, zi, zf)
+                    for zi, zf in self.slabs()]
+            for job in jobs:
+                # Re-raises the exceptions raised in the threads.
+                job.result()
+
+
+def evaluate(expression, out, n_workers=None, slab_size=SLAB_SIZE):
+    """
+    Evaluates the boolean expression into the mask matrix out.
+    """
+    BooleanEvaluator(expression, out, n_workers, slab_size).run()
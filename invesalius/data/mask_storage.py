@@ -0,0 +1,456 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Storage backends for the mask matrices.
+
+Masks are stored by default as a dense uint8 numpy.memmap. BrickMatrix is an
+alternative backend that splits the volume in bricks (32x32x32 by default).
+A brick is stored as:
+
+    - uniform: just its value (empty or full bricks);
+    - packed: one bit per voxel (value > 127) plus a side channel with the
+      position and value of the voxels that are neither 0 nor 255 (the
+      1, 2, 253 and 254 edition states and the slice flags);
+    - raw: a dense uint8 array, when it is smaller than the packed one.
+
+BrickMatrix supports the same int/slice indexing used with the dense masks.
+Indexing returns a numpy array (a copy, not a view), so in place operations
+must use edit_region.
+"""
+
+import collections
+import contextlib
+import tempfile
+
+import numpy as np
+
+import invesalius.constants as const
+
+BRICK_SIZE = 32
+
+# Maximum number of decoded bricks kept in memory by each BrickMatrix.
+CACHE_SIZE = 1024
+
+
+class PackedBrick(object):
+    __slots__ = ('bits', 'index', 'values')
+
+    def __init__(self, bits, index, values):
+        self.bits = bits
+        self.index = index
+        self.values = values
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes + self.index.nbytes + self.values.nbytes
+
+
+def encode_brick(block):
+    """
+    Encodes a brick (a uint8 numpy array). Returns an int if the brick is
+    uniform, a PackedBrick or a copy of block if it is smaller than the
+    packed version.
+    """
+    flat = block.ravel()
+    first = flat[0]
+    if not (flat != first).any():
+        return int(first)
+
+    side = np.flatnonzero((flat != 0) & (flat != 255))
+    bits_size = (flat.size + 7) // 8
+    if bits_size + side.size * 3 >= flat.size:
+        return block.copy()
+
+    bits = np.packbits(flat > 127)
+    return PackedBrick(bits, side.astype('uint16'), flat[side])
+
+
+def decode_brick(encoded, shape, dtype='uint8'):
+    """
+    Decodes a brick encoded by encode_brick. Always returns a new array.
+    """
+    if isinstance(encoded, PackedBrick):
+        size = int(np.prod(shape))
+        block = np.unpackbits(encoded.bits)[:size] * np.uint8(255)
+        block[encoded.index] = encoded.values
+        return block.reshape(shape)
+    elif isinstance(encoded, np.ndarray):
+        return encoded.copy()
+    else:
+        return np.full(shape, encoded, dtype=dtype)
+
+
+class BrickMatrix(object):
+    """
+    A 3D uint8 matrix stored in bricks (see the module documentation).
+
+    Parameters:
+        shape (int, int, int): the shape of the matrix.
+        filename: the file used by flush to persist the matrix. If None a
+            temporary filename is used.
+        brick_size (int): the size of the (cubic) bricks.
+    """
+    def __init__(self, shape, filename=None, brick_size=BRICK_SIZE):
+        self.shape = tuple(int(i) for i in shape)
+        self.dtype = np.dtype('uint8')
+        self.brick_size = int(brick_size)
+        if filename is None:
+            filename = tempfile.mktemp()
+        self.filename = filename
+
+        bs = self.brick_size
+        self.grid_shape = tuple((i + bs - 1) // bs for i in self.shape)
+        # Value of the uniform bricks. Bricks in self.bricks ignore it.
+        self.uniform = np.zeros(self.grid_shape, dtype=self.dtype)
+        self.bricks = {}
+
+        # Decoded bricks, the bool flags if it was modified since decoded.
+        self._cache = collections.OrderedDict()
+
+    @classmethod
+    def from_array(cls, array, filename=None, brick_size=BRICK_SIZE):
+        matrix = cls(array.shape, filename, brick_size)
+        matrix[:] = array
+        return matrix
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Opens a matrix saved with flush.
+        """
+        with open(filename, 'rb') as f:
+            data = np.load(f)
+            matrix = cls(data['shape'], filename, int(data['brick_size']))
+            matrix.uniform[:] = data['uniform']
+
+            keys = data['keys']
+            kinds = data['kinds']
+            offsets = data['offsets']
+            nside = data['nside']
+            blob = data['blob']
+
+        for key, kind, i, f, n in zip(keys, kinds, offsets[:-1], offsets[1:], nside):
+            key = tuple(int(k) for k in key)
+            chunk = blob[i:f]
+            if kind == 0:
+                values = chunk[chunk.size - n:]
+                index = chunk[chunk.size - 3 * n:chunk.size - n].view('uint16')
+                bits = chunk[:chunk.size - 3 * n]
+                matrix.bricks[key] = PackedBrick(bits.copy(), index.copy(), values.copy())
+            else:
+                shape = matrix._brick_shape(key)
+                matrix.bricks[key] = chunk.reshape(shape).copy()
+        return matrix
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the encoded bricks (decoded cache not included).
+        """
+        size = self.uniform.nbytes
+        for encoded in self.bricks.values():
+            size += encoded.nbytes
+        return size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        array = self[:, :, :]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def _brick_shape(self, key):
+        bs = self.brick_size
+        return tuple(min(bs, s - k * bs) for k, s in zip(key, self.shape))
+
+    def _normalize_key(self, key):
+        """
+        Converts key into a list of (start, stop, post) by axis, where
+        start:stop is the contiguous range covered and post is what must be
+        applied to it to get the requested indexing (None for ints).
+        Returns None if key is not supported (fancy indexing).
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (3 - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),) * (3 - len(key))
+        if len(key) != 3:
+            return None
+
+        axes = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                indices = range(start, stop, step)
+                if len(indices) == 0:
+                    axes.append((0, 0, slice(None)))
+                elif step > 0:
+                    lo = indices[0]
+                    hi = indices[-1] + 1
+                    axes.append((lo, hi, slice(None, None, step)))
+                else:
+                    lo = indices[-1]
+                    hi = indices[0] + 1
+                    axes.append((lo, hi, slice(None, None, step)))
+            elif isinstance(k, (int, np.integer)):
+                k = int(k)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError("index %d is out of bounds for size %d" % (k, n))
+                axes.append((k, k + 1, None))
+            else:
+                return None
+        return axes
+
+    def _bricks_in(self, ranges):
+        """
+        Yields (brick key, local slices, region slices) of the bricks
+        intersecting the region given by ranges [(start, stop), ...].
+        """
+        bs = self.brick_size
+        by_axis = []
+        for lo, hi in ranges:
+            parts = []
+            for b in range(lo // bs, (hi - 1) // bs + 1):
+                b0 = max(lo, b * bs)
+                b1 = min(hi, (b + 1) * bs)
+                parts.append((b, slice(b0 - b * bs, b1 - b * bs), slice(b0 - lo, b1 - lo)))
+            by_axis.append(parts)
+
+        for bz, lz, rz in by_axis[0]:
+            for by, ly, ry in by_axis[1]:
+                for bx, lx, rx in by_axis[2]:
+                    yield (bz, by, bx), (lz, ly, lx), (rz, ry, rx)
+
+    def _get_block(self, key):
+        try:
+            block, dirty = self._cache.pop(key)
+        except KeyError:
+            shape = self._brick_shape(key)
+            encoded = self.bricks.get(key, self.uniform[key])
+            block = decode_brick(encoded, shape, self.dtype)
+            dirty = False
+        self._cache[key] = (block, dirty)
+        self._evict()
+        return block
+
+    def _set_dirty(self, key):
+        block, dirty = self._cache[key]
+        self._cache[key] = (block, True)
+
+    def _store(self, key, block):
+        encoded = encode_brick(block)
+        if isinstance(encoded, int):
+            self.uniform[key] = encoded
+            self.bricks.pop(key, None)
+        else:
+            self.bricks[key] = encoded
+
+    def _evict(self):
+        while len(self._cache) > CACHE_SIZE:
+            key, (block, dirty) = self._cache.popitem(last=False)
+            if dirty:
+                self._store(key, block)
+
+    def _sync(self):
+        """
+        Encodes the modified bricks from the cache.
+        """
+        for key, (block, dirty) in list(self._cache.items()):
+            if dirty:
+                self._store(key, block)
+                self._cache[key] = (block, False)
+
+    def __getitem__(self, key):
+        axes = self._normalize_key(key)
+        if axes is None:
+            return np.asarray(self)[key]
+
+        ranges = [(lo, hi) for lo, hi, post in axes]
+        out = np.empty([hi - lo for lo, hi in ranges], dtype=self.dtype)
+        if out.size:
+            for bkey, local, region in self._bricks_in(ranges):
+                if bkey in self.bricks or bkey in self._cache:
+                    out[region] = self._get_block(bkey)[local]
+                else:
+                    out[region] = self.uniform[bkey]
+
+        return out[tuple(0 if post is None else post for lo, hi, post in axes)]
+
+    def __setitem__(self, key, value):
+        axes = self._normalize_key(key)
+        if axes is None:
+            array = np.asarray(self)
+            array[key] = value
+            self[:] = array
+            return
+
+        ranges = [(lo, hi) for lo, hi, post in axes]
+        shape = [hi - lo for lo, hi in ranges]
+        if not all(shape):
+            return
+
+        value = np.asarray(value)
+        strided = any(post is not None and post.step not in (None, 1)
+                      for lo, hi, post in axes)
+        if value.ndim == 0 and not strided:
+            self._fill(ranges, value.astype(self.dtype))
+            return
+
+        if strided:
+            # Strided or reversed assignment: the covered region is
+            # read, modified and written back.
+            region = self[tuple(slice(lo, hi) for lo, hi in ranges)]
+            region[tuple(0 if post is None else post for lo, hi, post in axes)] = value
+            value = region
+        else:
+            requested = [1 if post is None else s for (lo, hi, post), s in zip(axes, shape)]
+            value = np.broadcast_to(value, [s for s, (lo, hi, post) in zip(requested, axes) if post is not None])
+            value = value.reshape(shape)
+
+        for bkey, local, region in self._bricks_in(ranges):
+            part = value[region]
+            if part.shape == self._brick_shape(bkey):
+                first = part.flat[0]
+                if not (part != first).any():
+                    self._set_uniform(bkey, first)
+                    continue
+                self._cache.pop(bkey, None)
+                self._cache[bkey] = (part.astype(self.dtype), True)
+                self._evict()
+                continue
+            block = self._get_block(bkey)
+            block[local] = part
+            self._set_dirty(bkey)
+
+    def _set_uniform(self, key, value):
+        self._cache.pop(key, None)
+        self.bricks.pop(key, None)
+        self.uniform[key] = value
+
+    def _fill(self, ranges, value):
+        for bkey, local, region in self._bricks_in(ranges):
+            if all((s.stop - s.start) == b for s, b in zip(local, self._brick_shape(bkey))):
+                self._set_uniform(bkey, value)
+            else:
+                block = self._get_block(bkey)
+                block[local] = value
+                self._set_dirty(bkey)
+
+    def copy(self, filename=None):
+        """
+        Returns a copy of this matrix. Only the (encoded) bricks are copied,
+        the copy does not need a dense buffer.
+        """
+        self._sync()
+        new = BrickMatrix(self.shape, filename, self.brick_size)
+        new.uniform[:] = self.uniform
+        # Encoded bricks are never modified in place, so they can be shared.
+        new.bricks = dict(self.bricks)
+        return new
+
+    def swapaxes(self, axis0, axis1):
+        array = np.asarray(self).swapaxes(axis0, axis1)
+        return BrickMatrix.from_array(array, self.filename, self.brick_size)
+
+    def flush(self):
+        """
+        Saves the matrix into self.filename (readable with load).
+        """
+        self._sync()
+        keys = sorted(self.bricks)
+        kinds = np.zeros(len(keys), dtype='uint8')
+        nside = np.zeros(len(keys), dtype='int64')
+        offsets = np.zeros(len(keys) + 1, dtype='int64')
+        chunks = []
+        for i, key in enumerate(keys):
+            encoded = self.bricks[key]
+            if isinstance(encoded, PackedBrick):
+                chunk = np.concatenate((encoded.bits,
+                                        encoded.index.view('uint8'),
+                                        encoded.values))
+                nside[i] = encoded.values.size
+            else:
+                chunk = encoded.ravel()
+                kinds[i] = 1
+            chunks.append(chunk)
+            offsets[i + 1] = offsets[i] + chunk.size
+
+        if chunks:
+            blob = np.concatenate(chunks)
+        else:
+            blob = np.zeros(0, dtype='uint8')
+
+        with open(self.filename, 'wb') as f:
+            np.savez(f, shape=np.array(self.shape), brick_size=self.brick_size,
+                     uniform=self.uniform,
+                     keys=np.array(keys, dtype='int64').reshape(-1, 3),
+                     kinds=kinds, offsets=offsets, nside=nside, blob=blob)
+
+
+def create_matrix(filename, shape, storage, dtype='uint8'):
+    """
+    Creates a new mask matrix using the given storage (one of
+    const.MASK_STORAGE_*).
+    """
+    if storage == const.MASK_STORAGE_BRICKS:
+        return BrickMatrix(shape, filename)
+    return np.memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+
+def open_matrix(filename, shape, storage, dtype='uint8', mode='r+'):
+    """
+    Opens a mask matrix saved in filename using the given storage.
+    """
+    if storage == const.MASK_STORAGE_BRICKS:
+        return BrickMatrix.load(filename)
+    return np.memmap(filename, mode=mode, dtype=dtype, shape=shape)
+
+
+@contextlib.contextmanager
+def edit_region(matrix, key):
+    """
+    Gives a numpy array of matrix[key] to be modified in place. With the
+    dense storage it's a view, with BrickMatrix it's a copy written back
+    when the block ends.
+
+        with edit_region(mask.matrix, (slice(1, None),) * 3) as m:
+            floodfill.floodfill_threshold(m, ...)
+    """
+    if isinstance(matrix, BrickMatrix):
+        region = matrix[key]
+        yield region
+        matrix[key] = region
+    else:
+        yield matrix[key]
@@ -0,0 +1,232 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Co-registration maths used by the navigation.
+
+The poses read from the tracker are rigid transforms, so they are built and
+inverted in closed form (the inverse of [R t] is [R.T -R.T t]) instead of
+with the general matrix functions of transformations.py. Every function
+works on a block of samples at once, the first axis indexing the samples;
+the navigation threads pass blocks of one sample and a recorded session
+can be co-registered again offline in a single call.
+
+The angles are in the conventions used by the navigation: the tracker
+gives 'rzyx' Euler angles in degrees and the co-registered coordinates
+have the 'sxyz' angles returned by transformations.decompose_matrix.
+"""
+
+import numpy as np
+
+
+def rotation_matrices(angles):
+    """
+    Rotation matrices of the 'rzyx' Euler angles.
+
+    :param angles: Nx3 array of angles in radians
+    :return: Nx3x3 array of rotation matrices
+    """
+    angles = np.asarray(angles, dtype='float64')
+    ca, cb, cg = np.cos(angles).T
+    sa, sb, sg = np.sin(angles).T
+
+    r = np.empty(angles.shape[:-1] + (3, 3))
+    r[..., 0, 0] = ca * cb
+    r[..., 0, 1] = ca * sb * sg - sa * cg
+    r[..., 0, 2] = ca * sb * cg + sa * sg
+    r[..., 1, 0] = sa * cb
+    r[..., 1, 1] = sa * sb * sg + ca * cg
+    r[..., 1, 2] = sa * sb * cg - ca * sg
+    r[..., 2, 0] = -sb
+    r[..., 2, 1] = cb * sg
+    r[..., 2, 2] = cb * cg
+    return r
+
+
+def euler_angles(rotations, axes='sxyz'):
+    """
+    Euler angles of rotation matrices, as transformations.euler_from_matrix.
+
+    :param rotations: Nx3x3 (or Nx4x4) array of rotation matrices
+    :param axes: 'sxyz' or 'rzyx'
+    :return: Nx3 array of angles in radians
+    """
+    m = np.asarray(rotations)
+    cy = np.hypot(m[..., 0, 0], m[..., 1, 0])
+    singular = cy <= np.finfo(float).eps * 4.0
+
+    ax = np.where(singular, np.arctan2(-m[..., 1, 2], m[..., 1, 1]),
+                  np.arctan2(m[..., 2, 1], m[..., 2, 2]))
+    ay = np.arctan2(-m[..., 2, 0], cy)
+    az = np.where(singular, 0.0, np.arctan2(m[..., 1, 0], m[..., 0, 0]))
+
+    if axes == 'sxyz':
+        return np.stack((ax, ay, az), axis=-1)
+    elif axes == 'rzyx':
+        return np.stack((az, ay, ax), axis=-1)
+    raise ValueError("Unsupported axes: %r" % (axes,))
+
+
+def rigid_matrices(rotations, translations):
+    """
+    :param rotations: Nx3x3 array of rotation matrices
+    :param translations: Nx3 array of translations
+    :return: Nx4x4 array of the rigid transforms
+    """
+    rotations = np.asarray(rotations)
+    m = np.zeros(rotations.shape[:-2] + (4, 4))
+    m[..., :3, :3] = rotations
+    m[..., :3, 3] = translations
+    m[..., 3, 3] = 1.0
+    return m
+
+
+def poses_to_matrices(coords):
+    """
+    Rigid transforms of the poses read from the tracker, the same as
+    concatenate_matrices(translation_matrix, euler_matrix(..., 'rzyx')).
+
+    :param coords: Nx6 array of x, y, z and 'rzyx' angles in degrees
+    :return: Nx4x4 array of the rigid transforms
+    """
+    coords = np.asarray(coords, dtype='float64')
+    return rigid_matrices(rotation_matrices(np.radians(coords[..., 3:6])),
+                          coords[..., :3])
+
+
+def invert_rigid(m):
+    """
+    :param m: Nx4x4 array of rigid transforms
+    :return: Nx4x4 array of the inverse transforms
+    """
+    rt = np.swapaxes(m[..., :3, :3], -1, -2)
+    t = -np.einsum('...ij,...j->...i', rt, m[..., :3, 3])
+    return rigid_matrices(rt, t)
+
+
+def _apply_change(change, r, t):
+    """
+    Applies the change of basis m_change to the rigid transforms [r t]
+    after negating their z translation.
+    """
+    t = t.copy()
+    t[..., 2] = -t[..., 2]
+    r_change, t_change = change
+    r_img = np.einsum('ij,...jk->...ik', r_change, r)
+    t_img = np.einsum('ij,...j->...i', r_change, t) + t_change
+    return r_img, t_img
+
+
+def _coords(r, t):
+    """
+    Returns the co-registered coordinates: the translation and the 'sxyz'
+    angles in degrees.
+    """
+    return np.concatenate((t, np.degrees(euler_angles(r))), axis=-1)
+
+
+class Coregistration(object):
+    """
+    Constants of a navigation session, computed once from the coreg_data
+    given to the navigation threads: [m_change, obj_ref_mode] optionally
+    followed by the object registration (see bases.object_registration).
+    The methods co-register blocks of tracker poses, returning the Nx4x4
+    m_img matrices and the Nx6 coordinates sent with 'Co-registered
+    points'.
+    """
+    def __init__(self, coreg_data):
+        m_change = np.asarray(coreg_data[0], dtype='float64')
+        self.obj_ref_mode = coreg_data[1]
+        self.change = (m_change[:3, :3], m_change[:3, 3])
+
+        if len(coreg_data) > 2:
+            t_obj_raw, s0_raw, r_s0_raw, s0_dyn, m_obj_raw, r_obj_img = \
+                    [np.asarray(m, dtype='float64') for m in coreg_data[2:8]]
+            # Position of the object, in the probe frame.
+            self.q_obj = t_obj_raw[:3, 3]
+            # r_obj = (r_obj_img * m_obj_raw.I * s0_dyn.I) * m_probe * m_obj_raw
+            left = np.dot(np.dot(r_obj_img, np.linalg.inv(m_obj_raw)),
+                          np.linalg.inv(s0_dyn))
+            self.r_obj_left = left[:3, :3]
+            self.r_obj_right = m_obj_raw[:3, :3]
+
+    def static(self, probes):
+        """
+        Static reference: only the probe translation is changed of basis,
+        the angles are the ones read from the tracker.
+
+        :param probes: Nx6 array of probe poses
+        """
+        probes = np.asarray(probes, dtype='float64')
+        r = np.broadcast_to(np.identity(3), probes.shape[:-1] + (3, 3))
+        r_img, t_img = _apply_change(self.change, r, probes[..., :3])
+        coords = np.concatenate((t_img, probes[..., 3:6]), axis=-1)
+        return rigid_matrices(r_img, t_img), coords
+
+    def dynamic(self, probes, references):
+        """
+        Dynamic reference: the probe pose relative to the reference.
+
+        :param probes: Nx6 array of probe poses
+        :param references: Nx6 array of reference poses
+        """
+        m_dyn = np.matmul(invert_rigid(poses_to_matrices(references)),
+                          poses_to_matrices(probes))
+        r_img, t_img = _apply_change(self.change, m_dyn[..., :3, :3],
+                                     m_dyn[..., :3, 3])
+        return rigid_matrices(r_img, t_img), _coords(r_img, t_img)
+
+    def _object_probe(self, probes):
+        # The probe moved to the object: as r_s0_raw is the rotation of
+        # s0_raw, the translation of s0_raw * t_offset * s0_raw.I *
+        # t_probe_raw reduces to t_probe + r_probe * q_obj.
+        probes = np.asarray(probes, dtype='float64')
+        r_probe = rotation_matrices(np.radians(probes[..., 3:6]))
+        t_probe = probes[..., :3] + np.einsum('...ij,j->...i', r_probe, self.q_obj)
+        return r_probe, t_probe
+
+    def _object_rotation(self, r):
+        return np.einsum('ij,...jk,kl->...il', self.r_obj_left, r,
+                         self.r_obj_right)
+
+    def object_static(self, probes):
+        """
+        Tracked object with the static reference.
+
+        :param probes: Nx6 array of probe poses
+        """
+        r_probe, t_probe = self._object_probe(probes)
+        r_img, t_img = _apply_change(self.change, r_probe, t_probe)
+        r_img = self._object_rotation(r_probe)
+        return rigid_matrices(r_img, t_img), _coords(r_img, t_img)
+
+    def object_dynamic(self, probes, references):
+        """
+        Tracked object with the dynamic reference.
+
+        :param probes: Nx6 array of probe poses
+        :param references: Nx6 array of reference poses
+        """
+        r_probe, t_probe = self._object_probe(probes)
+        m_dyn = np.matmul(invert_rigid(poses_to_matrices(references)),
+                          rigid_matrices(r_probe, t_probe))
+        r_img, t_img = _apply_change(self.change, m_dyn[..., :3, :3],
+                                     m_dyn[..., :3, 3])
+        r_img = self._object_rotation(m_dyn[..., :3, :3])
+        return rigid_matrices(r_img, t_img), _coords(r_img, t_img)
@@ -19,12 +19,16 @@
 
 import sys
 
+import numpy as np
 import vtk
 import wx
+from vtk.util import numpy_support
 from wx.lib.pubsub import pub as Publisher
 
 import invesalius.constants as const
+import invesalius.data.converters as converters
 import invesalius.data.vtk_utils as vu
+from invesalius.data.holes import union_find
 from invesalius.utils import touch
 
 if sys.platform == 'win32':
@@ -84,23 +88,30 @@ def FillSurfaceHole(polydata):
     filled_polydata.SetHoleSize(500)
     return filled_polydata.GetOutput()
 
+def MassProperties(polydata):
+    """
+    Returns the volume and the area of polydata, computed with numpy over
+    its triangles (see converters.mass_properties).
+    """
+    polydata = Triangulate(polydata)
+    if not polydata.GetNumberOfPolys():
+        return 0.0, 0.0
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    polys = numpy_support.vtk_to_numpy(polydata.GetPolys().GetData())
+    volume, area = converters.mass_properties(points, polys)
+    return abs(volume), area
+
 def CalculateSurfaceVolume(polydata):
     """
     Calculate the volume from the given polydata
     """
-    # Filter used to calculate volume and area from a polydata
-    measured_polydata = vtk.vtkMassProperties()
-    measured_polydata.SetInputData(polydata)
-    return measured_polydata.GetVolume()
+    return MassProperties(polydata)[0]
 
 def CalculateSurfaceArea(polydata):
     """
-    Calculate the volume from the given polydata
+    Calculate the area from the given polydata
     """
-    # Filter used to calculate volume and area from a polydata
-    measured_polydata = vtk.vtkMassProperties()
-    measured_polydata.SetInputData(polydata)
-    return measured_polydata.GetSurfaceArea()
+    return MassProperties(polydata)[1]
 
 def Merge(polydata_list):
     append = vtk.vtkAppendPolyData()
@@ -118,6 +129,138 @@ def Merge(polydata_list):
 
     return append.GetOutput()
 
+def _close_pairs(points, tolerance):
+    """
+    Returns the pairs (a, b) of the points closer than tolerance (some
+    pairs may be repeated).
+
+    The points are put in cells of size tolerance, so the points of a pair
+    are in the same cell or in neighbouring ones: each cell is compared with
+    itself and with the half of its neighbours after it.
+    """
+    points = np.asarray(points, dtype='float64')
+    cells = np.floor(points / tolerance).astype('int64')
+    offsets = np.array([(i, j, k) for i in (-1, 0, 1)
+                        for j in (-1, 0, 1)
+                        for k in (-1, 0, 1)
+                        if (i, j, k) >= (0, 0, 0)], dtype='int64')
+
+    # Numbers the cells of the points and the cells next to them, as a
+    # single integer when it fits.
+    n = points.shape[0]
+    cells -= cells.min(0) - 1
+    size = cells.max(0) + 2
+    around = cells[np.newaxis] + offsets[:, np.newaxis]
+    if float(size[0]) * size[1] * size[2] < 2 ** 62:
+        numbers = (around[..., 0] * size[1] + around[..., 1]) * size[2] \
+                + around[..., 2]
+    else:
+        _, numbers = np.unique(around.reshape(-1, 3), axis=0,
+                               return_inverse=True)
+        numbers = numbers.reshape(offsets.shape[0], n)
+
+    # Sorted by cell. With the single integers the neighbours of each
+    # offset are sorted too, which makes searchsorted much faster.
+    order = np.argsort(numbers[0], kind='mergesort')
+    numbers = numbers[:, order]
+    sorted_cell = numbers[0]
+
+    a = []
+    b = []
+    for neighbour in numbers:
+        start = np.searchsorted(sorted_cell, neighbour, 'left')
+        count = np.searchsorted(sorted_cell, neighbour, 'right') - start
+        i = np.repeat(order, count)
+        # Position of each candidate inside its range of sorted points.
+        position = np.arange(i.size) - np.repeat(np.cumsum(count) - count, count)
+        j = order[np.repeat(start, count) + position]
+        close = (i != j) & \
+                (((points[i] - points[j]) ** 2).sum(1) <= tolerance * tolerance)
+        a.append(i[close])
+        b.append(j[close])
+    return np.concatenate(a), np.concatenate(b)
+
+
+def MergeSeamPoints(polydata, seams, tolerance, band=None):
+    """
+    Merges the duplicated points left on the planes z = seams (in world
+    coordinates) when a surface is generated in pieces overlapping by one
+    slice. Points closer than tolerance are merged; only the points up to
+    band (tolerance by default) from the seams are tested, so it's much
+    cheaper than vtkCleanPolyData over the whole surface.
+    """
+    if band is None:
+        band = tolerance
+    if not len(seams) or not polydata.GetNumberOfPoints():
+        return polydata
+
+    polys = numpy_support.vtk_to_numpy(polydata.GetPolys().GetData())
+    ncells = polydata.GetPolys().GetNumberOfCells()
+    if polydata.GetNumberOfCells() != ncells or polys.size != ncells * 4 \
+       or not (polys[::4] == 3).all():
+        # Not only triangles, let vtk handle it.
+        clean = vtk.vtkCleanPolyData()
+        clean.SetInputData(polydata)
+        clean.PointMergingOn()
+        clean.Update()
+        return clean.GetOutput()
+
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    npoints = points.shape[0]
+
+    seams = np.sort(np.asarray(seams, dtype='float64'))
+    z = points[:, 2]
+    i = np.searchsorted(seams, z)
+    below = seams[np.clip(i - 1, 0, seams.size - 1)]
+    above = seams[np.clip(i, 0, seams.size - 1)]
+    distance = np.minimum(np.abs(z - below), np.abs(z - above))
+    ids = np.nonzero(distance <= band)[0]
+    if not ids.size:
+        return polydata
+
+    # Every point of a group of close points is replaced by the first one.
+    a, b = _close_pairs(points[ids], tolerance)
+    roots = union_find(ids.size, a, b)
+
+    mapping = np.arange(npoints)
+    mapping[ids] = ids[roots]
+    keep = mapping == np.arange(npoints)
+    if keep.all():
+        return polydata
+    new_index = np.cumsum(keep) - 1
+    mapping = new_index[mapping]
+
+    triangles = polys.reshape(-1, 4).copy()
+    triangles[:, 1:] = mapping[triangles[:, 1:]].astype(polys.dtype)
+
+    new_points = vtk.vtkPoints()
+    new_points.SetData(numpy_support.numpy_to_vtk(points[keep], deep=1))
+
+    cells = vtk.vtkCellArray()
+    cells.SetCells(ncells, numpy_support.numpy_to_vtkIdTypeArray(triangles.ravel(), deep=1))
+
+    result = vtk.vtkPolyData()
+    result.SetPoints(new_points)
+    result.SetPolys(cells)
+
+    point_data = polydata.GetPointData()
+    for n in range(point_data.GetNumberOfArrays()):
+        vtk_array = point_data.GetArray(n)
+        if vtk_array is None:
+            continue
+        array = numpy_support.vtk_to_numpy(vtk_array)
+        new_array = numpy_support.numpy_to_vtk(array[keep], deep=1,
+                                               array_type=vtk_array.GetDataType())
+        new_array.SetName(vtk_array.GetName())
+        attribute = point_data.IsArrayAnAttribute(n)
+        if attribute >= 0:
+            result.GetPointData().SetAttribute(new_array, attribute)
+        else:
+            result.GetPointData().AddArray(new_array)
+    result.GetCellData().ShallowCopy(polydata.GetCellData())
+
+    return result
+
 def Export(polydata, filename, bin=False):
     writer = vtk.vtkXMLPolyDataWriter()
     if _has_win32api:
@@ -163,51 +306,109 @@ def JoinSeedsParts(polydata, point_id_list):
     result.DeepCopy(conn.GetOutput())
     return result
 
-def SelectLargestPart(polydata):
+def Triangulate(polydata):
     """
+    Returns polydata with its polygons and strips turned into triangles,
+    or polydata itself if it has only triangles.
     """
-    UpdateProgress = vu.ShowProgress(1)
-    conn = vtk.vtkPolyDataConnectivityFilter()
-    conn.SetInputData(polydata)
-    conn.SetExtractionModeToLargestRegion()
-    conn.AddObserver("ProgressEvent", lambda obj, evt:
-                  UpdateProgress(conn, "Getting largest part..."))
-    conn.Update()
-
-    result = vtk.vtkPolyData()
-    result.DeepCopy(conn.GetOutput())
-    return result
-
-def SplitDisconectedParts(polydata):
+    if polydata.GetNumberOfStrips() or \
+       polydata.GetNumberOfPolys() * 4 != polydata.GetPolys().GetNumberOfConnectivityEntries():
+        triangle_filter = vtk.vtkTriangleFilter()
+        triangle_filter.SetInputData(polydata)
+        triangle_filter.PassVertsOff()
+        triangle_filter.PassLinesOff()
+        triangle_filter.Update()
+        polydata = triangle_filter.GetOutput()
+    return polydata
+
+def LabelConnectedParts(polydata):
     """
+    Labels the connected parts of polydata, triangles sharing a point are in
+    the same part. The parts are numbered in the order their first triangle
+    appears.
+
+    Returns the triangles of polydata as arrays (see
+    converters.polydata_to_numpy), the part of each triangle and the number
+    of triangles of each part.
     """
-    conn = vtk.vtkPolyDataConnectivityFilter()
-    conn.SetInputData(polydata)
-    conn.SetExtractionModeToAllRegions()
-    conn.Update()
+    arrays = converters.polydata_to_numpy(Triangulate(polydata))
+    triangles = arrays['polys'].reshape(-1, 4)[:, 1:]
+    npoints = arrays['points'].shape[0]
 
-    nregions = conn.GetNumberOfExtractedRegions()
+    # The points of each triangle are joined to its first point.
+    roots = union_find(npoints,
+                       np.concatenate((triangles[:, 0], triangles[:, 0])),
+                       np.concatenate((triangles[:, 1], triangles[:, 2])))
+    triangle_roots = roots[triangles[:, 0]]
 
-    conn.SetExtractionModeToSpecifiedRegions()
-    conn.Update()
+    part_roots, first_triangle = np.unique(triangle_roots, return_index=True)
+    part_of_root = np.zeros(npoints, dtype='int64')
+    part_of_root[part_roots[np.argsort(first_triangle)]] = np.arange(part_roots.size)
+    labels = part_of_root[triangle_roots]
 
-    polydata_collection = []
+    return arrays, labels, np.bincount(labels, minlength=part_roots.size)
 
-    # Update progress value in GUI
-    progress = nregions -1
-    if progress:
-        UpdateProgress = vu.ShowProgress(progress)
 
-    for region in range(nregions):
-        conn.InitializeSpecifiedRegionList()
-        conn.AddSpecifiedRegion(region)
-        conn.Update()
+def ExtractParts(arrays, labels, parts):
+    """
+    Returns a vtkPolyData with each one of the parts (a list of part
+    numbers) labelled by LabelConnectedParts. Only the points used by the
+    part are kept.
+    """
+    triangles = arrays['polys'].reshape(-1, 4)[:, 1:]
+    points = arrays['points']
+    npoints = points.shape[0]
+    nparts = labels.max() + 1 if labels.size else 0
+
+    point_labels = np.empty(npoints, dtype='int64')
+    point_labels[:] = nparts
+    point_labels[triangles.ravel()] = np.repeat(labels, 3)
+
+    # Triangles and points sorted by part, the ones of the part i are
+    # between the bounds i and i + 1.
+    triangle_order = np.argsort(labels, kind='mergesort')
+    triangle_bounds = np.zeros(nparts + 1, dtype='int64')
+    np.cumsum(np.bincount(labels, minlength=nparts), out=triangle_bounds[1:])
+
+    point_order = np.argsort(point_labels, kind='mergesort')
+    point_bounds = np.zeros(nparts + 2, dtype='int64')
+    np.cumsum(np.bincount(point_labels, minlength=nparts + 1),
+              out=point_bounds[1:])
+
+    # Index of each point inside its part.
+    local_ids = np.empty(npoints, dtype='int64')
+    local_ids[point_order] = np.arange(npoints) - point_bounds[point_labels[point_order]]
+
+    result = []
+    for part in parts:
+        part_triangles = triangles[triangle_order[triangle_bounds[part]:triangle_bounds[part + 1]]]
+        part_points = point_order[point_bounds[part]:point_bounds[part + 1]]
+
+        cells = np.empty((part_triangles.shape[0], 4), dtype='int64')
+        cells[:, 0] = 3
+        cells[:, 1:] = local_ids[part_triangles]
+
+        part_arrays = {'points': points[part_points],
+                       'polys': cells.ravel(),
+                       'ncells': cells.shape[0],
+                       'point_data': [(name, attribute, array[part_points])
+                                      for name, attribute, array in arrays['point_data']]}
+        result.append(converters.numpy_to_polydata([part_arrays]))
+    return result
 
-        p = vtk.vtkPolyData()
-        p.DeepCopy(conn.GetOutput())
 
-        polydata_collection.append(p)
-        if progress:
-            UpdateProgress(region, _("Splitting disconnected regions..."))
+def SelectLargestPart(polydata):
+    """
+    Returns the connected part of polydata with more triangles.
+    """
+    arrays, labels, sizes = LabelConnectedParts(polydata)
+    if not sizes.size:
+        return vtk.vtkPolyData()
+    return ExtractParts(arrays, labels, [int(np.argmax(sizes))])[0]
 
-    return polydata_collection
+def SplitDisconectedParts(polydata):
+    """
+    Returns each connected part of polydata as a vtkPolyData.
+    """
+    arrays, labels, sizes = LabelConnectedParts(polydata)
+    return ExtractParts(arrays, labels, range(sizes.size))
@@ -17,51 +17,105 @@
 #    detalhes.
 #--------------------------------------------------------------------------
 
-import threading
-import time
-
-import wx
-from numpy import array, savetxt, hstack,vstack, asarray
+import numpy as np
 import invesalius.gui.dialogs as dlg
 from wx.lib.pubsub import pub as Publisher
 
+# Rows allocated at once by CoordinatesBuffer.
+CHUNK_SIZE = 4096
+
+
+class CoordinatesBuffer(object):
+    """
+    Recorded rows (time, x, y, z, a, b, g) kept in chunks of CHUNK_SIZE
+    preallocated rows, so adding a row doesn't copy the ones already
+    recorded, however long the session.
+    """
+    def __init__(self, columns=7, chunk_size=CHUNK_SIZE):
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        index = self.size % self.chunk_size
+        if index == 0:
+            self.chunks.append(np.empty((self.chunk_size, self.columns)))
+        self.chunks[-1][index] = row
+        self.size += 1
+
+    def get_chunks(self):
+        """
+        Yields the recorded rows, chunk by chunk.
+        """
+        for n, chunk in enumerate(self.chunks):
+            yield chunk[:min(self.size - n * self.chunk_size, self.chunk_size)]
 
-class Record(threading.Thread):
+
+class Record(object):
     """
-    Thread created to save obj coords with software during neuronavigation
+    Records the coordinates of the tracker samples during neuronavigation,
+    one sample each timestamp seconds. The samples are timed when read
+    from the tracker (see coregistration.PoseDispatcher), not when they're
+    shown.
     """
 
     def __init__(self, nav_id, timestamp):
-        threading.Thread.__init__(self)
         self.nav_id = nav_id
-        self.coord = None
         self.timestamp = timestamp
-        self.coord_list = array([])
-        self.__bind_events()
+        self.coords = CoordinatesBuffer()
+        self.initial_time = None
+        self.next_time = None
+        self.acquired = None
         self._pause_ = False
-        self.start()
+        self.__bind_events()
 
     def __bind_events(self):
+        Publisher.subscribe(self.UpdateSampleTime, 'Update navigation sample time')
         Publisher.subscribe(self.UpdateCurrentCoords, 'Co-registered points')
 
+    def __unbind_events(self):
+        Publisher.unsubscribe(self.UpdateSampleTime, 'Update navigation sample time')
+        Publisher.unsubscribe(self.UpdateCurrentCoords, 'Co-registered points')
+
+    def UpdateSampleTime(self, pubsub_evt):
+        self.acquired = pubsub_evt.data
+
     def UpdateCurrentCoords(self, pubsub_evt):
-        self.coord = asarray(pubsub_evt.data[1])
+        # Only the coordinates of a tracker sample, the ones set with the
+        # mouse have no sample time.
+        acquired = self.acquired
+        self.acquired = None
+        if acquired is None or self._pause_ or not self.nav_id:
+            return
+
+        if self.initial_time is None:
+            self.initial_time = self.next_time = acquired
+        if acquired < self.next_time:
+            return
+        # The next sample is due timestamp seconds after this one was due,
+        # so the recording doesn't drift.
+        while self.next_time <= acquired:
+            self.next_time += self.timestamp
+
+        row = np.empty(self.coords.columns)
+        row[0] = acquired - self.initial_time
+        row[1:] = pubsub_evt.data[1][:6]
+        self.coords.append(row)
 
     def stop(self):
         self._pause_ = True
+        self.__unbind_events()
         #save coords dialog
         filename = dlg.ShowSaveCoordsDialog("coords.csv")
         if filename:
-            savetxt(filename, self.coord_list, delimiter=',', fmt='%.4f', header="time, x, y, z, a, b, g", comments="")
-
-    def run(self):
-        initial_time = time.time()
-        while self.nav_id:
-            relative_time = asarray(time.time() - initial_time)
-            time.sleep(self.timestamp)
-            if self.coord_list.size == 0:
-                self.coord_list = hstack((relative_time, self.coord))
-            else:
-                self.coord_list = vstack((self.coord_list, hstack((relative_time, self.coord))))
-            if self._pause_:
-                return
\ No newline at end of file
+            self.save(filename)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(b"time, x, y, z, a, b, g\n")
+            for chunk in self.coords.get_chunks():
+                np.savetxt(f, chunk, delimiter=',', fmt='%.4f')
@@ -23,11 +23,15 @@ import tempfile
 
 import numpy as np
 import vtk
+from vtk.util import numpy_support
 from wx.lib.pubsub import pub as Publisher
 
 import invesalius.constants as const
 import invesalius.data.converters as converters
+import invesalius.data.histogram as hist
 import invesalius.data.imagedata_utils as iu
+import invesalius.data.mask_boolean as mask_boolean
+import invesalius.data.stroke as stroke
 import invesalius.style as st
 import invesalius.session as ses
 import invesalius.utils as utils
@@ -41,11 +45,39 @@ OTHER=0
 PLIST=1
 WIDGET=2
 
+MASK_BLEND_OPACITY = 0.8
+
+
+def union_regions(r0, r1):
+    """
+    Returns the smallest region (yi, yf, xi, xf) containing the regions r0
+    and r1. Any of them may be None (empty region).
+    """
+    if r0 is None:
+        return r1
+    if r1 is None:
+        return r0
+    return (min(r0[0], r1[0]), max(r0[1], r1[1]),
+            min(r0[2], r1[2]), max(r0[3], r1[3]))
+
+
+def vtk_image_pixels(vtk_image, shape):
+    """
+    Returns a numpy view (rows, cols, components) sharing memory with the
+    scalars of the 2D vtk_image.
+    """
+    scalars = numpy_support.vtk_to_numpy(vtk_image.GetPointData().GetScalars())
+    return scalars.reshape(shape[0], shape[1], -1)
+
 
 class SliceBuffer(object):
     """ 
     This class is used as buffer that mantains the vtkImageData and numpy array
     from actual slices from each orientation.
+
+    The blend of image and mask (vtk_blend) is also kept, with the region
+    changed since it was blended (dirty_region). This way an edition only
+    re-blends the region it touched.
     """
     def __init__(self):
         self.index = -1
@@ -53,15 +85,30 @@ class SliceBuffer(object):
         self.mask = None
         self.vtk_image = None
         self.vtk_mask = None
+        self.vtk_blend = None
+        self.blend_inputs = (None, None)
+        self.dirty_region = None
+        self.edited_region = None
+
+    def add_dirty_region(self, region):
+        self.dirty_region = union_regions(self.dirty_region, region)
+
+    def discard_vtk_blend(self):
+        self.vtk_blend = None
+        self.blend_inputs = (None, None)
+        self.dirty_region = None
 
     def discard_vtk_mask(self):
         self.vtk_mask = None
+        self.discard_vtk_blend()
 
     def discard_vtk_image(self):
         self.vtk_image = None
+        self.discard_vtk_blend()
 
     def discard_mask(self):
         self.mask = None
+        self.edited_region = None
 
     def discard_image(self):
         self.image = None
@@ -72,6 +119,10 @@ class SliceBuffer(object):
         self.mask = None
         self.vtk_image = None
         self.vtk_mask = None
+        self.vtk_blend = None
+        self.blend_inputs = (None, None)
+        self.dirty_region = None
+        self.edited_region = None
 
 
 # Only one slice will be initialized per time (despite several viewers
@@ -81,8 +132,11 @@ class Slice(with_metaclass(utils.Singleton, object)):
     def __init__(self):
         self.current_mask = None
         self.blend_filter = None
-        self.histogram = None
+        self._mask_colour_table = None
         self._matrix = None
+        # Incremented each time the matrix changes (not by the mask
+        # edition), the data derived from the matrix is keyed by it.
+        self.matrix_generation = 0
         self.aux_matrices = {}
         self.state = const.STATE_DEFAULT
 
@@ -124,9 +178,9 @@ class Slice(with_metaclass(utils.Singleton, object)):
     @matrix.setter
     def matrix(self, value):
         self._matrix = value
-        i, e = value.min(), value.max()
-        r = int(e) - int(i)
-        self.histogram = np.histogram(self._matrix, r, (i, e))[0]
+        self.matrix_generation += 1
+        # Counted in a thread, the CLUT widgets get it from SliceHistogram.
+        hist.SliceHistogram().Compute(value, self.matrix_generation)
         self.center = [(s * d/2.0) for (d, s) in zip(self.matrix.shape[::-1], self.spacing)]
 
     @property
@@ -142,6 +196,8 @@ class Slice(with_metaclass(utils.Singleton, object)):
         # General slice control
         Publisher.subscribe(self.CreateSurfaceFromIndex,
                                  'Create surface from index')
+        Publisher.subscribe(self.ExportSurfacesFromThresholds,
+                                 'Export surfaces from thresholds')
         # Mask control
         Publisher.subscribe(self.__add_mask_thresh, 'Create new mask')
         Publisher.subscribe(self.__select_current_mask,
@@ -448,93 +504,152 @@ class Slice(with_metaclass(utils.Singleton, object)):
         return temp_file, matrix
 
     def edit_mask_pixel(self, operation, index, position, radius, orientation):
+        self.edit_mask_stroke(operation, index, [position], orientation)
+
+    def edit_mask_stroke(self, operation, index, positions, orientation):
+        """
+        Sweeps the brush index over the positions (a stroke) in the mask
+        buffer of the given orientation, applying the brush operation.
+
+        Only the region of the coloured mask touched by the stroke is
+        updated. Returns that region as (yi, yf, xi, xf) or None if the
+        stroke is outside the slice.
+        """
         mask = self.buffer_slices[orientation].mask
         image = self.buffer_slices[orientation].image
         thresh_min, thresh_max = self.current_mask.edition_threshold_range
 
-        if hasattr(position, '__iter__'):
-            px, py = position
-            if orientation == 'AXIAL':
-                sx = self.spacing[0]
-                sy = self.spacing[1]
-            elif orientation == 'CORONAL':
-                sx = self.spacing[0]
-                sy = self.spacing[2]
-            elif orientation == 'SAGITAL':
-                sx = self.spacing[2]
-                sy = self.spacing[1]
-
-        else:
-            if orientation == 'AXIAL':
-                sx = self.spacing[0]
-                sy = self.spacing[1]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-            elif orientation == 'CORONAL':
-                sx = self.spacing[0]
-                sy = self.spacing[2]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-            elif orientation == 'SAGITAL':
-                sx = self.spacing[2]
-                sy = self.spacing[1]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-
-        cx = index.shape[1] / 2 + 1
-        cy = index.shape[0] / 2 + 1
-        xi = int(px - index.shape[1] + cx)
-        xf = int(xi + index.shape[1])
-        yi = int(py - index.shape[0] + cy)
-        yf = int(yi + index.shape[0])
-
-        if yi < 0:
-            index = index[abs(yi):,:]
-            yi = 0
-        if yf > image.shape[0]:
-            index = index[:index.shape[0]-(yf-image.shape[0]), :]
-            yf = image.shape[0]
-
-        if xi < 0:
-            index = index[:,abs(xi):]
-            xi = 0
-        if xf > image.shape[1]:
-            index = index[:,:index.shape[1]-(xf-image.shape[1])]
-            xf = image.shape[1]
+        positions = [stroke.to_pixel_coord(p, mask.shape[1]) for p in positions]
+        centers = stroke.interpolate_positions(positions)
+        footprint, region = stroke.stroke_footprint(index, centers, image.shape)
 
         # Verifying if the points is over the image array.
-        if (not 0 <= xi <= image.shape[1] and not 0 <= xf <= image.shape[1]) or \
-           (not 0 <= yi <= image.shape[0] and not 0 <= yf <= image.shape[0]):
-            return
-
+        if footprint is None:
+            return None
 
-        roi_m = mask[yi:yf,xi:xf]
+        yi, yf, xi, xf = region
+        roi_m = mask[yi:yf, xi:xf]
         roi_i = image[yi:yf, xi:xf]
-
-        # Checking if roi_i has at least one element.
-        if roi_i.size:
-            if operation == const.BRUSH_THRESH:
-                # It's a trick to make points between threshold gets value 254
-                # (1 * 253 + 1) and out ones gets value 1 (0 * 253 + 1).
-                roi_m[index] = (((roi_i[index] >= thresh_min)
-                                 & (roi_i[index] <= thresh_max)) * 253) + 1
-            elif operation == const.BRUSH_THRESH_ERASE:
-                roi_m[index] = (((roi_i[index] < thresh_min)
-                                 | (roi_i[index] > thresh_max)) * 253) + 1
-            elif operation == const.BRUSH_THRESH_ADD_ONLY:
-                roi_m[((index) & (roi_i >= thresh_min) & (roi_i <= thresh_max))] = 254
-            elif operation == const.BRUSH_THRESH_ERASE_ONLY:
-                roi_m[((index) & ((roi_i < thresh_min) | (roi_i > thresh_max)))] = 1
-            elif operation == const.BRUSH_DRAW:
-                roi_m[index] = 254
-            elif operation == const.BRUSH_ERASE:
-                roi_m[index] = 1
-            self.buffer_slices[orientation].discard_vtk_mask()
+        stroke.apply_brush(operation, roi_m, roi_i, footprint,
+                           thresh_min, thresh_max)
+        buffer_ = self.buffer_slices[orientation]
+        buffer_.edited_region = union_regions(buffer_.edited_region, region)
+        self.update_vtk_mask_region(orientation, region)
 
         # Marking the project as changed
         session = ses.Session()
         session.ChangeProject()
 
+        return region
+
+    def update_vtk_mask_region(self, orientation, region):
+        """
+        Recolours only the given region (yi, yf, xi, xf) of the coloured
+        mask buffer from the mask buffer and marks it to be re-blended. If
+        there is no coloured mask to patch the coloured mask is discarded
+        and rebuilt in the next render.
+        """
+        buffer_ = self.buffer_slices[orientation]
+        vtk_mask = buffer_.vtk_mask
+        if vtk_mask is None or self._mask_colour_table is None \
+           or buffer_.mask is None:
+            buffer_.discard_vtk_mask()
+            return
+
+        yi, yf, xi, xf = region
+        rgba = vtk_image_pixels(vtk_mask, buffer_.mask.shape)
+        rgba[yi:yf, xi:xf] = self._mask_colour_table[buffer_.mask[yi:yf, xi:xf]]
+        vtk_mask.Modified()
+        buffer_.add_dirty_region(region)
+
+    def refresh_mask_region(self, orientation, slice_number, region=None):
+        """
+        Updates the buffers after the mask slice slice_number from the given
+        orientation was modified directly in the mask matrix, inside region
+        (yi, yf, xi, xf) or in the whole slice if region is None. Only the
+        parts of the buffers that intersect the modified region are updated.
+        """
+        if region is None:
+            dy, dx = self._get_mask_slice_shape(orientation)
+            region = (0, dy, 0, dx)
+
+        buffer_ = self.buffer_slices[orientation]
+        if buffer_.index == slice_number and buffer_.mask is not None:
+            yi, yf, xi, xf = region
+            buffer_.mask[yi:yf, xi:xf] = self._get_mask_slice_region(orientation,
+                                                                     slice_number,
+                                                                     region)
+            self.update_vtk_mask_region(orientation, region)
+
+        self._refresh_intersecting_buffers(orientation, slice_number, region)
+
+    def _refresh_intersecting_buffers(self, orientation, slice_number, region):
+        """
+        Copies to the mask buffers from the other orientations the line
+        they share with the region (yi, yf, xi, xf) of the slice
+        slice_number from orientation.
+        """
+        yi, yf, xi, xf = region
+        for o, buffer_ in self.buffer_slices.items():
+            if o == orientation or buffer_.mask is None:
+                continue
+            n = buffer_.index
+            # The intersection of two orthogonal slices is a line: a row or
+            # a column of the other orientation slice.
+            if orientation == 'AXIAL' and o == 'CORONAL':
+                if not yi <= n < yf:
+                    continue
+                o_region = (slice_number, slice_number + 1, xi, xf)
+            elif orientation == 'AXIAL' and o == 'SAGITAL':
+                if not xi <= n < xf:
+                    continue
+                o_region = (slice_number, slice_number + 1, yi, yf)
+            elif orientation == 'CORONAL' and o == 'AXIAL':
+                if not yi <= n < yf:
+                    continue
+                o_region = (slice_number, slice_number + 1, xi, xf)
+            elif orientation == 'CORONAL' and o == 'SAGITAL':
+                if not xi <= n < xf:
+                    continue
+                o_region = (yi, yf, slice_number, slice_number + 1)
+            elif orientation == 'SAGITAL' and o == 'AXIAL':
+                if not yi <= n < yf:
+                    continue
+                o_region = (xi, xf, slice_number, slice_number + 1)
+            elif orientation == 'SAGITAL' and o == 'CORONAL':
+                if not xi <= n < xf:
+                    continue
+                o_region = (yi, yf, slice_number, slice_number + 1)
+
+            oyi, oyf, oxi, oxf = o_region
+            buffer_.mask[oyi:oyf, oxi:oxf] = self._get_mask_slice_region(o, n,
+                                                                         o_region)
+            self.update_vtk_mask_region(o, o_region)
+
+    def _get_mask_slice_shape(self, orientation):
+        dz, dy, dx = self.current_mask.matrix.shape
+        if orientation == 'AXIAL':
+            return dy - 1, dx - 1
+        elif orientation == 'CORONAL':
+            return dz - 1, dx - 1
+        elif orientation == 'SAGITAL':
+            return dz - 1, dy - 1
+
+    def _get_mask_slice_region(self, orientation, slice_number, region):
+        """
+        Returns the region (yi, yf, xi, xf) of the slice_number slice from
+        the current mask matrix (without the first row and column used as
+        flags). Only that region is read, which matters when the mask is
+        not stored as a dense array.
+        """
+        n = slice_number + 1
+        yi, yf, xi, xf = region
+        if orientation == 'AXIAL':
+            return self.current_mask.matrix[n, yi+1:yf+1, xi+1:xf+1]
+        elif orientation == 'CORONAL':
+            return self.current_mask.matrix[yi+1:yf+1, n, xi+1:xf+1]
+        elif orientation == 'SAGITAL':
+            return self.current_mask.matrix[yi+1:yf+1, xi+1:xf+1, n]
 
     def GetSlices(self, orientation, slice_number, number_slices,
                   inverted=False, border_size=1.0):
@@ -561,7 +676,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
                     mask = converters.to_vtk(n_mask, self.spacing, slice_number, orientation)
                     mask = self.do_colour_mask(mask, self.opacity)
                     self.buffer_slices[orientation].mask = n_mask
-                final_image = self.do_blend(image, mask)
+                final_image = self.do_blend_buffer(orientation, image, mask)
                 self.buffer_slices[orientation].vtk_mask = mask
             else:
                 final_image = image
@@ -577,7 +692,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
                 n_mask = self.get_mask_slice(orientation, slice_number)
                 mask = converters.to_vtk(n_mask, self.spacing, slice_number, orientation)
                 mask = self.do_colour_mask(mask, self.opacity)
-                final_image = self.do_blend(image, mask)
+                final_image = self.do_blend_buffer(orientation, image, mask)
             else:
                 n_mask = None
                 final_image = image
@@ -790,7 +905,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
         if orientation == 'AXIAL':
             if self.current_mask.matrix[n, 0, 0] == 0:
                 mask = self.current_mask.matrix[n, 1:, 1:]
-                mask[:] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
+                self.current_mask.matrix[n, 1:, 1:] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
                                                                          slice_number),
                                                                             mask)
                 self.current_mask.matrix[n, 0, 0] = 1
@@ -800,7 +915,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
         elif orientation == 'CORONAL':
             if self.current_mask.matrix[0, n, 0] == 0:
                 mask = self.current_mask.matrix[1:, n, 1:]
-                mask[:] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
+                self.current_mask.matrix[1:, n, 1:] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
                                                                          slice_number),
                                                                             mask)
                 self.current_mask.matrix[0, n, 0] = 1
@@ -810,7 +925,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
         elif orientation == 'SAGITAL':
             if self.current_mask.matrix[0, 0, n] == 0:
                 mask = self.current_mask.matrix[1:, 1:, n]
-                mask[:] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
+                self.current_mask.matrix[1:, 1:, n] = self.do_threshold_to_a_slice(self.get_image_slice(orientation,
                                                                          slice_number),
                                                                             mask)
                 self.current_mask.matrix[0, 0, n] = 1
@@ -953,6 +1068,13 @@ class Slice(with_metaclass(utils.Singleton, object)):
         self.do_threshold_to_all_slices(mask)
         Publisher.sendMessage('Create surface', (self, mask, surface_parameters))
 
+    def ExportSurfacesFromThresholds(self, pubsub_evt):
+        # exports is a list of (filename, threshold_range), the surfaces are
+        # created from the image, without masks.
+        exports, filetype = pubsub_evt.data
+        Publisher.sendMessage('Create surfaces to export',
+                              (self, exports, filetype))
+
     def GetOutput(self):
         return self.blend_filter.GetOutput()
 
@@ -1280,6 +1402,10 @@ class Slice(with_metaclass(utils.Singleton, object)):
         lut_mask.Build()
         # self.lut_mask = lut_mask
 
+        # Keeping the colours as a numpy table (value -> RGBA) to recolour
+        # only the edited regions of the mask (see update_vtk_mask_region).
+        self._mask_colour_table = numpy_support.vtk_to_numpy(lut_mask.GetTable()).copy()
+
         # map the input image through a lookup table
         img_colours_mask = vtk.vtkImageMapToColors()
         img_colours_mask.SetLookupTable(lut_mask)
@@ -1329,55 +1455,97 @@ class Slice(with_metaclass(utils.Singleton, object)):
         blend_imagedata = vtk.vtkImageBlend()
         blend_imagedata.SetBlendModeToNormal()
         # blend_imagedata.SetOpacity(0, 1.0)
-        blend_imagedata.SetOpacity(1, 0.8)
+        blend_imagedata.SetOpacity(1, MASK_BLEND_OPACITY)
         blend_imagedata.SetInputData(imagedata)
         blend_imagedata.AddInputData(mask)
         blend_imagedata.Update()
 
         return blend_imagedata.GetOutput()
 
+    def do_blend_buffer(self, orientation, imagedata, mask):
+        """
+        Blends image with the mask reusing the blend kept in the buffer from
+        the given orientation. If image and mask are the same used to
+        generate that blend, only its dirty region is re-blended.
+        """
+        buffer_ = self.buffer_slices[orientation]
+        if buffer_.vtk_blend is None \
+           or buffer_.blend_inputs[0] is not imagedata \
+           or buffer_.blend_inputs[1] is not mask:
+            buffer_.vtk_blend = self.do_blend(imagedata, mask)
+            buffer_.blend_inputs = (imagedata, mask)
+        elif buffer_.dirty_region is not None:
+            self._reblend_region(buffer_, buffer_.dirty_region)
+
+        buffer_.dirty_region = None
+        return buffer_.vtk_blend
+
+    def _reblend_region(self, buffer_, region):
+        """
+        Blends (as do_blend) the image and mask from buffer_ only inside the
+        region (yi, yf, xi, xf), writing the result in its kept blend.
+        """
+        yi, yf, xi, xf = region
+        imagedata, mask = buffer_.blend_inputs
+        dy, dx = buffer_.mask.shape
+
+        out = vtk_image_pixels(buffer_.vtk_blend, (dy, dx))[yi:yf, xi:xf]
+        bg = vtk_image_pixels(imagedata, (dy, dx))[yi:yf, xi:xf]
+        fg = vtk_image_pixels(mask, (dy, dx))[yi:yf, xi:xf]
+
+        nc = min(out.shape[2], 3)
+        alpha = fg[:, :, 3:4] * (MASK_BLEND_OPACITY / 255.0)
+        bg_rgb = bg[:, :, :nc].astype('float32')
+        blended = bg_rgb + (fg[:, :, :nc] - bg_rgb) * alpha
+        out[:, :, :nc] = np.round(blended)
+        buffer_.vtk_blend.Modified()
+
     def _do_boolean_op(self, pubsub_evt):
         op, m1, m2 = pubsub_evt.data
         self.do_boolean_op(op, m1, m2)
 
 
     def do_boolean_op(self, op, m1, m2):
+        self.do_boolean_expression((op, m1, m2))
+
+    def _boolean_expression_name(self, expression):
         name_ops = {const.BOOLEAN_UNION: _(u"Union"), 
                     const.BOOLEAN_DIFF: _(u"Diff"),
                     const.BOOLEAN_AND: _(u"Intersection"),
                     const.BOOLEAN_XOR: _(u"XOR")}
 
+        names = [name_ops[expression[0]]]
+        for operand in expression[1:]:
+            if mask_boolean.is_expression(operand):
+                names.append(self._boolean_expression_name(operand))
+            else:
+                names.append(operand.name)
+        return u"_".join(names)
 
-        name = u"%s_%s_%s" % (name_ops[op], m1.name, m2.name)
+    def do_boolean_expression(self, expression, name=None):
+        """
+        Creates a new mask from a boolean expression of masks, like
+        (const.BOOLEAN_DIFF, (const.BOOLEAN_UNION, m1, m2), m3). See
+        invesalius.data.mask_boolean.
+        """
+        if name is None:
+            name = self._boolean_expression_name(expression)
         proj = Project()
         mask_dict = proj.mask_dict
         names_list = [mask_dict[i].name for i in mask_dict.keys()]
         new_name = utils.next_copy_name(name, names_list)
 
+        for mask in set(mask_boolean.leaves(expression)):
+            self.do_threshold_to_all_slices(mask)
+
         future_mask = Mask()
         future_mask.create_mask(self.matrix.shape)
         future_mask.name = new_name
-
         future_mask.matrix[:] = 1
-        m = future_mask.matrix[1:, 1:, 1:]
-
-        self.do_threshold_to_all_slices(m1)
-        m1 = m1.matrix[1:, 1:, 1:]
-
-        self.do_threshold_to_all_slices(m2)
-        m2 = m2.matrix[1:, 1:, 1:]
 
-        if op == const.BOOLEAN_UNION:
-            m[:] = ((m1 > 2) + (m2 > 2)) * 255
-
-        elif op == const.BOOLEAN_DIFF:
-            m[:] = ((m1 > 2) - ((m1 > 2) & (m2 > 2))) * 255
-
-        elif op == const.BOOLEAN_AND:
-            m[:] = ((m1 > 2) & (m2 > 2)) * 255
-
-        elif op == const.BOOLEAN_XOR:
-            m[:] = np.logical_xor((m1 > 2), (m2 > 2)) * 255
+        mask_boolean.evaluate(mask_boolean.map_leaves(expression,
+                                                      lambda m: m.matrix),
+                              future_mask.matrix)
 
         for o in self.buffer_slices:
             self.buffer_slices[o].discard_mask()
@@ -1424,10 +1592,13 @@ class Slice(with_metaclass(utils.Singleton, object)):
         self.current_mask.save_history(index, orientation, b_mask, p_mask)
         self.current_mask.was_edited = True
 
-        for o in self.buffer_slices:
-            if o != orientation:
-                self.buffer_slices[o].discard_mask()
-                self.buffer_slices[o].discard_vtk_mask()
+        # Only the line the other orientations share with the edited region
+        # has to be updated in their buffers.
+        region = self.buffer_slices[orientation].edited_region
+        if region is None:
+            region = (0, b_mask.shape[0], 0, b_mask.shape[1])
+        self.buffer_slices[orientation].edited_region = None
+        self._refresh_intersecting_buffers(orientation, index, region)
         Publisher.sendMessage('Reload actual slice')
 
     def apply_reorientation(self):
@@ -1495,6 +1666,7 @@ class Slice(with_metaclass(utils.Singleton, object)):
             self.matrix[:] = self.matrix[:, ::-1]
         elif axis == 2:
             self.matrix[:] = self.matrix[:, :, ::-1]
+        self.matrix_generation += 1
 
         for buffer_ in self.buffer_slices.values():
             buffer_.discard_buffer()
@@ -0,0 +1,178 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Brush stroke engine used by the mask editor and the watershed markers.
+
+Instead of stamping the brush once per mouse event, the positions reported
+between two renders are collected in a BrushStroke and the brush is swept
+along the (interpolated) path in a single vectorized operation.
+"""
+
+import numpy as np
+
+import invesalius.constants as const
+
+# Maximum number of (center, brush pixel) pairs evaluated at once when
+# rasterizing a stroke. It bounds the memory used by very long strokes done
+# with big brushes.
+MAX_STAMP_ELEMENTS = 2 ** 20
+
+
+class BrushStroke(object):
+    """
+    Accumulates the brush positions of a stroke until they are rasterized.
+
+    The last rasterized position is kept as the start of the next segment,
+    this way consecutive flushes are connected without gaps.
+    """
+    def __init__(self):
+        self.operation = None
+        self.positions = []
+        self._last_position = None
+
+    def start(self, operation):
+        self.operation = operation
+        self.positions = []
+        self._last_position = None
+
+    def add(self, position):
+        self.positions.append(position)
+
+    def has_pending(self):
+        return bool(self.positions)
+
+    def pop_positions(self):
+        """
+        Returns the positions not rasterized yet, preceded by the last
+        rasterized one.
+        """
+        positions = self.positions
+        if self._last_position is not None:
+            positions = [self._last_position] + positions
+        if self.positions:
+            self._last_position = self.positions[-1]
+        self.positions = []
+        return positions
+
+
+def to_pixel_coord(position, width):
+    """
+    Converts a position given by the viewer (a (px, py) pair or an index in
+    the flattened slice) to a (px, py) pair.
+    """
+    if hasattr(position, '__iter__'):
+        px, py = position
+    else:
+        py, px = divmod(int(position), width)
+    return px, py
+
+
+def interpolate_positions(positions):
+    """
+    Returns the integer brush centers (px, py) of a polyline passing through
+    positions. Consecutive centers are at most one pixel apart, so the swept
+    brush has no gaps even when the mouse moves fast.
+
+    >>> interpolate_positions([(0, 0), (3, 1)]).tolist()
+    [[0, 0], [1, 0], [2, 1], [3, 1]]
+    """
+    points = np.asarray(positions, dtype='float64').reshape(-1, 2)
+    if points.shape[0] == 1:
+        return np.round(points).astype('int64')
+
+    deltas = np.diff(points, axis=0)
+    steps = np.maximum(np.ceil(np.abs(deltas).max(1)).astype('int64'), 1)
+    segments = np.repeat(np.arange(deltas.shape[0]), steps)
+    starts = np.repeat(np.cumsum(steps) - steps, steps)
+    t = (np.arange(steps.sum()) - starts) / np.repeat(steps, steps).astype('float64')
+
+    centers = np.empty((segments.shape[0] + 1, 2), dtype='float64')
+    centers[:-1] = points[segments] + deltas[segments] * t[:, np.newaxis]
+    centers[-1] = points[-1]
+    return np.round(centers).astype('int64')
+
+
+def stroke_footprint(index, centers, shape):
+    """
+    Rasterizes the brush index (a boolean 2D array) swept along centers.
+
+    Returns the footprint (a boolean array) and the region of the slice it
+    covers as (yi, yf, xi, xf). If the stroke is entirely outside the slice
+    returns (None, None).
+    """
+    h, w = index.shape
+    # Same anchor used by the cursor: the brush pixel (ay, ax) is placed over
+    # the center.
+    ay = h - (h // 2 + 1)
+    ax = w - (w // 2 + 1)
+
+    cx = centers[:, 0]
+    cy = centers[:, 1]
+
+    yi = max(int(cy.min()) - ay, 0)
+    yf = min(int(cy.max()) - ay + h, shape[0])
+    xi = max(int(cx.min()) - ax, 0)
+    xf = min(int(cx.max()) - ax + w, shape[1])
+
+    if yi >= yf or xi >= xf:
+        return None, None
+
+    footprint = np.zeros((yf - yi, xf - xi), dtype='bool')
+    oy, ox = np.nonzero(index)
+    if not oy.size:
+        return None, None
+    oy = oy - ay - yi
+    ox = ox - ax - xi
+
+    chunk = max(MAX_STAMP_ELEMENTS // oy.size, 1)
+    for i in range(0, centers.shape[0], chunk):
+        ys = (cy[i:i+chunk, np.newaxis] + oy).ravel()
+        xs = (cx[i:i+chunk, np.newaxis] + ox).ravel()
+        inside = (ys >= 0) & (ys < footprint.shape[0]) \
+                & (xs >= 0) & (xs < footprint.shape[1])
+        footprint[ys[inside], xs[inside]] = True
+
+    return footprint, (yi, yf, xi, xf)
+
+
+def apply_brush(operation, roi_m, roi_i, footprint, thresh_min, thresh_max):
+    """
+    Applies the brush operation (one of const.BRUSH_*) to the mask region
+    roi_m over the pixels marked in footprint. roi_i is the image region
+    used by the threshold operations.
+    """
+    if operation == const.BRUSH_THRESH:
+        # It's a trick to make points between threshold gets value 254
+        # (1 * 253 + 1) and out ones gets value 1 (0 * 253 + 1).
+        values = roi_i[footprint]
+        roi_m[footprint] = (((values >= thresh_min)
+                             & (values <= thresh_max)) * 253) + 1
+    elif operation == const.BRUSH_THRESH_ERASE:
+        values = roi_i[footprint]
+        roi_m[footprint] = (((values < thresh_min)
+                             | (values > thresh_max)) * 253) + 1
+    elif operation == const.BRUSH_THRESH_ADD_ONLY:
+        roi_m[footprint & (roi_i >= thresh_min) & (roi_i <= thresh_max)] = 254
+    elif operation == const.BRUSH_THRESH_ERASE_ONLY:
+        roi_m[footprint & ((roi_i < thresh_min) | (roi_i > thresh_max))] = 1
+    elif operation == const.BRUSH_DRAW:
+        roi_m[footprint] = 254
+    elif operation == const.BRUSH_ERASE:
+        roi_m[footprint] = 1
@@ -35,6 +35,8 @@ from wx.lib.pubsub import pub as Publisher
 import invesalius.constants as const
 import invesalius.data.converters as converters
 import invesalius.data.cursor_actors as ca
+import invesalius.data.mask_storage as mask_storage
+import invesalius.data.stroke as stroke
 import invesalius.session as ses
 
 import numpy as np
@@ -718,6 +720,51 @@ class ChangeSliceInteractorStyle(DefaultInteractorStyle):
         self.last_position = position[1]
 
 
+class StrokePainter(object):
+    """
+    Paints the brush strokes of an interactor style. The positions of the
+    mouse moves are only collected and the stroke is rasterized, with
+    paint(operation, pixels, positions), once per render.
+    """
+    def __init__(self, viewer, paint):
+        self.viewer = viewer
+        self.paint = paint
+        self.stroke = stroke.BrushStroke()
+        self._scheduled = False
+
+    def start(self, operation, position):
+        self.stroke.start(operation)
+        self.stroke.add(position)
+        self.flush()
+
+    def add(self, operation, position):
+        if operation != self.stroke.operation:
+            self.flush()
+            self.stroke.operation = operation
+        self.stroke.add(position)
+        if not self._scheduled:
+            self._scheduled = True
+            wx.CallAfter(self._on_render)
+
+    def _on_render(self):
+        self._scheduled = False
+        if self.stroke.has_pending():
+            self.flush()
+            # TODO: To create a new function to reload images to viewer.
+            self.viewer.OnScrollBar(update3D=False)
+
+    def flush(self):
+        """
+        Rasterizes the brush along all the positions collected since the
+        last flush.
+        """
+        if not self.stroke.has_pending():
+            return
+        positions = self.stroke.pop_positions()
+        self.paint(self.stroke.operation,
+                   self.viewer.slice_data.cursor.GetPixels(), positions)
+
+
 class EditorConfig(with_metaclass(utils.Singleton, object)):
     def __init__(self):
         self.operation = const.BRUSH_THRESH
@@ -750,6 +797,8 @@ class EditorInteractorStyle(DefaultInteractorStyle):
         self.AddObserver("MouseWheelForwardEvent",self.EOnScrollForward)
         self.AddObserver("MouseWheelBackwardEvent", self.EOnScrollBackward)
 
+        self.stroke = StrokePainter(viewer, self.paint_stroke)
+
         Publisher.subscribe(self.set_bsize, 'Set edition brush size')
         Publisher.subscribe(self.set_bformat, 'Set brush format')
         Publisher.subscribe(self.set_boperation, 'Set edition operation')
@@ -858,12 +907,8 @@ class EditorInteractorStyle(DefaultInteractorStyle):
         wx, wy, wz = viewer.get_coordinate_cursor(mouse_x, mouse_y, self.picker)
         position = viewer.get_slice_pixel_coord_by_world_pos(wx, wy, wz)
 
-        cursor = slice_data.cursor
-        radius = cursor.radius
-
         slice_data.cursor.SetPosition((wx, wy, wz))
-        viewer.slice_.edit_mask_pixel(operation, cursor.GetPixels(),
-                                    position, radius, viewer.orientation)
+        self.stroke.start(operation, position)
         #viewer._flush_buffer = True
 
         # TODO: To create a new function to reload images to viewer.
@@ -902,24 +947,23 @@ class EditorInteractorStyle(DefaultInteractorStyle):
         slice_data.cursor.SetPosition((wx, wy, wz))
 
         if (self.left_pressed):
-            cursor = slice_data.cursor
-            radius = cursor.radius
-
             position = viewer.get_slice_pixel_coord_by_world_pos(wx, wy, wz)
 
             slice_data.cursor.SetPosition((wx, wy, wz))
-            viewer.slice_.edit_mask_pixel(operation, cursor.GetPixels(),
-                                          position, radius, viewer.orientation)
-
-            viewer.OnScrollBar(update3D=False)
+            self.stroke.add(operation, position)
 
         else:
             viewer.interactor.Render()
 
+    def paint_stroke(self, operation, pixels, positions):
+        self.viewer.slice_.edit_mask_stroke(operation, pixels, positions,
+                                            self.viewer.orientation)
+
     def OnBrushRelease(self, evt, obj):
         if (self.viewer.slice_.buffer_slices[self.orientation].mask is None):
             return
 
+        self.stroke.flush()
         self.viewer._flush_buffer = True
         self.viewer.slice_.apply_slice_buffer_to_mask(self.orientation)
         self.viewer._flush_buffer = False
@@ -1054,6 +1098,8 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
         self.AddObserver("LeftButtonReleaseEvent", self.OnBrushRelease)
         self.AddObserver("MouseMoveEvent", self.OnBrushMove)
 
+        self.stroke = StrokePainter(viewer, self.paint_stroke)
+
         Publisher.subscribe(self.expand_watershed, 'Expand watershed to 3D ' + self.orientation)
         Publisher.subscribe(self.set_bsize, 'Set watershed brush size')
         Publisher.subscribe(self.set_bformat, 'Set watershed brush format')
@@ -1200,9 +1246,6 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
         slice_data.cursor.Show()
         slice_data.cursor.SetPosition(coord)
 
-        cursor = slice_data.cursor
-        radius = cursor.radius
-
         operation = self.config.operation
 
         if operation == BRUSH_FOREGROUND:
@@ -1216,15 +1259,7 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
             elif iren.GetShiftKey():
                 operation = BRUSH_ERASE
 
-        n = self.viewer.slice_data.number
-        self.edit_mask_pixel(operation, n, cursor.GetPixels(),
-                                    position, radius, self.orientation)
-        if self.orientation == 'AXIAL':
-            mask = self.matrix[n, :, :]
-        elif self.orientation == 'CORONAL':
-            mask = self.matrix[:, n, :]
-        elif self.orientation == 'SAGITAL':
-            mask = self.matrix[:, :, n]
+        self.stroke.start(operation, position)
         # TODO: To create a new function to reload images to viewer.
         viewer.OnScrollBar()
 
@@ -1245,9 +1280,7 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
         slice_data.cursor.SetPosition(coord)
 
         if (self.left_pressed):
-            cursor = slice_data.cursor
             position = self.viewer.get_slice_pixel_coord_by_world_pos(*coord)
-            radius = cursor.radius
 
             if isinstance(position, int) and position < 0:
                 position = viewer.calculate_matrix_position(coord)
@@ -1265,39 +1298,34 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
                 elif iren.GetShiftKey():
                     operation = BRUSH_ERASE
 
-            n = self.viewer.slice_data.number
-            self.edit_mask_pixel(operation, n, cursor.GetPixels(),
-                                        position, radius, self.orientation)
-            if self.orientation == 'AXIAL':
-                mask = self.matrix[n, :, :]
-            elif self.orientation == 'CORONAL':
-                mask = self.matrix[:, n, :]
-            elif self.orientation == 'SAGITAL':
-                mask = self.matrix[:, :, n]
-            # TODO: To create a new function to reload images to viewer.
-            viewer.OnScrollBar(update3D=False)
+            self.stroke.add(operation, position)
 
         else:
             viewer.interactor.Render()
 
+    def paint_stroke(self, operation, pixels, positions):
+        n = self.viewer.slice_data.number
+        self.edit_mask_stroke(operation, n, pixels, positions,
+                              self.orientation)
+
     def OnBrushRelease(self, evt, obj):
+        self.stroke.flush()
         n = self.viewer.slice_data.number
-        self.viewer.slice_.discard_all_buffers()
         if self.orientation == 'AXIAL':
             image = self.viewer.slice_.matrix[n]
-            mask = self.viewer.slice_.current_mask.matrix[n+1, 1:, 1:]
+            mask_key = (n+1, slice(1, None), slice(1, None))
             self.viewer.slice_.current_mask.matrix[n+1, 0, 0] = 1
             markers = self.matrix[n]
 
         elif self.orientation == 'CORONAL':
             image = self.viewer.slice_.matrix[:, n, :]
-            mask = self.viewer.slice_.current_mask.matrix[1:, n+1, 1:]
+            mask_key = (slice(1, None), n+1, slice(1, None))
             self.viewer.slice_.current_mask.matrix[0, n+1, 0]
             markers = self.matrix[:, n, :]
 
         elif self.orientation == 'SAGITAL':
             image = self.viewer.slice_.matrix[:, :, n]
-            mask = self.viewer.slice_.current_mask.matrix[1: , 1:, n+1]
+            mask_key = (slice(1, None), slice(1, None), n+1)
             self.viewer.slice_.current_mask.matrix[0 , 0, n+1]
             markers = self.matrix[:, :, n]
 
@@ -1336,16 +1364,19 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
                     tmp_image = image - image.min().astype('uint16')
                     tmp_mask = watershed_ift(tmp_image, markers.astype('int16'), bstruct)
 
-            if self.viewer.overwrite_mask:
-                mask[:] = 0
-                mask[tmp_mask == 1] = 253
-            else:
-                mask[(tmp_mask==2) & ((mask == 0) | (mask == 2) | (mask == 253))] = 2
-                mask[(tmp_mask==1) & ((mask == 0) | (mask == 2) | (mask == 253))] = 253
+            with mask_storage.edit_region(self.viewer.slice_.current_mask.matrix,
+                                          mask_key) as mask:
+                if self.viewer.overwrite_mask:
+                    mask[:] = 0
+                    mask[tmp_mask == 1] = 253
+                else:
+                    mask[(tmp_mask==2) & ((mask == 0) | (mask == 2) | (mask == 253))] = 2
+                    mask[(tmp_mask==1) & ((mask == 0) | (mask == 2) | (mask == 253))] = 253
 
 
             self.viewer.slice_.current_mask.was_edited = True
             self.viewer.slice_.current_mask.clear_history()
+            self.viewer.slice_.refresh_mask_region(self.orientation, n)
 
             # Marking the project as changed
             session = ses.Session()
@@ -1354,6 +1385,9 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
         Publisher.sendMessage('Reload actual slice')
 
     def edit_mask_pixel(self, operation, n, index, position, radius, orientation):
+        self.edit_mask_stroke(operation, n, index, [position], orientation)
+
+    def edit_mask_stroke(self, operation, n, index, positions, orientation):
         if orientation == 'AXIAL':
             mask = self.matrix[n, :, :]
         elif orientation == 'CORONAL':
@@ -1361,80 +1395,31 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
         elif orientation == 'SAGITAL':
             mask = self.matrix[:, :, n]
 
-        spacing = self.viewer.slice_.spacing
-        if hasattr(position, '__iter__'):
-            px, py = position
-            if orientation == 'AXIAL':
-                sx = spacing[0]
-                sy = spacing[1]
-            elif orientation == 'CORONAL':
-                sx = spacing[0]
-                sy = spacing[2]
-            elif orientation == 'SAGITAL':
-                sx = spacing[2]
-                sy = spacing[1]
-
-        else:
-            if orientation == 'AXIAL':
-                sx = spacing[0]
-                sy = spacing[1]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-            elif orientation == 'CORONAL':
-                sx = spacing[0]
-                sy = spacing[2]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-            elif orientation == 'SAGITAL':
-                sx = spacing[2]
-                sy = spacing[1]
-                py = position / mask.shape[1]
-                px = position % mask.shape[1]
-
-        cx = index.shape[1] / 2 + 1
-        cy = index.shape[0] / 2 + 1
-        xi = int(px - index.shape[1] + cx)
-        xf = int(xi + index.shape[1])
-        yi = int(py - index.shape[0] + cy)
-        yf = int(yi + index.shape[0])
-
-        if yi < 0:
-            index = index[abs(yi):,:]
-            yi = 0
-        if yf > mask.shape[0]:
-            index = index[:index.shape[0]-(yf-mask.shape[0]), :]
-            yf = mask.shape[0]
-
-        if xi < 0:
-            index = index[:,abs(xi):]
-            xi = 0
-        if xf > mask.shape[1]:
-            index = index[:,:index.shape[1]-(xf-mask.shape[1])]
-            xf = mask.shape[1]
+        positions = [stroke.to_pixel_coord(p, mask.shape[1]) for p in positions]
+        centers = stroke.interpolate_positions(positions)
+        footprint, region = stroke.stroke_footprint(index, centers, mask.shape)
 
         # Verifying if the points is over the image array.
-        if (not 0 <= xi <= mask.shape[1] and not 0 <= xf <= mask.shape[1]) or \
-           (not 0 <= yi <= mask.shape[0] and not 0 <= yf <= mask.shape[0]):
+        if footprint is None:
             return
 
-        roi_m = mask[yi:yf,xi:xf]
-
-        # Checking if roi_i has at least one element.
-        if roi_m.size:
-            roi_m[index] = operation
+        yi, yf, xi, xf = region
+        roi_m = mask[yi:yf, xi:xf]
+        roi_m[footprint] = operation
 
     def expand_watershed(self, pubsub_evt):
         markers = self.matrix
         image = self.viewer.slice_.matrix
         self.viewer.slice_.do_threshold_to_all_slices()
-        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
+        mask_matrix = self.viewer.slice_.current_mask.matrix
+        mask_shape = tuple(i - 1 for i in mask_matrix.shape)
         ww = self.viewer.slice_.window_width
         wl = self.viewer.slice_.window_level
         if BRUSH_BACKGROUND in markers and BRUSH_FOREGROUND in markers:
             #w_algorithm = WALGORITHM[self.config.algorithm]
             bstruct = generate_binary_structure(3, CON3D[self.config.con_3d])
             tfile = tempfile.mktemp()
-            tmp_mask = np.memmap(tfile, shape=mask.shape, dtype=mask.dtype,
+            tmp_mask = np.memmap(tfile, shape=mask_shape, dtype=mask_matrix.dtype,
                                  mode='w+')
             q = multiprocessing.Queue()
             p = multiprocessing.Process(target=watershed_process.do_watershed, args=(image,
@@ -1489,12 +1474,13 @@ class WaterShedInteractorStyle(DefaultInteractorStyle):
                     ##tmp_image = ndimage.morphological_gradient((image - image.min()).astype('uint16'), self.config.mg_size)
                     #tmp_mask = watershed_ift(tmp_image, markers.astype('int8'), bstruct)
 
-            if self.viewer.overwrite_mask:
-                mask[:] = 0
-                mask[tmp_mask == 1] = 253
-            else:
-                mask[(tmp_mask==2) & ((mask == 0) | (mask == 2) | (mask == 253))] = 2
-                mask[(tmp_mask==1) & ((mask == 0) | (mask == 2) | (mask == 253))] = 253
+            with mask_storage.edit_region(mask_matrix, (slice(1, None),) * 3) as mask:
+                if self.viewer.overwrite_mask:
+                    mask[:] = 0
+                    mask[tmp_mask == 1] = 253
+                else:
+                    mask[(tmp_mask==2) & ((mask == 0) | (mask == 2) | (mask == 253))] = 2
+                    mask[(tmp_mask==1) & ((mask == 0) | (mask == 2) | (mask == 253))] = 253
 
             #mask[:] = tmp_mask
             self.viewer.slice_.current_mask.matrix[0] = 1
@@ -1827,8 +1813,8 @@ class FloodFillMaskInteractorStyle(DefaultInteractorStyle):
         mouse_x, mouse_y = iren.GetEventPosition()
         x, y, z = self.viewer.get_voxel_coord_by_screen_pos(mouse_x, mouse_y, self.picker)
 
-        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
-        if mask[z, y, x] < self.t0 or mask[z, y, x] > self.t1:
+        mask_matrix = self.viewer.slice_.current_mask.matrix
+        if mask_matrix[z+1, y+1, x+1] < self.t0 or mask_matrix[z+1, y+1, x+1] > self.t1:
             return
 
         if self.config.target == "3D":
@@ -1848,20 +1834,37 @@ class FloodFillMaskInteractorStyle(DefaultInteractorStyle):
                 bstruct[:, :, 0] = _bstruct
 
         if self.config.target == '2D':
-            floodfill.floodfill_threshold(mask, [[x, y, z]], self.t0, self.t1, self.fill_value, bstruct, mask)
             b_mask = self.viewer.slice_.buffer_slices[self.orientation].mask
             index = self.viewer.slice_.buffer_slices[self.orientation].index
 
+            # Only the current slice is edited, with the seed inside it.
+            key = [slice(1, None)] * 3
+            seed = [x, y, z]
+            if self.orientation == 'AXIAL':
+                key[0] = slice(index + 1, index + 2)
+                seed[2] = 0
+            elif self.orientation == 'CORONAL':
+                key[1] = slice(index + 1, index + 2)
+                seed[1] = 0
+            elif self.orientation == 'SAGITAL':
+                key[2] = slice(index + 1, index + 2)
+                seed[0] = 0
+
+            with mask_storage.edit_region(mask_matrix, tuple(key)) as mask:
+                floodfill.floodfill_threshold(mask, [seed], self.t0, self.t1, self.fill_value, bstruct, mask)
+
             if self.orientation == 'AXIAL':
-                p_mask = mask[index,:,:].copy()
+                p_mask = mask[0, :, :].copy()
             elif self.orientation == 'CORONAL':
-                p_mask = mask[:, index, :].copy()
+                p_mask = mask[:, 0, :].copy()
             elif self.orientation == 'SAGITAL':
-                p_mask = mask[:, :, index].copy()
+                p_mask = mask[:, :, 0].copy()
 
             self.viewer.slice_.current_mask.save_history(index, self.orientation, p_mask, b_mask)
+            self.viewer.slice_.refresh_mask_region(self.orientation, index)
         else:
-            with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            with mask_storage.edit_region(mask_matrix, (slice(1, None),) * 3) as mask, \
+                    futures.ThreadPoolExecutor(max_workers=1) as executor:
                 future = executor.submit(floodfill.floodfill_threshold, mask, [[x, y, z]], self.t0, self.t1, self.fill_value, bstruct, mask)
 
                 dlg = wx.ProgressDialog(self._progr_title, self._progr_msg, parent=None, style=wx.PD_APP_MODAL)
@@ -1873,13 +1876,13 @@ class FloodFillMaskInteractorStyle(DefaultInteractorStyle):
 
             self.viewer.slice_.current_mask.save_history(0, 'VOLUME', self.viewer.slice_.current_mask.matrix.copy(), cp_mask)
 
-        self.viewer.slice_.buffer_slices['AXIAL'].discard_mask()
-        self.viewer.slice_.buffer_slices['CORONAL'].discard_mask()
-        self.viewer.slice_.buffer_slices['SAGITAL'].discard_mask()
+            self.viewer.slice_.buffer_slices['AXIAL'].discard_mask()
+            self.viewer.slice_.buffer_slices['CORONAL'].discard_mask()
+            self.viewer.slice_.buffer_slices['SAGITAL'].discard_mask()
 
-        self.viewer.slice_.buffer_slices['AXIAL'].discard_vtk_mask()
-        self.viewer.slice_.buffer_slices['CORONAL'].discard_vtk_mask()
-        self.viewer.slice_.buffer_slices['SAGITAL'].discard_vtk_mask()
+            self.viewer.slice_.buffer_slices['AXIAL'].discard_vtk_mask()
+            self.viewer.slice_.buffer_slices['CORONAL'].discard_vtk_mask()
+            self.viewer.slice_.buffer_slices['SAGITAL'].discard_vtk_mask()
 
         self.viewer.slice_.current_mask.was_edited = True
         Publisher.sendMessage('Reload actual slice')
@@ -2082,18 +2085,18 @@ class SelectMaskPartsInteractorStyle(DefaultInteractorStyle):
         mouse_x, mouse_y = iren.GetEventPosition()
         x, y, z = self.viewer.get_voxel_coord_by_screen_pos(mouse_x, mouse_y, self.picker)
 
-        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
-
         bstruct = np.array(generate_binary_structure(3, CON3D[self.config.con_3d]), dtype='uint8')
         self.viewer.slice_.do_threshold_to_all_slices()
+        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
 
         if self.config.mask is None:
             self._create_new_mask()
 
-        if iren.GetControlKey():
-            floodfill.floodfill_threshold(self.config.mask.matrix[1:, 1:, 1:], [[x, y, z]], 254, 255, 0, bstruct, self.config.mask.matrix[1:, 1:, 1:])
-        else:
-            floodfill.floodfill_threshold(mask, [[x, y, z]], self.t0, self.t1, self.fill_value, bstruct, self.config.mask.matrix[1:, 1:, 1:])
+        with mask_storage.edit_region(self.config.mask.matrix, (slice(1, None),) * 3) as out_mask:
+            if iren.GetControlKey():
+                floodfill.floodfill_threshold(out_mask, [[x, y, z]], 254, 255, 0, bstruct, out_mask)
+            else:
+                floodfill.floodfill_threshold(mask, [[x, y, z]], self.t0, self.t1, self.fill_value, bstruct, out_mask)
 
         self.viewer.slice_.aux_matrices['SELECT'] = self.config.mask.matrix[1:, 1:, 1:]
         self.viewer.slice_.to_show_aux = 'SELECT'
@@ -2250,14 +2253,14 @@ class FloodFillSegmentInteractorStyle(DefaultInteractorStyle):
 
         index = self.viewer.slice_.buffer_slices[self.orientation].index
         b_mask = self.viewer.slice_.buffer_slices[self.orientation].mask
-        vol_mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
+        vol_mask = self.viewer.slice_.current_mask.matrix
 
         if self.orientation == 'AXIAL':
-            vol_mask[index, :, :] = mask
+            vol_mask[index+1, 1:, 1:] = mask[0]
         elif self.orientation == 'CORONAL':
-            vol_mask[:, index, :] = mask
+            vol_mask[1:, index+1, 1:] = mask[0]
         elif self.orientation == 'SAGITAL':
-            vol_mask[:, :, index] = mask
+            vol_mask[1:, 1:, index+1] = mask[0]
 
         self.viewer.slice_.current_mask.save_history(index, self.orientation, mask, b_mask)
 
@@ -2267,7 +2270,6 @@ class FloodFillSegmentInteractorStyle(DefaultInteractorStyle):
         mouse_x, mouse_y = iren.GetEventPosition()
         x, y, z = self.viewer.get_voxel_coord_by_screen_pos(mouse_x, mouse_y, self.picker)
 
-        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
         image = self.viewer.slice_.matrix
 
         if self.config.method != 'confidence':
@@ -2295,6 +2297,7 @@ class FloodFillSegmentInteractorStyle(DefaultInteractorStyle):
         bstruct = np.array(generate_binary_structure(3, CON3D[self.config.con_3d]), dtype='uint8')
         self.viewer.slice_.do_threshold_to_all_slices()
         cp_mask = self.viewer.slice_.current_mask.matrix.copy()
+        mask = self.viewer.slice_.current_mask.matrix[1:, 1:, 1:]
 
         if self.config.method == 'confidence':
             with futures.ThreadPoolExecutor(max_workers=1) as executor:
@@ -2318,7 +2321,9 @@ class FloodFillSegmentInteractorStyle(DefaultInteractorStyle):
 
                 dlg.Destroy()
 
-        mask[out_mask.astype('bool')] = self.config.fill_value
+        with mask_storage.edit_region(self.viewer.slice_.current_mask.matrix,
+                                      (slice(1, None),) * 3) as mask:
+            mask[out_mask.astype('bool')] = self.config.fill_value
 
         self.viewer.slice_.current_mask.save_history(0, 'VOLUME', self.viewer.slice_.current_mask.matrix.copy(), cp_mask)
 
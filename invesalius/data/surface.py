@@ -17,14 +17,15 @@
 #    detalhes.
 #--------------------------------------------------------------------------
 
-import multiprocessing
 import os
 import plistlib
 import random
 import shutil
 import sys
 import tempfile
-import weakref
+import time
+
+from concurrent import futures
 
 import vtk
 import wx
@@ -40,10 +41,13 @@ else:
     _has_win32api = False
 
 import invesalius.constants as const
+import invesalius.data.converters as converters
 import invesalius.data.imagedata_utils as iu
 import invesalius.data.polydata_utils as pu
 import invesalius.project as prj
 import invesalius.session as ses
+import invesalius.data.surface_export as surface_export
+import invesalius.data.surface_lod as surface_lod
 import invesalius.data.surface_process as surface_process
 import invesalius.utils as utl
 import invesalius.data.vtk_utils as vu
@@ -76,6 +80,10 @@ class Surface():
 
         self.filename = None
 
+        # Coarser copies of polydata (see surface_lod), None if they weren't
+        # computed yet.
+        self.lods = None
+
     def SavePlist(self, dir_temp, filelist):
         if self.filename and os.path.exists(self.filename):
             filename = u'surface_%d' % self.index
@@ -99,6 +107,17 @@ class Surface():
                    'volume': self.volume,
                    'area': self.area,
                   }
+
+        if self.lods is not None:
+            lod_filenames = []
+            for i, lod in enumerate(self.lods):
+                lod_filename = u'%s_lod_%d.vtp' % (filename, i)
+                lod_filepath = tempfile.mktemp()
+                pu.Export(lod, lod_filepath, bin=True)
+                filelist[lod_filepath] = lod_filename
+                lod_filenames.append(lod_filename)
+            surface['lods'] = lod_filenames
+
         plist_filename = filename + u'.plist'
         #plist_filepath = os.path.join(dir_temp, filename + '.plist')
         temp_plist = tempfile.mktemp()
@@ -122,6 +141,9 @@ class Surface():
         except KeyError:
             self.area = 0.0
         self.polydata = pu.Import(os.path.join(dirpath, sp['polydata']))
+        if 'lods' in sp:
+            self.lods = [pu.Import(os.path.join(dirpath, lod_filename))
+                         for lod_filename in sp['lods']]
         Surface.general_index = max(Surface.general_index, self.index)
 
     def _set_class_index(self, index):
@@ -144,6 +166,10 @@ class SurfaceManager():
     def __init__(self):
         self.actors_dict = {}
         self.last_surface_index = 0
+        self.worker_pool = None
+        self.lod_executor = None
+        # actor -> surface_lod.SurfaceLOD
+        self.actors_lod = {}
         self.__bind_events()
 
     def __bind_events(self):
@@ -156,6 +182,8 @@ class SurfaceManager():
         Publisher.subscribe(self.OnChangeSurfaceName, 'Change surface name')
         Publisher.subscribe(self.OnShowSurface, 'Show surface')
         Publisher.subscribe(self.OnExportSurface,'Export surface to file')
+        Publisher.subscribe(self.OnExportSurfacesFromThresholds,
+                            'Create surfaces to export')
         Publisher.subscribe(self.OnLoadSurfaceDict, 'Load surface dict')
         Publisher.subscribe(self.OnCloseProject, 'Close project data')
         Publisher.subscribe(self.OnSelectSurface, 'Change surface selected')
@@ -170,6 +198,7 @@ class SurfaceManager():
         Publisher.subscribe(self.UpdateSurfaceInterpolation, 'Update Surface Interpolation')
 
         Publisher.subscribe(self.OnImportSurfaceFile, 'Import surface file')
+        Publisher.subscribe(self.OnSetInteractiveLOD, 'Set surfaces interactive LOD')
 
     def OnDuplicate(self, pubsub_evt):
         selected_items = pubsub_evt.data
@@ -207,6 +236,7 @@ class SurfaceManager():
                         if i > index:
                             new_dict[i-1] = old_dict[i]
                     old_dict = new_dict
+                    self.actors_lod.pop(actor, None)
                     Publisher.sendMessage('Remove surface actor from viewer', actor)
             self.actors_dict = new_dict
 
@@ -344,24 +374,16 @@ class SurfaceManager():
         actor.GetProperty().SetColor(surface.colour)
         actor.GetProperty().SetOpacity(1-surface.transparency)
         self.actors_dict[surface.index] = actor
+        self._SetupLOD(surface, actor)
 
         session = ses.Session()
         session.ChangeProject()
 
         # The following lines have to be here, otherwise all volumes disappear
         if not volume or not area:
-            triangle_filter = vtk.vtkTriangleFilter()
-            triangle_filter.SetInputData(polydata)
-            triangle_filter.Update()
-
-            measured_polydata = vtk.vtkMassProperties()
-            measured_polydata.SetInputConnection(triangle_filter.GetOutputPort())
-            measured_polydata.Update()
-            volume =  measured_polydata.GetVolume()
-            area =  measured_polydata.GetSurfaceArea()
+            volume, area = pu.MassProperties(polydata)
             surface.volume = volume
             surface.area = area
-            print(">>>>", surface.volume)
         else:
             surface.volume = volume
             surface.area = area
@@ -379,7 +401,192 @@ class SurfaceManager():
     def OnCloseProject(self, pubsub_evt):
         self.CloseProject()
 
+    def _get_worker_pool(self):
+        """
+        Returns the pool of surface workers, starting it the first time it's
+        used in the project.
+        """
+        if self.worker_pool is None:
+            self.worker_pool = surface_process.SurfaceWorkerPool()
+            self.worker_pool.start()
+        return self.worker_pool
+
+    def _create_progress_dialog(self, label):
+        # There is no wx application when running without GUI.
+        if wx.GetApp() is None:
+            return None
+        return wx.ProgressDialog("InVesalius 3", label, maximum=100,
+                                 parent=None,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT)
+
+    def _SetupLOD(self, surface, actor):
+        """
+        Prepares the levels of detail of the actor of surface. If surface
+        doesn't have them yet and needs them they're computed in background.
+        """
+        lod = surface_lod.SurfaceLOD(actor,
+                                     surface_lod.count_triangles(surface.polydata))
+        self.actors_lod[actor] = lod
+        if surface.lods is not None:
+            lod.set_lods(surface.lods)
+        elif not surface_lod.needs_lods(surface.polydata):
+            surface.lods = []
+        elif wx.GetApp() is not None:
+            if self.lod_executor is None:
+                self.lod_executor = futures.ThreadPoolExecutor(max_workers=1)
+            # The worker gets its own copy, surface.polydata is being
+            # rendered from this thread.
+            polydata = vtk.vtkPolyData()
+            polydata.DeepCopy(surface.polydata)
+            future = self.lod_executor.submit(surface_lod.build_lods, polydata)
+            future.add_done_callback(lambda f: wx.CallAfter(self._OnLODsBuilt,
+                                                            surface, actor, f))
+
+    def _OnLODsBuilt(self, surface, actor, future):
+        # The surface may have been removed or the project closed meanwhile.
+        if future.cancelled() or actor not in self.actors_lod:
+            return
+        try:
+            lods = future.result()
+        except Exception as e:
+            utl.debug("Error computing the surface levels of detail: %s" % e)
+            return
+        surface.lods = lods
+        self.actors_lod[actor].set_lods(lods)
+
+    def OnSetInteractiveLOD(self, pubsub_evt):
+        """
+        Shows the coarser levels of the surfaces while the camera moves, the
+        polygons shown are shared by the visible surfaces.
+        """
+        interactive = pubsub_evt.data
+        visible = [actor for actor in self.actors_dict.values()
+                   if actor.GetVisibility()]
+        max_polys = const.SURFACE_LOD_INTERACTIVE_POLYS // max(len(visible), 1)
+        for lod in self.actors_lod.values():
+            lod.set_interactive(interactive, max_polys)
+
+    def _PostProcessSurface(self, polydata, mass_properties, algorithm,
+                            options, decimate_reduction, keep_largest,
+                            fill_holes, with_gui, status):
+        """
+        Steps of the surface creation done over the whole surface. It runs
+        outside the GUI thread, so it must not call wx or send messages, the
+        progress is reported through status (a PipelineProgress).
+
+        mass_properties is the (volume, area) of polydata, summed from the
+        pieces. Returns the (volume, area) of the final surface and the
+        polydata to be shown, or (None, None) if cancelled.
+        """
+        if algorithm == 'ca_smoothing':
+            normals = vtk.vtkPolyDataNormals()
+            status.observe(normals)
+            normals.SetInputData(polydata)
+            normals.ComputeCellNormalsOn()
+            normals.Update()
+            del polydata
+            polydata = normals.GetOutput()
+            del normals
+
+            clean = vtk.vtkCleanPolyData()
+            status.observe(clean)
+            clean.SetInputData(polydata)
+            clean.PointMergingOn()
+            clean.Update()
+            del polydata
+            polydata = clean.GetOutput()
+            del clean
+
+            if status.cancelled:
+                return None, None
+
+            # The mesh uses the polydata arrays, it must be alive until
+            # the smoothing is done.
+            mesh = cy_mesh.Mesh(polydata)
+            smoothed = cy_mesh.ca_smoothing(mesh, options['angle'],
+                                            options['max distance'],
+                                            options['min weight'],
+                                            options['steps'])
+            del mesh
+            del polydata
+            polydata = smoothed
+            del smoothed
+            status.step()
+
+        # Decimated whole, after the pieces are merged, so the seams are
+        # decimated like the rest of the surface.
+        if decimate_reduction:
+            decimation = vtk.vtkQuadricDecimation()
+            status.observe(decimation)
+            decimation.SetInputData(polydata)
+            decimation.SetTargetReduction(decimate_reduction)
+            decimation.Update()
+            del polydata
+            polydata = decimation.GetOutput()
+            del decimation
+
+        if keep_largest:
+            largest = pu.SelectLargestPart(polydata)
+            del polydata
+            polydata = largest
+            del largest
+            status.step()
+
+        #Filter used to detect and fill holes. Only fill boundary edges holes.
+        #TODO: Hey! This piece of code is the same from
+        #polydata_utils.FillSurfaceHole, we need to review this.
+        if fill_holes:
+            filled_polydata = vtk.vtkFillHolesFilter()
+            status.observe(filled_polydata)
+            filled_polydata.SetInputData(polydata)
+            filled_polydata.SetHoleSize(300)
+            filled_polydata.Update()
+            del polydata
+            polydata = filled_polydata.GetOutput()
+            del filled_polydata
+
+        # The pieces were measured by the workers, the surface is measured
+        # again only if the steps above changed it.
+        if algorithm == 'ca_smoothing' or decimate_reduction or keep_largest \
+           or fill_holes:
+            mass_properties = pu.MassProperties(polydata)
+
+        if with_gui:
+            normals = vtk.vtkPolyDataNormals()
+            status.observe(normals)
+            normals.SetInputData(polydata)
+            normals.SetFeatureAngle(80)
+            normals.AutoOrientNormalsOn()
+            normals.Update()
+            polydata = normals.GetOutput()
+            del normals
+
+            # Improve performance
+            stripper = vtk.vtkStripper()
+            status.observe(stripper)
+            stripper.SetInputData(polydata)
+            stripper.PassThroughCellIdsOn()
+            stripper.PassThroughPointIdsOn()
+            stripper.Update()
+            polydata = stripper.GetOutput()
+            del stripper
+
+        # An aborted filter leaves its output incomplete.
+        if status.cancelled:
+            return None, None
+        return mass_properties, polydata
+
     def CloseProject(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+
+        if self.lod_executor is not None:
+            # The levels being computed are discarded.
+            self.lod_executor.shutdown(wait=False)
+            self.lod_executor = None
+        self.actors_lod = {}
+
         for index in self.actors_dict:
             Publisher.sendMessage('Remove surface actor from viewer', self.actors_dict[index])
         del self.actors_dict
@@ -434,6 +641,7 @@ class SurfaceManager():
             actor.GetProperty().SetOpacity(1-surface.transparency)
 
             self.actors_dict[surface.index] = actor
+            self._SetupLOD(surface, actor)
 
             # Send actor by pubsub to viewer's render
             Publisher.sendMessage('Load surface actor into viewer', (actor))
@@ -488,240 +696,109 @@ class SurfaceManager():
         #if imagedata_resolution:
             #imagedata = iu.ResampleImage3D(imagedata, imagedata_resolution)
 
-        pipeline_size = 4
+        # Steps done over the whole surface, after the pieces are created
+        # by the workers. The smoothing is done by the workers, by piece,
+        # unless the algorithm is ca_smoothing.
+        with_gui = wx.GetApp() is not None
+        n_filters = 0
+        if algorithm == 'ca_smoothing':
+            n_filters += 3
         if decimate_reduction:
-            pipeline_size += 1
-        if (smooth_iterations and smooth_relaxation_factor):
-            pipeline_size += 1
-        if fill_holes:
-            pipeline_size += 1
+            n_filters += 1
         if keep_largest:
-            pipeline_size += 1
+            n_filters += 1
+        if fill_holes:
+            n_filters += 1
+        if with_gui:
+            n_filters += 2
+        pipeline_size = n_filters + 1
 
         ## Update progress value in GUI
         UpdateProgress = vu.ShowProgress(pipeline_size)
         UpdateProgress(0, _("Creating 3D surface..."))
 
-        language = ses.Session().language
+        pool = self._get_worker_pool()
+        pieces = surface_process.compute_pieces(matrix.shape[0],
+                                                pool.n_processes)
+
+        job = {'filename': filename_img,
+               'shape': matrix.shape,
+               'dtype': matrix.dtype,
+               'mask_filename': mask.temp_file,
+               'mask_shape': mask.matrix.shape,
+               'mask_dtype': mask.matrix.dtype,
+               'mask_storage': mask.storage,
+               'spacing': spacing,
+               'mode': mode,
+               'min_value': min_value,
+               'max_value': max_value,
+               'from_binary': algorithm != 'Default',
+               'algorithm': algorithm,
+               'imagedata_resolution': imagedata_resolution,
+               'smooth_iterations': 0,
+               'smooth_relaxation_factor': 0}
+        if algorithm != 'ca_smoothing':
+            job['smooth_iterations'] = smooth_iterations
+            job['smooth_relaxation_factor'] = smooth_relaxation_factor
+
+        # The dialog goes up to 50% while the workers create the pieces and
+        # from 50% to 100% in the steps done over the whole surface.
+        label = _("Creating 3D surface...")
+        dlg = self._create_progress_dialog(label)
+        def OnProgress(value, start=0):
+            UpdateProgress(value, label)
+            if dlg is not None:
+                keep_going = dlg.Update(int(start + value * 50), label)
+                # wx >= 2.9 returns (continue, skip)
+                if isinstance(keep_going, tuple):
+                    keep_going = keep_going[0]
+                return keep_going
 
-        if (prj.Project().original_orientation == const.CORONAL):
-            flip_image = False
-        else:
-            flip_image = True
-
-        n_processors = multiprocessing.cpu_count()
-
-        pipe_in, pipe_out = multiprocessing.Pipe()
-        o_piece = 1
-        piece_size = 2000
-
-        n_pieces = int(round(matrix.shape[0] / piece_size + 0.5, 0))
-
-        q_in = multiprocessing.Queue()
-        q_out = multiprocessing.Queue()
-
-        p = []
-        for i in range(n_processors):
-            sp = surface_process.SurfaceProcess(pipe_in, filename_img,
-                                                matrix.shape, matrix.dtype,
-                                                mask.temp_file,
-                                                mask.matrix.shape,
-                                                mask.matrix.dtype,
-                                                spacing,
-                                                mode, min_value, max_value,
-                                                decimate_reduction,
-                                                smooth_relaxation_factor,
-                                                smooth_iterations, language,
-                                                flip_image, q_in, q_out,
-                                                algorithm != 'Default',
-                                                algorithm,
-                                                imagedata_resolution)
-            p.append(sp)
-            sp.start()
-
-        for i in range(n_pieces):
-            init = i * piece_size
-            end = init + piece_size + o_piece
-            roi = slice(init, end)
-            q_in.put(roi)
-            print("new_piece", roi)
-
-        for i in p:
-            q_in.put(None)
-
-        none_count = 1
-        while 1:
-            msg = pipe_out.recv()
-            if(msg is None):
-                none_count += 1
+        try:
+            pieces_arrays = pool.run(job, pieces, OnProgress)
+            if pieces_arrays is None:
+                polydata = None
             else:
-                UpdateProgress(msg[0]/(n_pieces * pipeline_size), msg[1])
-
-            if none_count > n_pieces:
-                break
-
-        polydata_append = vtk.vtkAppendPolyData()
-        #  polydata_append.ReleaseDataFlagOn()
-        t = n_pieces
-        while t:
-            filename_polydata = q_out.get()
-
-            reader = vtk.vtkXMLPolyDataReader()
-            reader.SetFileName(filename_polydata)
-            #  reader.ReleaseDataFlagOn()
-            reader.Update()
-            #  reader.GetOutput().ReleaseDataFlagOn()
-
-            polydata = reader.GetOutput()
-            #  polydata.SetSource(None)
-
-            polydata_append.AddInputData(polydata)
-            del reader
-            del polydata
-            t -= 1
-
-        polydata_append.Update()
-        #  polydata_append.GetOutput().ReleaseDataFlagOn()
-        polydata = polydata_append.GetOutput()
-        #polydata.Register(None)
-        #  polydata.SetSource(None)
-        del polydata_append
-
-        if algorithm == 'ca_smoothing':
-            normals = vtk.vtkPolyDataNormals()
-            normals_ref = weakref.ref(normals)
-            normals_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                                      UpdateProgress(normals_ref(), _("Creating 3D surface...")))
-            normals.SetInputData(polydata)
-            #  normals.ReleaseDataFlagOn()
-            #normals.SetFeatureAngle(80)
-            #normals.AutoOrientNormalsOn()
-            normals.ComputeCellNormalsOn()
-            #  normals.GetOutput().ReleaseDataFlagOn()
-            normals.Update()
-            del polydata
-            polydata = normals.GetOutput()
-            #  polydata.SetSource(None)
-            del normals
-
-            clean = vtk.vtkCleanPolyData()
-            #  clean.ReleaseDataFlagOn()
-            #  clean.GetOutput().ReleaseDataFlagOn()
-            clean_ref = weakref.ref(clean)
-            clean_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            UpdateProgress(clean_ref(), _("Creating 3D surface...")))
-            clean.SetInputData(polydata)
-            clean.PointMergingOn()
-            clean.Update()
-
-            del polydata
-            polydata = clean.GetOutput()
-            #  polydata.SetSource(None)
-            del clean
-
-            #  try:
-                #  polydata.BuildLinks()
-            #  except TypeError:
-                #  polydata.BuildLinks(0)
-            #  polydata = ca_smoothing.ca_smoothing(polydata, options['angle'],
-                                                 #  options['max distance'],
-                                                 #  options['min weight'],
-                                                 #  options['steps'])
-
-            mesh = cy_mesh.Mesh(polydata)
-            cy_mesh.ca_smoothing(mesh, options['angle'],
-                                 options['max distance'],
-                                 options['min weight'],
-                                 options['steps'])
-            #  polydata = mesh.to_vtk()
-
-            #  polydata.SetSource(None)
-            #  polydata.DebugOn()
-        else:
-            #smoother = vtk.vtkWindowedSincPolyDataFilter()
-            smoother = vtk.vtkSmoothPolyDataFilter()
-            smoother_ref = weakref.ref(smoother)
-            smoother_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            UpdateProgress(smoother_ref(), _("Creating 3D surface...")))
-            smoother.SetInputData(polydata)
-            smoother.SetNumberOfIterations(smooth_iterations)
-            smoother.SetRelaxationFactor(smooth_relaxation_factor)
-            smoother.SetFeatureAngle(80)
-            #smoother.SetEdgeAngle(90.0)
-            #smoother.SetPassBand(0.1)
-            smoother.BoundarySmoothingOn()
-            smoother.FeatureEdgeSmoothingOn()
-            #smoother.NormalizeCoordinatesOn()
-            #smoother.NonManifoldSmoothingOn()
-            #  smoother.ReleaseDataFlagOn()
-            #  smoother.GetOutput().ReleaseDataFlagOn()
-            smoother.Update()
-            del polydata
-            polydata = smoother.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            del smoother
-
-
-        if decimate_reduction:
-            print("Decimating", decimate_reduction)
-            decimation = vtk.vtkQuadricDecimation()
-            #  decimation.ReleaseDataFlagOn()
-            decimation.SetInputData(polydata)
-            decimation.SetTargetReduction(decimate_reduction)
-            decimation_ref = weakref.ref(decimation)
-            decimation_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            UpdateProgress(decimation_ref(), _("Creating 3D surface...")))
-            #decimation.PreserveTopologyOn()
-            #decimation.SplittingOff()
-            #decimation.BoundaryVertexDeletionOff()
-            #  decimation.GetOutput().ReleaseDataFlagOn()
-            decimation.Update()
-            del polydata
-            polydata = decimation.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            del decimation
-
-        #to_measure.Register(None)
-        #  to_measure.SetSource(None)
-
-        if keep_largest:
-            conn = vtk.vtkPolyDataConnectivityFilter()
-            conn.SetInputData(polydata)
-            conn.SetExtractionModeToLargestRegion()
-            conn_ref = weakref.ref(conn)
-            conn_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                    UpdateProgress(conn_ref(), _("Creating 3D surface...")))
-            conn.Update()
-            #  conn.GetOutput().ReleaseDataFlagOn()
-            del polydata
-            polydata = conn.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            del conn
-
-        #Filter used to detect and fill holes. Only fill boundary edges holes.
-        #TODO: Hey! This piece of code is the same from
-        #polydata_utils.FillSurfaceHole, we need to review this.
-        if fill_holes:
-            filled_polydata = vtk.vtkFillHolesFilter()
-            #  filled_polydata.ReleaseDataFlagOn()
-            filled_polydata.SetInputData(polydata)
-            filled_polydata.SetHoleSize(300)
-            filled_polydata_ref = weakref.ref(filled_polydata)
-            filled_polydata_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                    UpdateProgress(filled_polydata_ref(), _("Creating 3D surface...")))
-            filled_polydata.Update()
-            #  filled_polydata.GetOutput().ReleaseDataFlagOn()
-            del polydata
-            polydata = filled_polydata.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            #  polydata.DebugOn()
-            del filled_polydata
-
-        to_measure = polydata
+                polydata = converters.numpy_to_polydata(pieces_arrays)
+                volume = abs(sum(p['mass_properties'][0] for p in pieces_arrays))
+                area = sum(p['mass_properties'][1] for p in pieces_arrays)
+                del pieces_arrays
+
+                # The pieces share a slice, the points generated on it
+                # twice (and moved by the smoothing) are merged, otherwise
+                # the surface would have cracks.
+                tolerance = min(spacing) * 1e-3
+                band = surface_process.seam_band(spacing,
+                                                 job['smooth_iterations'],
+                                                 job['smooth_relaxation_factor'],
+                                                 tolerance)
+                polydata = pu.MergeSeamPoints(polydata,
+                                              surface_process.seams_z(pieces, spacing),
+                                              tolerance, band)
+
+                # The remaining steps run in another thread, this one keeps
+                # the dialog updated and responsive to the cancel button.
+                status = surface_process.PipelineProgress(n_filters)
+                with futures.ThreadPoolExecutor(max_workers=1) as executor:
+                    future = executor.submit(self._PostProcessSurface,
+                                             polydata, (volume, area),
+                                             algorithm, options,
+                                             decimate_reduction, keep_largest,
+                                             fill_holes, with_gui, status)
+                    del polydata
+                    while not future.done():
+                        if OnProgress(status.value, 50) is False:
+                            status.cancelled = True
+                        time.sleep(0.05)
+                mass_properties, polydata = future.result()
+        finally:
+            if dlg is not None:
+                dlg.Destroy()
+
+        if polydata is None:
+            Publisher.sendMessage('Update status text in GUI', _("Ready"))
+            Publisher.sendMessage('Update status in GUI', (100, ""))
+            return
 
         # If InVesalius is running without GUI
         if wx.GetApp() is None:
@@ -737,42 +814,10 @@ class SurfaceManager():
                 self.last_surface_index = index
             surface.colour = colour
             surface.polydata = polydata
+            surface.volume, surface.area = mass_properties
 
         # With GUI
         else:
-            normals = vtk.vtkPolyDataNormals()
-            #  normals.ReleaseDataFlagOn()
-            normals_ref = weakref.ref(normals)
-            normals_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            UpdateProgress(normals_ref(), _("Creating 3D surface...")))
-            normals.SetInputData(polydata)
-            normals.SetFeatureAngle(80)
-            normals.AutoOrientNormalsOn()
-            #  normals.GetOutput().ReleaseDataFlagOn()
-            normals.Update()
-            del polydata
-            polydata = normals.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            del normals
-
-            # Improve performance
-            stripper = vtk.vtkStripper()
-            #  stripper.ReleaseDataFlagOn()
-            stripper_ref = weakref.ref(stripper)
-            stripper_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            UpdateProgress(stripper_ref(), _("Creating 3D surface...")))
-            stripper.SetInputData(polydata)
-            stripper.PassThroughCellIdsOn()
-            stripper.PassThroughPointIdsOn()
-            #  stripper.GetOutput().ReleaseDataFlagOn()
-            stripper.Update()
-            del polydata
-            polydata = stripper.GetOutput()
-            #polydata.Register(None)
-            #  polydata.SetSource(None)
-            del stripper
-
             # Map polygonal data (vtkPolyData) to graphics primitives.
             mapper = vtk.vtkPolyDataMapper()
             mapper.SetInputData(polydata)
@@ -814,26 +859,20 @@ class SurfaceManager():
             session = ses.Session()
             session.ChangeProject()
 
-            measured_polydata = vtk.vtkMassProperties()
-            #  measured_polydata.ReleaseDataFlagOn()
-            measured_polydata.SetInputData(to_measure)
-            volume =  float(measured_polydata.GetVolume())
-            area =  float(measured_polydata.GetSurfaceArea())
-            surface.volume = volume
-            surface.area = area
+            surface.volume, surface.area = mass_properties
             self.last_surface_index = surface.index
-            del measured_polydata
-            del to_measure
 
             Publisher.sendMessage('Load surface actor into viewer', actor)
 
             # Send actor by pubsub to viewer's render
             if overwrite and self.actors_dict.keys():
                 old_actor = self.actors_dict[self.last_surface_index]
+                self.actors_lod.pop(old_actor, None)
                 Publisher.sendMessage('Remove surface actor from viewer', old_actor)
 
             # Save actor for future management tasks
             self.actors_dict[surface.index] = actor
+            self._SetupLOD(surface, actor)
 
             Publisher.sendMessage('Update surface info in GUI',
                                         (surface.index, surface.name,
@@ -862,7 +901,8 @@ class SurfaceManager():
         Remove actor, according to given actor index.
         """
         Publisher.sendMessage('Remove surface actor from viewer', (index))
-        self.actors_dict.pop(index)
+        actor = self.actors_dict.pop(index)
+        self.actors_lod.pop(actor, None)
         # Remove surface from project's surface_dict
         proj = prj.Project()
         proj.surface_dict.pop(index)
@@ -953,26 +993,6 @@ class SurfaceManager():
             else:
                 polydata = pu.Merge(polydata_list)
 
-            # Having a polydata that represents all surfaces
-            # selected, we write it, according to filetype
-            if filetype == const.FILETYPE_STL:
-                writer = vtk.vtkSTLWriter()
-                writer.SetFileTypeToBinary()
-            elif filetype == const.FILETYPE_STL_ASCII:
-                writer = vtk.vtkSTLWriter()
-                writer.SetFileTypeToASCII()
-            elif filetype == const.FILETYPE_VTP:
-                writer = vtk.vtkXMLPolyDataWriter()
-            #elif filetype == const.FILETYPE_IV:
-            #    writer = vtk.vtkIVWriter()
-            elif filetype == const.FILETYPE_PLY:
-                writer = vtk.vtkPLYWriter()
-                writer.SetFileTypeToASCII()
-                writer.SetColorModeToOff()
-                #writer.SetDataByteOrderToLittleEndian()
-                #writer.SetColorModeToUniformCellColor()
-                #writer.SetColor(255, 0, 0)
-
             if filetype in (const.FILETYPE_STL,
                             const.FILETYPE_STL_ASCII,
                             const.FILETYPE_PLY):
@@ -986,7 +1006,126 @@ class SurfaceManager():
                 normals.Update()
                 polydata = normals.GetOutput()
 
+            # The binary STL and PLY are written straight from the numpy
+            # arrays of the surface. The shown surfaces may be made of
+            # triangle strips.
+            if filetype in (const.FILETYPE_STL, const.FILETYPE_PLY):
+                arrays = converters.polydata_to_numpy(pu.Triangulate(polydata))
+                surface_export.write_surface(filename, filetype, arrays)
+                return
+
+            # Having a polydata that represents all surfaces
+            # selected, we write it, according to filetype
+            if filetype == const.FILETYPE_STL_ASCII:
+                writer = vtk.vtkSTLWriter()
+                writer.SetFileTypeToASCII()
+            elif filetype == const.FILETYPE_VTP:
+                writer = vtk.vtkXMLPolyDataWriter()
+            #elif filetype == const.FILETYPE_IV:
+            #    writer = vtk.vtkIVWriter()
+
             filename = filename.encode(const.FS_ENCODE)
             writer.SetFileName(filename)
             writer.SetInputData(polydata)
             writer.Write()
+
+    def OnExportSurfacesFromThresholds(self, pubsub_evt):
+        slice_, exports, filetype = pubsub_evt.data
+        self.ExportSurfacesFromThresholds(slice_, exports, filetype)
+
+    def ExportSurfacesFromThresholds(self, slice_, exports,
+                                     filetype=const.FILETYPE_STL,
+                                     quality=const.DEFAULT_SURFACE_QUALITY):
+        """
+        Creates the surfaces of the image of slice_ thresholded by each one
+        of the ranges in exports, a list of (filename, threshold_range), and
+        writes them to the files (filetype is one of the keys of
+        surface_export.WRITERS). The surfaces are not added to the project.
+
+        The pieces of all the surfaces are given at once to the worker pool
+        and each surface is written as soon as its pieces are done. Returns
+        the list of the files written.
+        """
+        matrix = slice_.matrix
+        spacing = slice_.spacing
+
+        imagedata_resolution, smooth_iterations, smooth_relaxation_factor, \
+                decimate_reduction = const.SURFACE_QUALITY[quality]
+
+        pool = self._get_worker_pool()
+        pieces = surface_process.compute_pieces(matrix.shape[0],
+                                                pool.n_processes)
+        seams = surface_process.seams_z(pieces, spacing)
+        tolerance = min(spacing) * 1e-3
+        band = surface_process.seam_band(spacing, smooth_iterations,
+                                         smooth_relaxation_factor, tolerance)
+
+        jobs = []
+        for filename, (min_value, max_value) in exports:
+            job = {'filename': slice_.matrix_filename,
+                   'shape': matrix.shape,
+                   'dtype': matrix.dtype,
+                   'mask_filename': None,
+                   'mask_shape': None,
+                   'mask_dtype': None,
+                   'mask_storage': None,
+                   'spacing': spacing,
+                   'mode': 'CONTOUR',
+                   'min_value': min_value,
+                   'max_value': max_value,
+                   'from_binary': False,
+                   'algorithm': 'Default',
+                   'imagedata_resolution': imagedata_resolution,
+                   'smooth_iterations': smooth_iterations,
+                   'smooth_relaxation_factor': smooth_relaxation_factor}
+            jobs.append((job, pieces))
+
+        label = _("Exporting 3D surfaces...")
+        UpdateProgress = vu.ShowProgress(1)
+        UpdateProgress(0, label)
+        dlg = self._create_progress_dialog(label)
+        def OnProgress(value):
+            UpdateProgress(value, label)
+            if dlg is not None:
+                keep_going = dlg.Update(int(value * 100), label)
+                # wx >= 2.9 returns (continue, skip)
+                if isinstance(keep_going, tuple):
+                    keep_going = keep_going[0]
+                return keep_going
+
+        written = []
+        try:
+            for n, pieces_arrays in pool.run_many(jobs, OnProgress):
+                filename = exports[n][0]
+                if not pieces_arrays:
+                    utl.debug("Empty surface, %s not written" % filename)
+                    continue
+                polydata = converters.numpy_to_polydata(pieces_arrays)
+                del pieces_arrays
+                polydata = pu.MergeSeamPoints(polydata, seams, tolerance, band)
+                arrays = converters.polydata_to_numpy(polydata)
+                del polydata
+                # The triangles are turned to the side of the normals of
+                # the contour and then each part is turned out, instead of
+                # running vtkPolyDataNormals.
+                surface_export.orient_triangles(arrays)
+                surface_export.orient_outward(arrays)
+                if decimate_reduction:
+                    # Decimated whole, like the surfaces created in the
+                    # project. It keeps the orientation of the triangles.
+                    decimation = vtk.vtkQuadricDecimation()
+                    decimation.SetInputData(converters.numpy_to_polydata([arrays]))
+                    decimation.SetTargetReduction(decimate_reduction)
+                    decimation.Update()
+                    arrays = converters.polydata_to_numpy(decimation.GetOutput())
+                    del decimation
+                surface_export.write_surface(filename, filetype, arrays)
+                del arrays
+                written.append(filename)
+        finally:
+            if dlg is not None:
+                dlg.Destroy()
+
+        Publisher.sendMessage('Update status text in GUI', _("Ready"))
+        Publisher.sendMessage('Update status in GUI', (100, ""))
+        return written
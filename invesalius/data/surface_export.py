@@ -0,0 +1,200 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Surface file writers working directly on numpy arrays.
+
+The surfaces are given as dicts of arrays like the ones returned by
+converters.polydata_to_numpy, with triangles only.
+"""
+
+import struct
+
+import numpy as np
+
+import invesalius.constants as const
+from invesalius.data.holes import union_find
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)),
+                       ('vertices', '<f4', (3, 3)),
+                       ('attribute', '<u2')])
+
+PLY_FACE = np.dtype([('n', 'u1'), ('vertices', '<i4', (3,))])
+
+# Number of triangles or points written at once.
+CHUNK_SIZE = 2 ** 20
+
+
+def get_triangles(arrays):
+    """
+    Returns the triangles of arrays as a (n, 3) array of point ids.
+    """
+    polys = arrays['polys']
+    if polys.size % 4 or not (polys[::4] == 3).all():
+        raise ValueError("Only triangles can be written")
+    return polys.reshape(-1, 4)[:, 1:]
+
+
+def orient_triangles(arrays):
+    """
+    Reverses, in place, the triangles facing the opposite direction of the
+    point normals (the 'Normals' point data array) of their vertices. Does
+    nothing if there are no point normals.
+    """
+    normals = None
+    for name, attribute, array in arrays['point_data']:
+        if name == 'Normals':
+            normals = array
+    if normals is None:
+        return
+
+    points = arrays['points']
+    triangles = get_triangles(arrays)
+    for i in range(0, triangles.shape[0], CHUNK_SIZE):
+        chunk = triangles[i:i + CHUNK_SIZE]
+        p0, p1, p2 = points[chunk[:, 0]], points[chunk[:, 1]], points[chunk[:, 2]]
+        face_normals = np.cross(p1 - p0, p2 - p0)
+        vertex_normals = normals[chunk[:, 0]] + normals[chunk[:, 1]] + normals[chunk[:, 2]]
+        inverted = (face_normals * vertex_normals).sum(1) < 0
+        flipped = chunk[inverted]
+        chunk[inverted, 1] = flipped[:, 2]
+        chunk[inverted, 2] = flipped[:, 1]
+
+
+def orient_outward(arrays):
+    """
+    Reverses, in place, the triangles of the connected parts of the surface
+    with negative signed volume, so the parts face out, as
+    vtkPolyDataNormals with AutoOrientNormalsOn. The triangles of each part
+    must already be consistently oriented (see orient_triangles).
+
+    The volume of a part is taken about its centre, so the sign of the
+    parts that aren't closed (cut by the borders of the image) doesn't
+    depend on where the origin is.
+    """
+    points = arrays['points']
+    triangles = get_triangles(arrays)
+    if not triangles.shape[0]:
+        return
+    npoints = points.shape[0]
+
+    # The points of each triangle are joined to its first point.
+    roots = union_find(npoints,
+                       np.concatenate((triangles[:, 0], triangles[:, 0])),
+                       np.concatenate((triangles[:, 1], triangles[:, 2])))
+    parts = roots[triangles[:, 0]]
+
+    counts = np.bincount(parts, minlength=npoints)
+    centres = np.zeros((npoints, 3))
+    for k in range(3):
+        centres[:, k] = np.bincount(parts, weights=points[triangles[:, 0], k],
+                                    minlength=npoints)
+    centres[counts > 0] /= counts[counts > 0, np.newaxis]
+
+    volumes = np.zeros(npoints)
+    for i in range(0, triangles.shape[0], CHUNK_SIZE):
+        chunk = triangles[i:i + CHUNK_SIZE]
+        chunk_parts = parts[i:i + CHUNK_SIZE]
+        p0 = points[chunk[:, 0]] - centres[chunk_parts]
+        p1 = points[chunk[:, 1]] - centres[chunk_parts]
+        p2 = points[chunk[:, 2]] - centres[chunk_parts]
+        volumes += np.bincount(chunk_parts,
+                               weights=(p0 * np.cross(p1, p2)).sum(1),
+                               minlength=npoints)
+
+    inverted = volumes[parts] < 0
+    flipped = triangles[inverted]
+    triangles[inverted, 1] = flipped[:, 2]
+    triangles[inverted, 2] = flipped[:, 1]
+
+
+def write_stl(filename, arrays):
+    """
+    Writes the surface to a binary STL file.
+    """
+    points = arrays['points']
+    triangles = get_triangles(arrays)
+    with open(filename, 'wb') as f:
+        f.write(b'InVesalius'.ljust(80, b' '))
+        f.write(struct.pack('<I', triangles.shape[0]))
+        for i in range(0, triangles.shape[0], CHUNK_SIZE):
+            chunk = triangles[i:i + CHUNK_SIZE]
+            records = np.zeros(chunk.shape[0], dtype=STL_RECORD)
+            records['vertices'] = points[chunk]
+            v = records['vertices']
+            normals = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+            norm = np.sqrt((normals ** 2).sum(1))
+            norm[norm == 0] = 1
+            records['normal'] = normals / norm[:, np.newaxis]
+            records.tofile(f)
+
+
+def write_ply(filename, arrays):
+    """
+    Writes the surface to a binary (little endian) PLY file.
+    """
+    points = np.ascontiguousarray(arrays['points'], dtype='<f4')
+    triangles = get_triangles(arrays)
+    header = ('ply\n'
+              'format binary_little_endian 1.0\n'
+              'comment InVesalius\n'
+              'element vertex %d\n'
+              'property float x\n'
+              'property float y\n'
+              'property float z\n'
+              'element face %d\n'
+              'property list uchar int vertex_indices\n'
+              'end_header\n') % (points.shape[0], triangles.shape[0])
+    with open(filename, 'wb') as f:
+        f.write(header.encode('ascii'))
+        points.tofile(f)
+        for i in range(0, triangles.shape[0], CHUNK_SIZE):
+            chunk = triangles[i:i + CHUNK_SIZE]
+            faces = np.empty(chunk.shape[0], dtype=PLY_FACE)
+            faces['n'] = 3
+            faces['vertices'] = chunk
+            faces.tofile(f)
+
+
+def write_obj(filename, arrays):
+    """
+    Writes the surface to a Wavefront OBJ file.
+    """
+    points = arrays['points']
+    triangles = get_triangles(arrays)
+    with open(filename, 'wb') as f:
+        f.write(b'# InVesalius\n')
+        for i in range(0, points.shape[0], CHUNK_SIZE):
+            np.savetxt(f, points[i:i + CHUNK_SIZE], fmt='v %.6g %.6g %.6g')
+        for i in range(0, triangles.shape[0], CHUNK_SIZE):
+            # OBJ indices start at 1.
+            np.savetxt(f, triangles[i:i + CHUNK_SIZE] + 1, fmt='f %d %d %d')
+
+
+WRITERS = {const.FILETYPE_STL: write_stl,
+           const.FILETYPE_PLY: write_ply,
+           const.FILETYPE_OBJ: write_obj}
+
+
+def write_surface(filename, filetype, arrays):
+    """
+    Writes the surface in arrays to filename, filetype is one of the keys of
+    WRITERS.
+    """
+    WRITERS[filetype](filename, arrays)
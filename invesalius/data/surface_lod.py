@@ -0,0 +1,124 @@
+#--------------------------------------------------------------------------
+# Software:     InVesalius - Software de Reconstrucao 3D de Imagens Medicas
+# Copyright:    (C) 2001  Centro de Pesquisas Renato Archer
+# Homepage:     http://www.softwarepublico.gov.br
+# Contact:      invesalius@cti.gov.br
+# License:      GNU - GPL 2 (LICENSE.txt/LICENCA.txt)
+#--------------------------------------------------------------------------
+#    Este programa e software livre; voce pode redistribui-lo e/ou
+#    modifica-lo sob os termos da Licenca Publica Geral GNU, conforme
+#    publicada pela Free Software Foundation; de acordo com a versao 2
+#    da Licenca.
+#
+#    Este programa eh distribuido na expectativa de ser util, mas SEM
+#    QUALQUER GARANTIA; sem mesmo a garantia implicita de
+#    COMERCIALIZACAO ou de ADEQUACAO A QUALQUER PROPOSITO EM
+#    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
+#    detalhes.
+#--------------------------------------------------------------------------
+
+"""
+Levels of detail of the surfaces.
+
+The big surfaces get a few coarser copies (decimated in background). While
+the camera is moving the surface actor shows one of them, the full surface
+is shown again once the camera is still.
+"""
+
+import vtk
+
+import invesalius.constants as const
+
+
+def count_triangles(polydata):
+    """
+    Returns the number of triangles of polydata, counting the ones inside
+    triangle strips.
+    """
+    strips = polydata.GetStrips()
+    return polydata.GetNumberOfPolys() \
+            + strips.GetNumberOfConnectivityEntries() \
+            - 3 * strips.GetNumberOfCells()
+
+
+def needs_lods(polydata):
+    return count_triangles(polydata) > const.SURFACE_LOD_MIN_POLYS
+
+
+def build_lods(polydata):
+    """
+    Returns the coarser copies of polydata, from the finest to the coarsest,
+    each one SURFACE_LOD_FACTOR times smaller than the previous. Returns an
+    empty list if polydata is small enough to not need them.
+
+    It may run in another thread, as long as polydata isn't used anywhere
+    else meanwhile (e.g. a copy of the polydata of a shown actor).
+    """
+    lods = []
+    if not needs_lods(polydata):
+        return lods
+
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(polydata)
+    triangles.PassVertsOff()
+    triangles.PassLinesOff()
+    triangles.Update()
+    source = triangles.GetOutput()
+    del triangles
+
+    reduction = 1.0 - 1.0 / const.SURFACE_LOD_FACTOR
+    for i in range(const.SURFACE_LOD_MAX_LEVELS):
+        # Each level is decimated from the previous one, it's faster than
+        # decimating the full surface every time.
+        decimation = vtk.vtkQuadricDecimation()
+        decimation.SetInputData(source)
+        decimation.SetTargetReduction(reduction)
+        decimation.Update()
+        source = decimation.GetOutput()
+        del decimation
+
+        normals = vtk.vtkPolyDataNormals()
+        normals.SetInputData(source)
+        normals.SetFeatureAngle(80)
+        normals.AutoOrientNormalsOn()
+        normals.Update()
+        lods.append(normals.GetOutput())
+        del normals
+
+        if source.GetNumberOfPolys() <= const.SURFACE_LOD_MIN_POLYS // const.SURFACE_LOD_FACTOR:
+            break
+
+    return lods
+
+
+class SurfaceLOD(object):
+    """
+    Switches the mapper of a surface actor between the mapper of the full
+    surface (with npolys triangles) and the mappers of its levels of detail.
+    Since the actor is kept, its property (colour, transparency, etc) and
+    visibility are the same in all levels.
+    """
+    def __init__(self, actor, npolys):
+        self.actor = actor
+        # (number of triangles, mapper), from the finest to the coarsest.
+        self.levels = [(npolys, actor.GetMapper())]
+
+    def set_lods(self, lods):
+        del self.levels[1:]
+        for lod in lods:
+            mapper = vtk.vtkPolyDataMapper()
+            mapper.SetInputData(lod)
+            mapper.ScalarVisibilityOff()
+            self.levels.append((lod.GetNumberOfPolys(), mapper))
+
+    def set_interactive(self, interactive, max_polys):
+        """
+        While interactive shows the finest level with at most max_polys
+        triangles (or the coarsest one), otherwise the full surface.
+        """
+        mapper = self.levels[0][1]
+        if interactive:
+            for npolys, mapper in self.levels:
+                if npolys <= max_polys:
+                    break
+        self.actor.SetMapper(mapper)
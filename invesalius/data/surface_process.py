@@ -1,15 +1,109 @@
 import multiprocessing
-import tempfile
 import time
+import traceback
 
 import numpy
 import vtk
 
-import invesalius.i18n as i18n
 import invesalius.data.converters as converters
+import invesalius.data.mask_storage as mask_storage
 # import invesalius.data.imagedata_utils as iu
 
 from scipy import ndimage
+from six.moves import queue
+
+# The volume is split in about PIECES_PER_PROCESSOR pieces by processor, so
+# the work stays balanced even if some pieces are faster than others (or
+# empty). Pieces are never smaller than MIN_PIECE_SIZE slices.
+PIECES_PER_PROCESSOR = 4
+MIN_PIECE_SIZE = 8
+
+
+def compute_pieces(n_slices, n_processors,
+                   pieces_per_processor=PIECES_PER_PROCESSOR,
+                   min_size=MIN_PIECE_SIZE):
+    """
+    Splits n_slices axial slices into pieces of about
+    n_slices / (pieces_per_processor * n_processors) slices. Each piece
+    overlaps the next one by one slice, so the surfaces generated from
+    them touch each other. Returns a list of slices.
+
+    >>> compute_pieces(20, 2, 2, 1)
+    [slice(0, 6, None), slice(5, 11, None), slice(10, 16, None), slice(15, 20, None)]
+    """
+    n_pieces = min(pieces_per_processor * n_processors, n_slices // min_size)
+    n_pieces = max(n_pieces, 1)
+    bounds = [int(round(i * n_slices / float(n_pieces)))
+              for i in range(n_pieces + 1)]
+    return [slice(bounds[i], min(bounds[i + 1] + 1, n_slices))
+            for i in range(n_pieces)]
+
+
+def seams_z(pieces, spacing):
+    """
+    Returns the z coordinate of the slices shared by consecutive pieces.
+    """
+    return [p.start * spacing[2] for p in pieces[1:]]
+
+
+def smoothing_margin(smooth_iterations, smooth_relaxation_factor):
+    """
+    Number of slices added to each side of a piece before smoothing it.
+    An edge of the contour spans at most one slice and each iteration of
+    vtkSmoothPolyDataFilter only looks at the neighbour vertices, so with
+    this margin the vertices near the seams are smoothed exactly as if
+    the surface was smoothed whole.
+    """
+    if smooth_iterations and smooth_relaxation_factor:
+        return smooth_iterations + 1
+    return 0
+
+
+def seam_band(spacing, smooth_iterations, smooth_relaxation_factor,
+              tolerance):
+    """
+    Returns how far (in z) from the seams the points shared by two pieces
+    can be: each smoothing iteration moves a point by at most
+    smooth_relaxation_factor slices.
+    """
+    if not smoothing_margin(smooth_iterations, smooth_relaxation_factor):
+        return tolerance
+    return smooth_iterations * smooth_relaxation_factor * spacing[2] + tolerance
+
+
+def triangle_slices(points, polys, spacing):
+    """
+    Returns the z of the centroid of each triangle, in slices. The
+    triangles lying on a slice get exactly its number.
+    """
+    triangles = polys.reshape(-1, 4)[:, 1:]
+    z = points[:, 2].astype('float64')
+    centroid = (z[triangles[:, 0]] + z[triangles[:, 1]] + z[triangles[:, 2]]) \
+            / (3.0 * spacing[2])
+    nearest = numpy.round(centroid)
+    # The points are float32.
+    on_slice = numpy.abs(centroid - nearest) < 1e-3
+    centroid[on_slice] = nearest[on_slice]
+    return centroid
+
+
+def select_triangles(arrays, keep):
+    """
+    Returns a copy of arrays (from converters.polydata_to_numpy, with only
+    triangles) with the triangles where keep is True and their points.
+    """
+    triangles = arrays['polys'].reshape(-1, 4)[keep]
+    used = numpy.zeros(arrays['points'].shape[0], dtype='bool')
+    used[triangles[:, 1:].ravel()] = True
+    new_index = numpy.cumsum(used) - 1
+    triangles = triangles.copy()
+    triangles[:, 1:] = new_index[triangles[:, 1:]]
+
+    return {'points': arrays['points'][used],
+            'polys': triangles.ravel(),
+            'ncells': triangles.shape[0],
+            'point_data': [(name, attribute, array[used])
+                           for name, attribute, array in arrays['point_data']]}
 
 # TODO: Code duplicated from file {imagedata_utils.py}.
 def ResampleImage3D(imagedata, value):
@@ -33,107 +127,169 @@ def ResampleImage3D(imagedata, value):
     return resample.GetOutput()
 
 class SurfaceProcess(multiprocessing.Process):
+    """
+    Long-lived surface worker. It gets tasks (job, piece, roi) from q_in,
+    where job is a dict with the parameters of a surface creation, and
+    answers in q_out with messages (kind, job id, piece, data):
+
+        ('progress', id, piece, value) - value between 0 and 1
+        ('piece', id, piece, arrays) - arrays from
+            converters.polydata_to_numpy, None if the piece was skipped
+        ('error', id, piece, traceback)
 
-    def __init__(self, pipe, filename, shape, dtype, mask_filename,
-                 mask_shape, mask_dtype, spacing, mode, min_value, max_value,
-                 decimate_reduction, smooth_relaxation_factor,
-                 smooth_iterations, language, flip_image, q_in, q_out,
-                 from_binary, algorithm, imagedata_resolution):
+    Every task gets exactly one 'piece' or 'error' answer. Jobs with id
+    lower or equal to cancelled.value are skipped (or aborted).
+    """
 
+    def __init__(self, q_in, q_out, cancelled):
         multiprocessing.Process.__init__(self)
-        self.pipe = pipe
-        self.spacing = spacing
-        self.filename = filename
-        self.mode = mode
-        self.min_value = min_value
-        self.max_value = max_value
-        self.decimate_reduction = decimate_reduction
-        self.smooth_relaxation_factor = smooth_relaxation_factor
-        self.smooth_iterations = smooth_iterations
-        self.language = language
-        self.flip_image = flip_image
+        self.daemon = True
         self.q_in = q_in
         self.q_out = q_out
-        self.dtype = dtype
-        self.shape = shape
-        self.from_binary = from_binary
-        self.algorithm = algorithm
-        self.imagedata_resolution = imagedata_resolution
+        self.cancelled = cancelled
 
-        self.mask_filename = mask_filename
-        self.mask_shape = mask_shape
-        self.mask_dtype = mask_dtype
+        self.job_id = None
+        self.image = None
+        self._image_key = None
 
     def run(self):
-        if self.from_binary:
-            self.mask = numpy.memmap(self.mask_filename, mode='r',
-                                     dtype=self.mask_dtype,
-                                     shape=self.mask_shape)
-        else:
-            self.image = numpy.memmap(self.filename, mode='r', dtype=self.dtype,
-                                      shape=self.shape)
-            self.mask = numpy.memmap(self.mask_filename, mode='r',
-                                     dtype=self.mask_dtype,
-                                     shape=self.mask_shape)
-
         while 1:
-            roi = self.q_in.get()
-            if roi is None:
+            task = self.q_in.get()
+            if task is None:
                 break
-            self.CreateSurface(roi)
-
-    def SendProgress(self, obj, msg):
-        prog = obj.GetProgress()
-        self.pipe.send([prog, msg])
+            job, piece, roi = task
+            if self.IsCancelled(job['id']):
+                self.q_out.put(('piece', job['id'], piece, None))
+                continue
+            try:
+                self.SetJob(job)
+                self.piece = piece
+                self.CreateSurface(roi)
+            except Exception:
+                self.q_out.put(('error', job['id'], piece,
+                                traceback.format_exc()))
+
+    def SetJob(self, job):
+        if job['id'] == self.job_id:
+            return
+
+        self.job_id = job['id']
+        self.spacing = job['spacing']
+        self.mode = job['mode']
+        self.min_value = job['min_value']
+        self.max_value = job['max_value']
+        self.from_binary = job['from_binary']
+        self.algorithm = job['algorithm']
+        self.imagedata_resolution = job['imagedata_resolution']
+        self.smooth_iterations = job['smooth_iterations']
+        self.smooth_relaxation_factor = job['smooth_relaxation_factor']
+        self.n_slices = job['shape'][0]
+
+        # The image memmap is kept between jobs, the mask is opened again
+        # since it's a different mask or it may have been edited.
+        image_key = (job['filename'], tuple(job['shape']), str(job['dtype']))
+        if not self.from_binary and image_key != self._image_key:
+            # Copy-on-write, vtk wants writable memory but never writes.
+            self.image = numpy.memmap(job['filename'], mode='c',
+                                      dtype=job['dtype'], shape=job['shape'])
+            self._image_key = image_key
+        # Surfaces from the image only (e.g. the exports by threshold) have
+        # no mask.
+        if job['mask_filename'] is None:
+            self.mask = None
+        else:
+            self.mask = mask_storage.open_matrix(job['mask_filename'],
+                                                 job['mask_shape'],
+                                                 job['mask_storage'],
+                                                 job['mask_dtype'], mode='r')
+
+    def IsCancelled(self, job_id=None):
+        if job_id is None:
+            job_id = self.job_id
+        return job_id <= self.cancelled.value
+
+    def ObserveProgress(self, vtk_filter):
+        """
+        Sends the progress of vtk_filter, the next stage of this piece, and
+        aborts it if the job is cancelled.
+        """
+        stage = self.stage
+        n_stages = self.n_stages
+        self.stage += 1
+        last = [0.0]
+        def SendProgress(obj, evt):
+            if self.IsCancelled():
+                obj.SetAbortExecute(1)
+            progress = obj.GetProgress()
+            if progress - last[0] >= 0.05:
+                last[0] = progress
+                self.q_out.put(('progress', self.job_id, self.piece,
+                                (stage + progress) / float(n_stages)))
+        vtk_filter.AddObserver("ProgressEvent", SendProgress)
+
+    def SkipPiece(self):
+        self.q_out.put(('piece', self.job_id, self.piece, None))
 
     def CreateSurface(self, roi):
+        # contour and optionally smoothing.
+        self.n_stages = 1
+        if self.smooth_iterations and self.smooth_relaxation_factor:
+            self.n_stages += 1
+        self.stage = 0
+
+        # The piece is contoured with a margin of slices, so the smoothing
+        # near its ends is the same as in the neighbour pieces, and then
+        # only the triangles inside [first, last) (the slices of the piece)
+        # are kept. A triangle lying on the slice shared with the next
+        # piece belongs to the next one.
+        margin = smoothing_margin(self.smooth_iterations,
+                                  self.smooth_relaxation_factor)
+        first = roi.start if roi.start > 0 else None
+        last = roi.stop - 1 if roi.stop < self.n_slices else None
+        roi = slice(max(roi.start - margin, 0),
+                    min(roi.stop + margin, self.n_slices))
+
+        # The image given to vtk uses the memory of a_image, there is at
+        # most one copy of the piece in memory (none when contouring the
+        # image directly from the memmap).
         if self.from_binary:
-            a_mask = numpy.array(self.mask[roi.start + 1: roi.stop + 1,
-                                           1:, 1:])
-            image =  converters.to_vtk(a_mask, self.spacing, roi.start,
-                                       "AXIAL")
-            del a_mask
+            a_image = numpy.ascontiguousarray(self.mask[roi.start + 1: roi.stop + 1,
+                                                        1:, 1:])
+            # Without foreground voxels there is nothing to contour.
+            if a_image.max() <= 127:
+                self.SkipPiece()
+                return
         else:
-            a_image = numpy.array(self.image[roi])
+            a_image = self.image[roi]
 
             if self.algorithm == u'InVesalius 3.b2':
-                a_mask = numpy.array(self.mask[roi.start + 1: roi.stop + 1,
-                                               1:, 1:])
-                a_image[a_mask == 1] = a_image.min() - 1
-                a_image[a_mask == 254] = (self.min_value + self.max_value) / 2.0
-
-                image =  converters.to_vtk(a_image, self.spacing, roi.start,
-                                           "AXIAL")
-
-                gauss = vtk.vtkImageGaussianSmooth()
-                gauss.SetInputData(image)
-                gauss.SetRadiusFactor(0.3)
-                gauss.ReleaseDataFlagOn()
-                gauss.Update()
-
-                del image
-                image = gauss.GetOutput()
-                del gauss
-                del a_mask
-            else:
-                image = converters.to_vtk(a_image, self.spacing, roi.start,
-                                           "AXIAL")
-            del a_image
+                # The mask edition is applied to a copy of the image, slice
+                # by slice so there is no copy of the mask piece too. (The
+                # vtkImageGaussianSmooth done after it had a kernel radius
+                # of int(2.0 * 0.3) = 0, it only copied the image.)
+                a_image = numpy.array(a_image)
+                erased_value = a_image.min() - 1
+                edited_value = (self.min_value + self.max_value) / 2.0
+                for z in range(a_image.shape[0]):
+                    a_mask = self.mask[roi.start + z + 1, 1:, 1:]
+                    a_image[z][a_mask == 1] = erased_value
+                    a_image[z][a_mask == 254] = edited_value
+                    del a_mask
+
+            # The contour values are min_value and max_value, if all the
+            # voxels are below or above both there is no surface here.
+            if a_image.max() < self.min_value or a_image.min() > self.max_value:
+                self.SkipPiece()
+                return
+
+        image = converters.to_vtk_view(a_image, self.spacing, roi.start)
 
         if self.imagedata_resolution:
             # image = iu.ResampleImage3D(image, self.imagedata_resolution)
             image = ResampleImage3D(image, self.imagedata_resolution)
 
-        flip = vtk.vtkImageFlip()
-        flip.SetInputData(image)
-        flip.SetFilteredAxis(1)
-        flip.FlipAboutOriginOn()
-        flip.ReleaseDataFlagOn()
-        flip.Update()
-
-        del image
-        image = flip.GetOutput()
-        del flip
+        # The image is not flipped in the Y axis before the contour (it'd be
+        # another copy of it), the surface is mirrored later.
 
         #filename = tempfile.mktemp(suffix='_%s.vti' % (self.pid))
         #writer = vtk.vtkXMLImageDataWriter()
@@ -159,11 +315,13 @@ class SurfaceProcess(multiprocessing.Process):
         contour.ComputeGradientsOn()
         contour.ComputeNormalsOn()
         contour.ReleaseDataFlagOn()
+        self.ObserveProgress(contour)
         contour.Update()
         #contour.AddObserver("ProgressEvent", lambda obj,evt:
         #                    self.SendProgress(obj, _("Generating 3D surface...")))
         polydata = contour.GetOutput()
         del image
+        del a_image
         del contour
 
         #else: #mode == "GRAYSCALE":
@@ -198,16 +356,216 @@ class SurfaceProcess(multiprocessing.Process):
             #decimation.BoundaryVertexDeletionOff()
             #polydata = decimation.GetOutput()
 
-        self.pipe.send(None)
-        
-        filename = tempfile.mktemp(suffix='_%s.vtp' % (self.pid))
-        writer = vtk.vtkXMLPolyDataWriter()
-        writer.SetInputData(polydata)
-        writer.SetFileName(filename)
-        writer.Write()
-
-        print("Writing piece", roi, "to", filename)
+        # The triangles of the piece are chosen before smoothing, when they
+        # are still inside their voxels.
+        arrays = converters.polydata_to_numpy(polydata)
+        keep = None
+        if arrays['ncells'] and (first is not None or last is not None):
+            z = triangle_slices(arrays['points'], arrays['polys'], self.spacing)
+            keep = numpy.ones(z.size, dtype='bool')
+            if first is not None:
+                keep &= z >= first
+            if last is not None:
+                keep &= z < last
+            del z
+        del arrays
+
+        # The smoothing is done here, by piece. The decimation is done over
+        # the whole surface, after merging the pieces, so it doesn't depend
+        # on how the surface was split.
+        if margin and not self.IsCancelled():
+            smoother = vtk.vtkSmoothPolyDataFilter()
+            smoother.SetInputData(polydata)
+            smoother.SetNumberOfIterations(self.smooth_iterations)
+            smoother.SetRelaxationFactor(self.smooth_relaxation_factor)
+            smoother.SetFeatureAngle(80)
+            smoother.BoundarySmoothingOn()
+            smoother.FeatureEdgeSmoothingOn()
+            self.ObserveProgress(smoother)
+            smoother.Update()
+            del polydata
+            polydata = smoother.GetOutput()
+            del smoother
+
+        # The smoother keeps the order of the points and triangles.
+        if keep is not None:
+            arrays = select_triangles(converters.polydata_to_numpy(polydata),
+                                      keep)
+            del polydata
+            if not arrays['ncells']:
+                self.SkipPiece()
+                return
+            polydata = converters.numpy_to_polydata([arrays])
+            del arrays
+
+        if self.IsCancelled():
+            self.SkipPiece()
+            return
+
+        # The piece is sent to the main process as numpy arrays (pickled
+        # through the queue), it's cheaper than writing and reading it
+        # again from a vtp file.
+        arrays = converters.polydata_to_numpy(polydata)
+        converters.mirror_y(arrays)
+        # The pieces are measured here, the main process only sums them.
+        arrays['mass_properties'] = converters.mass_properties(arrays['points'],
+                                                               arrays['polys'])
+        print("Sending piece", roi, arrays['points'].shape[0], "points")
         del polydata
-        del writer
 
-        self.q_out.put(filename)
+        self.q_out.put(('piece', self.job_id, self.piece, arrays))
+
+
+class SurfaceWorkerPool(object):
+    """
+    Pool of SurfaceProcess workers, started once and reused by all the
+    surfaces created from the same project.
+    """
+    def __init__(self, n_processes=None):
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        self.n_processes = n_processes
+        self.q_in = multiprocessing.Queue()
+        self.q_out = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Value('i', -1)
+        self.processes = []
+        self._next_id = 0
+
+    def start(self):
+        for i in range(self.n_processes):
+            sp = SurfaceProcess(self.q_in, self.q_out, self.cancelled)
+            sp.start()
+            self.processes.append(sp)
+
+    def is_alive(self):
+        return bool(self.processes) and all(p.is_alive() for p in self.processes)
+
+    def cancel(self, job_id):
+        self.cancelled.value = max(self.cancelled.value, job_id)
+
+    def run(self, job, pieces, progress_callback=None):
+        """
+        Creates the surface pieces of job (see SurfaceProcess.SetJob) and
+        returns them as a list of arrays dicts.
+
+        progress_callback(value) is called with the overall progress
+        (between 0 and 1) while waiting; if it returns False the job is
+        cancelled and run returns None.
+        """
+        for n, results in self.run_many([(job, pieces)], progress_callback):
+            return results
+
+    def run_many(self, jobs, progress_callback=None):
+        """
+        Creates the surfaces of jobs, a list of (job, pieces). The pieces of
+        all the jobs are queued at once, so the workers don't wait for the
+        results of a job to be handled before starting the next one.
+
+        It's a generator, yields (n, results) as soon as the n-th job is
+        done, where results is like the return of run. If progress_callback
+        (see run) returns False the remaining jobs are cancelled and nothing
+        else is yielded. If a piece fails the remaining jobs are cancelled
+        and RuntimeError is raised.
+        """
+        if not self.is_alive():
+            self.shutdown()
+            self.start()
+
+        pending = {}
+        remaining = {}
+        for n, (job, pieces) in enumerate(jobs):
+            job = dict(job)
+            job['id'] = job_id = self._next_id
+            self._next_id += 1
+            pending[job_id] = (n, [])
+            remaining[job_id] = len(pieces)
+            for piece, roi in enumerate(pieces):
+                self.q_in.put((job, piece, roi))
+        last_id = self._next_id - 1
+
+        n_pieces = sum(len(pieces) for job, pieces in jobs)
+        progress = {}
+        try:
+            while pending:
+                try:
+                    kind, msg_id, piece, data = self.q_out.get(timeout=0.1)
+                except queue.Empty:
+                    if not self.is_alive():
+                        raise RuntimeError("A surface worker process died")
+                else:
+                    # Late messages from a cancelled job are discarded.
+                    if msg_id not in pending:
+                        continue
+                    if kind == 'progress':
+                        progress[msg_id, piece] = data
+                    else:
+                        progress[msg_id, piece] = 1.0
+                        remaining[msg_id] -= 1
+                        if kind == 'error':
+                            raise RuntimeError(data)
+                        elif data is not None:
+                            pending[msg_id][1].append(data)
+
+                        if not remaining[msg_id]:
+                            n, results = pending.pop(msg_id)
+                            yield n, results
+
+                if progress_callback is not None and pending:
+                    if progress_callback(sum(progress.values()) / float(n_pieces)) is False:
+                        return
+        finally:
+            # Cancelled, failed or the caller stopped iterating: the jobs
+            # left are not needed anymore.
+            if pending:
+                self.cancel(last_id)
+
+    def shutdown(self):
+        for p in self.processes:
+            self.q_in.put(None)
+        for p in self.processes:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
+
+        # The sentinels of the workers that had already exited and the
+        # pieces of a failed run are still queued, the next workers would
+        # take them. A terminated worker may also have left the queues
+        # locked. So the queues are replaced.
+        for q in (self.q_in, self.q_out):
+            q.close()
+            q.cancel_join_thread()
+        self.q_in = multiprocessing.Queue()
+        self.q_out = multiprocessing.Queue()
+
+
+class PipelineProgress(object):
+    """
+    Progress of a sequence of n_filters vtk filters run in another thread.
+    The GUI thread reads value and sets cancelled, which aborts the
+    running filter.
+    """
+    def __init__(self, n_filters):
+        self.n_filters = max(n_filters, 1)
+        self.done = 0
+        self.current = 0.0
+        self.cancelled = False
+
+    @property
+    def value(self):
+        return min((self.done + self.current) / float(self.n_filters), 1.0)
+
+    def observe(self, vtk_filter):
+        def OnProgress(obj, evt):
+            if self.cancelled:
+                obj.SetAbortExecute(1)
+            self.current = obj.GetProgress()
+        vtk_filter.AddObserver("ProgressEvent", OnProgress)
+        vtk_filter.AddObserver("EndEvent", lambda obj, evt: self.step())
+
+    def step(self):
+        """
+        Marks a step (observed or not) as done.
+        """
+        self.done += 1
+        self.current = 0.0
@@ -38,6 +38,7 @@ import invesalius.data.bases as bases
 import invesalius.data.transformations as tr
 import invesalius.data.vtk_utils as vtku
 import invesalius.project as prj
+import invesalius.session as ses
 import invesalius.style as st
 import invesalius.utils as utils
 
@@ -63,8 +64,13 @@ class Viewer(wx.Panel):
 
         self.staticballs = []
 
+        # Surfaces levels of detail, see OnStartInteraction.
+        self._interactive_lod = False
+        self._lod_timer = None
+
         style = vtk.vtkInteractorStyleTrackballCamera()
         self.style = style
+        self._bind_lod_events(style)
 
         interactor = wxVTKRenderWindowInteractor(self, -1, size = self.GetSize())
         interactor.SetInteractorStyle(style)
@@ -98,6 +104,17 @@ class Viewer(wx.Panel):
         self.text.SetValue("")
         self.ren.AddActor(self.text.actor)
 
+        # Frame rate of the raycasting, shown while a volume is loaded.
+        self.text_fps = vtku.Text()
+        self.text_fps.SetValue("")
+        self.text_fps.SetPosition(const.TEXT_POS_RIGHT_DOWN)
+        self.text_fps.SetJustificationToRight()
+        self.text_fps.SetVerticalJustificationToBottom()
+        self.text_fps.Hide()
+        self.ren.AddActor(self.text_fps.actor)
+        self.ren.AddObserver("EndEvent", self.OnRenderEnd)
+        self.SetFrameTime()
+
         # axes = vtk.vtkAxesActor()
         # axes.SetXAxisLabelText('x')
         # axes.SetYAxisLabelText('y')
@@ -182,6 +199,8 @@ class Viewer(wx.Panel):
                                  'Unload volume')
         Publisher.subscribe(self.OnSetWindowLevelText,
                             'Set volume window and level text')
+        Publisher.subscribe(self.OnUpdateFrameTime,
+                            'Update raycasting frame time')
         Publisher.subscribe(self.OnHideRaycasting,
                                 'Hide raycasting volume')
         Publisher.subscribe(self.OnShowRaycasting,
@@ -455,6 +474,7 @@ class Viewer(wx.Panel):
         volumes = self.ren.GetVolumes()
         if (volumes.GetNumberOfItems()):
             self.ren.RemoveVolume(volumes.GetLastProp())
+            self.text_fps.Hide()
             self.interactor.Render()
             self._to_show_ball -= 1
             self._check_and_set_ball_visibility()
@@ -1317,6 +1337,7 @@ class Viewer(wx.Panel):
             style = vtk.vtkInteractorStyleTrackballCamera()
             self.interactor.SetInteractorStyle(style)
             self.style = style
+            self._bind_lod_events(style)
 
             # Check each event available for each mode
             for event in action[state]:
@@ -1325,6 +1346,57 @@ class Viewer(wx.Panel):
 
         self._last_state = state
 
+    def _bind_lod_events(self, style):
+        style.AddObserver("StartInteractionEvent", self.OnStartInteraction)
+        style.AddObserver("EndInteractionEvent", self.OnEndInteraction)
+
+    def OnStartInteraction(self, obj, evt):
+        """
+        The surfaces show their coarser levels of detail while the camera
+        is moving.
+        """
+        if self._lod_timer is not None:
+            self._lod_timer.Stop()
+            self._lod_timer = None
+        if not self._interactive_lod:
+            self._interactive_lod = True
+            Publisher.sendMessage('Set surfaces interactive LOD', True)
+            Publisher.sendMessage('Set raycasting interactive quality', True)
+
+    def OnEndInteraction(self, obj, evt):
+        # The full surfaces are shown only when the camera is still for a
+        # while, otherwise each mouse wheel step would render them.
+        if self._lod_timer is not None:
+            self._lod_timer.Stop()
+        self._lod_timer = wx.CallLater(const.SURFACE_LOD_STILL_DELAY,
+                                       self._OnCameraStill)
+
+    def _OnCameraStill(self):
+        self._lod_timer = None
+        if self._interactive_lod:
+            self._interactive_lod = False
+            Publisher.sendMessage('Set surfaces interactive LOD', False)
+            Publisher.sendMessage('Set raycasting interactive quality', False)
+            self.interactor.Render()
+
+    def SetFrameTime(self):
+        """
+        The raycasting mappers adjust their sample distances to render each
+        frame, while interacting, in the frame time set in the preferences.
+        """
+        frame_time = max(int(ses.Session().raycasting_frame_time), 1)
+        self.interactor.SetDesiredUpdateRate(1000.0 / frame_time)
+
+    def OnUpdateFrameTime(self, pubsub_evt):
+        self.SetFrameTime()
+
+    def OnRenderEnd(self, obj, evt):
+        if not self.raycasting_volume:
+            return
+        render_time = self.ren.GetLastRenderTimeInSeconds()
+        if render_time > 0:
+            self.text_fps.SetValue("FPS: %.1f" % (1.0 / render_time))
+
     def OnSpinMove(self, evt, obj):
         if (self.mouse_pressed):
             evt.Spin()
@@ -1576,6 +1648,8 @@ class Viewer(wx.Panel):
 
         self.ren.AddVolume(volume)
         self.text.SetValue("WL: %d  WW: %d"%(wl, ww))
+        self.text_fps.SetValue("")
+        self.text_fps.Show()
 
         if self.on_wl:
             self.text.Show()
@@ -1598,6 +1672,7 @@ class Viewer(wx.Panel):
         self.ren.RemoveVolume(volume)
         del volume
         self.raycasting_volume = False
+        self.text_fps.Hide()
         self._to_show_ball -= 1
         self._check_and_set_ball_visibility()
 
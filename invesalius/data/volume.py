@@ -16,9 +16,11 @@
 #    PARTICULAR. Consulte a Licenca Publica Geral GNU para obter mais
 #    detalhes.
 #--------------------------------------------------------------------------
+import collections
 import plistlib
 import os
-import weakref
+import shutil
+import tempfile
 
 import numpy
 import vtk
@@ -29,9 +31,11 @@ import invesalius.constants as const
 import invesalius.project as prj
 import invesalius.data.slice_ as slice_
 import invesalius.data.converters as converters
+import invesalius.data.histogram as hist
 import invesalius.data.vtk_utils as vtk_utils
 from vtk.util import numpy_support
 import invesalius.session as ses
+import invesalius.utils as utils
 
 
 Kernels = { 
@@ -42,6 +46,191 @@ Kernels = {
                           1.0, 1.0, 1.0, 1.0, 1.0]
 }
 
+# Number of voxels processed at once when preparing the image given to the
+# volume mapper.
+SLAB_SIZE = 2 ** 22
+
+# Size, in voxels, of the side of the bricks used to find the regions of the
+# image made fully transparent by the opacity function.
+BRICK_SIZE = 16
+
+
+def fill_volume_array(matrix, shift, out, update_progress=None):
+    """
+    Writes into out (an unsigned short array with the shape of matrix) the
+    matrix flipped in the Y axis and shifted by shift, slab by slab. It's
+    the same done by vtkImageFlip and vtkImageShiftScale, without their
+    full size intermediate images.
+    """
+    slabs = list(utils.slabs(matrix.shape, SLAB_SIZE))
+    for n, (zi, zf) in enumerate(slabs):
+        slab = numpy.array(matrix[zi:zf, ::-1], dtype='int32')
+        slab += shift
+        out[zi:zf] = slab
+        del slab
+        if update_progress is not None:
+            update_progress((n + 1.0) / len(slabs), "Rendering...")
+
+
+def convolve_volume_array(array, spacing, kernel, update_progress=None):
+    """
+    Applies vtkImageConvolve with the 5x5 kernel to array in place, slab by
+    slab. The kernel is 2D, each slice is filtered on its own, so the result
+    is the same of filtering the whole image at once.
+    """
+    slabs = list(utils.slabs(array.shape, SLAB_SIZE))
+    for n, (zi, zf) in enumerate(slabs):
+        slab = array[zi:zf]
+        convolve = vtk.vtkImageConvolve()
+        convolve.SetInputData(converters.to_vtk_view(slab, spacing, zi))
+        convolve.SetKernel5x5(kernel)
+        convolve.Update()
+        output = convolve.GetOutput().GetPointData().GetScalars()
+        slab[:] = numpy_support.vtk_to_numpy(output).reshape(slab.shape)
+        del convolve
+        del output
+        if update_progress is not None:
+            update_progress((n + 1.0) / len(slabs), "Rendering...")
+
+
+def brick_min_max(array, brick_size=BRICK_SIZE):
+    """
+    Returns the minimum and the maximum value of each brick (a block of
+    brick_size voxels in each axis) of array, as two arrays indexed by brick.
+    """
+    dz, dy, dx = array.shape
+    ys = numpy.arange(0, dy, brick_size)
+    xs = numpy.arange(0, dx, brick_size)
+    shape = ((dz + brick_size - 1) // brick_size, ys.size, xs.size)
+    bmin = numpy.empty(shape, dtype=array.dtype)
+    bmax = numpy.empty(shape, dtype=array.dtype)
+    for n, zi in enumerate(range(0, dz, brick_size)):
+        slab = numpy.asarray(array[zi:zi + brick_size])
+        for out, ufunc in ((bmin, numpy.minimum), (bmax, numpy.maximum)):
+            plane = ufunc.reduce(slab, axis=0)
+            plane = ufunc.reduceat(plane, ys, axis=0)
+            out[n] = ufunc.reduceat(plane, xs, axis=1)
+    return bmin, bmax
+
+
+def visible_values(opacity_transfer_func):
+    """
+    Returns a boolean array telling, for each unsigned short value, if the
+    opacity function gives it some opacity. The function is taken as
+    linear between its nodes, which may only mark as visible values that
+    are not.
+    """
+    points = []
+    node = [0.0] * 4
+    for i in range(opacity_transfer_func.GetSize()):
+        opacity_transfer_func.GetNodeValue(i, node)
+        points.append(node[:2])
+    if not points:
+        return numpy.ones(2**16, dtype='bool')
+    xs, ys = numpy.array(points).T
+    return numpy.interp(numpy.arange(2**16), xs, ys) > 0
+
+
+def visible_extent(bmin, bmax, visible, shape, brick_size=BRICK_SIZE):
+    """
+    Returns the extent (z0, z1, y0, y1, x0, x1), in voxels, of the bricks
+    holding some value marked in visible. The extent is grown by one voxel,
+    the samples between a visible brick and its neighbours are
+    interpolated from both. Returns None if no brick is visible.
+    """
+    count = numpy.zeros(visible.size + 1, dtype='int64')
+    numpy.cumsum(visible, out=count[1:])
+    bricks = (count[bmax.astype('int64') + 1] - count[bmin]) > 0
+    if not bricks.any():
+        return None
+
+    extent = []
+    for axis, n in enumerate(shape):
+        others = tuple(i for i in range(3) if i != axis)
+        used = numpy.nonzero(bricks.any(axis=others))[0]
+        extent.append(max(int(used[0]) * brick_size - 1, 0))
+        extent.append(min((int(used[-1]) + 1) * brick_size, n - 1))
+    return extent
+
+
+# The colour lists used by the presets without advanced CLUT, by name.
+_colour_lists = {}
+
+
+def read_colour_list(name):
+    """
+    Returns the colours, a list of (r, g, b) from 0 to 255, of the colour
+    list name. Each file is parsed only the first time it's used.
+    """
+    try:
+        return _colour_lists[name]
+    except KeyError:
+        p = plistlib.readPlist(
+            os.path.join(const.RAYCASTING_PRESETS_DIRECTORY,
+                         'color_list', name + '.plist'))
+        colours = list(zip(p['Red'], p['Green'], p['Blue']))
+        _colour_lists[name] = colours
+        return colours
+
+
+class VolumeCache(object):
+    """
+    The images prepared for the raycasting (the slice matrix flipped,
+    shifted to unsigned short and filtered), kept in memory-mapped files and
+    keyed by (matrix generation, convolution filters). When there are more
+    than max_size images the least recently used one is removed.
+    """
+    def __init__(self, max_size=const.RAYCASTING_CACHE_SIZE):
+        self.max_size = max_size
+        self.folder = None
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the filename and the scalar range of the matrix of the
+        image prepared for key, or None.
+        """
+        try:
+            filename, scale, owned = self.entries.pop(key)
+        except KeyError:
+            return None
+        self.entries[key] = (filename, scale, owned)
+        return filename, scale
+
+    def new_filename(self):
+        if self.folder is None:
+            self.folder = tempfile.mkdtemp()
+        return tempfile.mktemp(suffix='.dat', dir=self.folder)
+
+    def add(self, key, filename, scale, owned=True):
+        """
+        Adds the image in filename to the cache. If owned the file is
+        removed with the entry, otherwise (e.g. the file belongs to the
+        project) it's left alone.
+        """
+        self.entries[key] = (filename, scale, owned)
+        while len(self.entries) > self.max_size:
+            key, (filename, scale, owned) = self.entries.popitem(last=False)
+            if owned:
+                self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            # It's still mapped (on Windows), it goes with the folder.
+            pass
+
+    def clear(self):
+        for filename, scale, owned in self.entries.values():
+            if owned:
+                self._remove(filename)
+        self.entries.clear()
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+
 SHADING = {
     "Default": {
         "ambient"       :0.15,
@@ -79,6 +268,7 @@ class Volume():
         self.config = None
         self.exist = None
         self.color_transfer = None
+        self.clut_nodes = None
         self.opacity_transfer_func = None
         self.ww = None
         self.wl = None
@@ -87,7 +277,11 @@ class Volume():
         self.plane_on = False
         self.volume = None
         self.image = None
-        self.loaded_image = 0
+        self.image_array = None
+        self.image_key = None
+        self.cache = VolumeCache()
+        self.bricks = None
+        self.bricks_key = None
         self.to_reload = False
         self.__bind_events()
 
@@ -102,6 +296,8 @@ class Volume():
                                 'Set raycasting wwwl')
         Publisher.subscribe(self.Refresh,
                                 'Set raycasting refresh')
+        Publisher.subscribe(self.OnUpdateCurve,
+                                'Update raycasting curve')
         Publisher.subscribe(self.OnSetRelativeWindowLevel,
                                  'Set raycasting relative window and level')
         Publisher.subscribe(self.OnEnableTool,
@@ -113,6 +309,10 @@ class Volume():
         Publisher.subscribe(self.ResetRayCasting, 'Reset Reaycasting')
 
         Publisher.subscribe(self.OnFlipVolume, 'Flip volume')
+        Publisher.subscribe(self.OnFlipVolume, 'Swap volume axes')
+
+        Publisher.subscribe(self.OnSetInteractiveQuality,
+                            'Set raycasting interactive quality')
 
     def ResetRayCasting(self, pub_evt):
         if self.exist:
@@ -148,13 +348,21 @@ class Volume():
             del self.volume_mapper
             self.volume = None
             self.exist = False
-            self.loaded_image = False
             self.image = None
+            self.image_array = None
+            self.image_key = None
             self.final_imagedata = None
             self.opacity_transfer_func = None
             self.color_transfer = None
+            self.clut_nodes = None
             Publisher.sendMessage('Render volume viewer')
 
+        self.image_key = None
+        self.cache.clear()
+        self.bricks = None
+        self.bricks_key = None
+        prj.Project().prepared_volume = None
+
     def OnLoadVolume(self, pubsub_evt):
         label = pubsub_evt.data
         #self.LoadConfig(label)
@@ -214,18 +422,40 @@ class Volume():
             del self.volume_mapper
             self.volume = None
             self.exist = False
-            self.loaded_image = False
             self.image = None
+            self.image_array = None
+            self.image_key = None
             self.final_imagedata = None
             self.opacity_transfer_func = None
             self.color_transfer = None
+            self.clut_nodes = None
             Publisher.sendMessage('Render volume viewer')
 
+    def OnSetInteractiveQuality(self, pubsub_evt):
+        self.SetInteractiveQuality(pubsub_evt.data)
+
+    def SetInteractiveQuality(self, interactive):
+        """
+        While interacting the mapper raises the sample distances to render
+        each frame in the time asked by the interactor (see the frame time
+        in the preferences). When the interaction ends the volume is
+        rendered again with the full quality.
+        """
+        if not self.exist:
+            return
+        volume_mapper = self.volume_mapper
+        if interactive:
+            volume_mapper.AutoAdjustSampleDistancesOn()
+        else:
+            volume_mapper.AutoAdjustSampleDistancesOff()
+            volume_mapper.SetImageSampleDistance(const.RAYCASTING_IMAGE_SAMPLE_DISTANCE)
+            volume_mapper.SetSampleDistance(self.sample_distance)
+
     def OnFlipVolume(self, pubsub_evt):
         print("Flipping Volume")
-        self.loaded_image = False
-        del self.image
-        self.image = None
+        # The matrix changed, the prepared image saved in the project is not
+        # valid anymore.
+        prj.Project().prepared_volume = None
         self.to_reload = True
         
     def __load_preset_config(self):
@@ -235,22 +465,86 @@ class Volume():
         if self.config['advancedCLUT']:
             self.Create16bColorTable(self.scale)
             self.CreateOpacityTable(self.scale)
+            self.clut_nodes = [self._GetCurveNodes(n) for n in
+                               range(len(self.config['16bitClutCurves']))]
         else:
             self.Create8bColorTable(self.scale)
             self.Create8bOpacityTable(self.scale)
+            self.clut_nodes = None
+
+    def _GetCurveNodes(self, n):
+        """
+        Returns the nodes (x, red, green, blue, opacity) the curve n adds to
+        the transfer functions.
+        """
+        nodes = []
+        curve = self.config['16bitClutCurves'][n]
+        colours = self.config['16bitClutColors'][n]
+        for point, colour in zip(curve, colours):
+            nodes.append((self.TranslateScale(self.scale, point['x']),
+                          colour['red'], colour['green'], colour['blue'],
+                          point['y']))
+        return nodes
+
+    def UpdateCurve(self, n):
+        """
+        Updates the transfer functions after the nodes of the curve n were
+        moved, patching only the nodes that changed. The functions are
+        built again if nodes were added or removed or if a changed node
+        shares its position with a node of other curve.
+        """
+        curves = self.config['16bitClutCurves']
+        if not self.config['advancedCLUT'] or self.clut_nodes is None \
+           or len(self.clut_nodes) != len(curves):
+            self.__update_colour_table()
+            return
+
+        old = self.clut_nodes[n]
+        new = self._GetCurveNodes(n)
+        if len(old) != len(new):
+            self.__update_colour_table()
+            return
+
+        changed = [(o, c) for o, c in zip(old, new) if o != c]
+        # The ends of the segment added by CreateOpacityTable.
+        others = set([0, 2**16-1])
+        for i, nodes in enumerate(self.clut_nodes):
+            if i != n:
+                others.update(node[0] for node in nodes)
+        for o, c in changed:
+            if o[0] in others or c[0] in others:
+                self.__update_colour_table()
+                return
+
+        for o, c in changed:
+            self.color_transfer.RemovePoint(o[0])
+            self.opacity_transfer_func.RemovePoint(o[0])
+        for o, c in changed:
+            x, r, g, b, opacity = c
+            self.color_transfer.AddRGBPoint(x, r, g, b)
+            self.opacity_transfer_func.AddPoint(x, opacity)
+        self.clut_nodes[n] = new
+
+    def OnUpdateCurve(self, pubsub_evt):
+        if self.exist:
+            self.UpdateCurve(pubsub_evt.data)
+            self.UpdateCropping()
 
     def __load_preset(self):   
+        # Update convolution filter, only if the preset uses other filters.
+        if self.PrepareImage():
+            self.volume_mapper.SetInputData(self.image)
+            self.final_imagedata = self.image
+            if self.plane:
+                self.plane.SetVolumeMapper(self.volume_mapper)
+
         # Update colour table
         self.__update_colour_table()
 
-        # Update convolution filter
-        original_imagedata = self.imagedata.GetOutput()
-        imagedata = self.ApplyConvolution(original_imagedata)
-        self.volume_mapper.SetInputData(imagedata)
-
         # Update other information
         self.SetShading()
         self.SetTypeRaycasting()
+        self.UpdateCropping()
 
     def OnSetCurve(self, pubsub_evt):
         self.curve = pubsub_evt.data
@@ -301,11 +595,16 @@ class Volume():
                     i['x'] -= shiftWW * factor
                 else:
                     i['x'] += shiftWW * factor
+
+            # Only the nodes of this curve moved.
+            self.UpdateCurve(self.curve)
         else:
             self.config['wl'] = wl
             self.config['ww'] = ww
 
-        self.__update_colour_table()
+            self.__update_colour_table()
+
+        self.UpdateCropping()
 
     def CalculateWWWL(self):
         """
@@ -323,6 +622,7 @@ class Volume():
 
     def Refresh(self, pubsub_evt):
         self.__update_colour_table()
+        self.UpdateCropping()
 
     def Create16bColorTable(self, scale):
         if self.color_transfer:
@@ -354,13 +654,7 @@ class Volume():
         color_transfer.RemoveAllPoints()
         color_preset = self.config['CLUT']
         if color_preset != "No CLUT":
-            p = plistlib.readPlist(
-                os.path.join(const.RAYCASTING_PRESETS_DIRECTORY,
-                             'color_list', color_preset + '.plist'))
-            r = p['Red']
-            g = p['Green']
-            b = p['Blue']
-            colors = list(zip(r,g,b))
+            colors = read_colour_list(color_preset)
         else:
             # Grayscale from black to white
             colors = [(i, i, i) for i in range(256)]
@@ -504,85 +798,127 @@ class Volume():
             if ses.Session().rendering == '0':
                 self.volume_mapper.SetVolumeRayCastFunction(raycasting_function)
 
-    def ApplyConvolution(self, imagedata, update_progress = None):
-        number_filters = len(self.config['convolutionFilters'])
-        if number_filters:
-            if not(update_progress):
-                update_progress = vtk_utils.ShowProgress(number_filters)
-            for filter in self.config['convolutionFilters']:
-                convolve = vtk.vtkImageConvolve()
-                convolve.SetInputData(imagedata)
-                convolve.SetKernel5x5([i/60.0 for i in Kernels[filter]])
-                #  convolve.ReleaseDataFlagOn()
-
-                convolve_ref = weakref.ref(convolve)
-                
-                convolve_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                                     update_progress(convolve_ref(), "Rendering..."))
-                convolve.Update()
-                del imagedata
-                imagedata = convolve.GetOutput()
-                del convolve
-                #convolve.GetOutput().ReleaseDataFlagOn()
-        return imagedata
-
-    def LoadImage(self):
+    def UpdateCropping(self):
+        """
+        Crops the volume to the bricks the opacity function doesn't make
+        fully transparent, so the rays don't sample the air around the
+        visible structures. Called each time the opacity function changes.
+        """
+        if not self.exist:
+            return
+        volume_mapper = self.volume_mapper
+        # In MIP a transparent voxel may still be the maximum of a ray.
+        if self.config.get('MIP', False):
+            volume_mapper.CroppingOff()
+            return
+
+        if self.bricks is None or self.bricks_key != self.image_key:
+            self.bricks = brick_min_max(self.image_array)
+            self.bricks_key = self.image_key
+        bmin, bmax = self.bricks
+
+        extent = visible_extent(bmin, bmax,
+                                visible_values(self.opacity_transfer_func),
+                                self.image_array.shape)
+        if extent is None:
+            volume_mapper.CroppingOff()
+            return
+
+        z0, z1, y0, y1, x0, x1 = extent
+        sx, sy, sz = self.image.GetSpacing()
+        ox, oy, oz = self.image.GetOrigin()
+        volume_mapper.SetCroppingRegionPlanes(ox + x0 * sx, ox + x1 * sx,
+                                              oy + y0 * sy, oy + y1 * sy,
+                                              oz + z0 * sz, oz + z1 * sz)
+        volume_mapper.SetCroppingRegionFlagsToSubVolume()
+        volume_mapper.CroppingOn()
+
+    def PrepareImage(self, update_progress=None):
+        """
+        Makes self.image the image given to the volume mapper: the slice
+        matrix flipped in the Y axis (as vtkImageFlip with FlipAboutOrigin
+        does), shifted to unsigned short and filtered by the convolution
+        filters of the preset. The image is taken from the cache (or from
+        the project) if it was already prepared. Returns False if self.image
+        was already that image.
+        """
         slice_data = slice_.Slice()
-        n_array = slice_data.matrix
+        matrix = slice_data.matrix
         spacing = slice_data.spacing
-        slice_number = 0
-        orientation = 'AXIAL'
+        dz, dy, dx = matrix.shape
+
+        filters = tuple(self.config['convolutionFilters'])
+        key = (slice_data.matrix_generation, filters)
+        if key == self.image_key:
+            return False
+
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self._GetProjectImage(key, matrix.shape)
+
+        if entry is None:
+            filename = self.cache.new_filename()
+            scale = (float(matrix.min()), float(matrix.max()))
+            array = numpy.memmap(filename, dtype='uint16', mode='w+',
+                                 shape=matrix.shape)
+            fill_volume_array(matrix, int(abs(scale[0])), array,
+                              update_progress)
+            for filter in filters:
+                convolve_volume_array(array, spacing,
+                                      [i/60.0 for i in Kernels[filter]],
+                                      update_progress)
+            array.flush()
+            self.cache.add(key, filename, scale)
+        else:
+            filename, scale = entry
+            array = numpy.memmap(filename, dtype='uint16', mode='r+',
+                                 shape=matrix.shape)
 
-        image = converters.to_vtk(n_array, spacing, slice_number, orientation) 
+        image = converters.to_vtk_view(array, spacing, 0)
+        # The flip about the origin mirrors the image in the world
+        # coordinates.
+        image.SetOrigin(0, -spacing[1] * (dy - 1), 0)
+
+        self.image_array = array
         self.image = image
+        self.image_key = key
+        self.scale = scale
+
+        # Saved with the project, so it's not prepared again when reopened.
+        prj.Project().prepared_volume = {'filename': filename,
+                                         'filters': list(filters),
+                                         'scale': list(scale)}
+        return True
+
+    def _GetProjectImage(self, key, shape):
+        """
+        Returns the (filename, scale) of the image prepared and saved with
+        the project if it was prepared for key, None otherwise.
+        """
+        prepared = prj.Project().prepared_volume
+        if prepared is None or tuple(prepared['filters']) != key[1]:
+            return None
+        filename = prepared['filename']
+        size = 2
+        for n in shape:
+            size *= n
+        if not os.path.exists(filename) or os.path.getsize(filename) != size:
+            return None
+        scale = tuple(prepared['scale'])
+        self.cache.add(key, filename, scale, owned=False)
+        return filename, scale
 
     def LoadVolume(self):
         proj = prj.Project()
         #image = imagedata_utils.to_vtk(n_array, spacing, slice_number, orientation) 
 
-        if not self.loaded_image:
-            self.LoadImage()
-            self.loaded_image = 1
-
-        image = self.image
-
         number_filters = len(self.config['convolutionFilters'])
-        
-        if (prj.Project().original_orientation == const.AXIAL):
-            flip_image = True
-        else:
-            flip_image = False
-        
-        #if (flip_image):    
-        update_progress= vtk_utils.ShowProgress(2 + number_filters) 
-        # Flip original vtkImageData
-        flip = vtk.vtkImageFlip()
-        flip.SetInputData(image)
-        flip.SetFilteredAxis(1)
-        flip.FlipAboutOriginOn()
-        #  flip.ReleaseDataFlagOn()
-
-        flip_ref = weakref.ref(flip)
-        flip_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            update_progress(flip_ref(), "Rendering..."))
-        flip.Update()
-        image = flip.GetOutput()
-        
-        scale = image.GetScalarRange()
-        self.scale = scale
+        update_progress= vtk_utils.ShowProgress(1 + number_filters) 
 
-        cast = vtk.vtkImageShiftScale()
-        cast.SetInputData(image)
-        cast.SetShift(abs(scale[0]))
-        cast.SetOutputScalarTypeToUnsignedShort()
-        #  cast.ReleaseDataFlagOn()
-        cast_ref = weakref.ref(cast)
-        cast_ref().AddObserver("ProgressEvent", lambda obj,evt:
-                            update_progress(cast_ref(), "Rendering..."))
-        cast.Update()
-        image2 = cast
-
-        self.imagedata = image2
+        self.PrepareImage(update_progress)
+        scale = self.scale
+
+        self.imagedata = self.image
         if self.config['advancedCLUT']:
             self.Create16bColorTable(scale)
             self.CreateOpacityTable(scale)
@@ -590,7 +926,7 @@ class Volume():
             self.Create8bColorTable(scale)
             self.Create8bOpacityTable(scale)
 
-        image2 = self.ApplyConvolution(image2.GetOutput(), update_progress)
+        image2 = self.image
         self.final_imagedata = image2
 
         # Changed the vtkVolumeRayCast to vtkFixedPointVolumeRayCastMapper
@@ -642,8 +978,12 @@ class Volume():
         # TODO: Need to see values that improve the quality and don't decrease
         # the performance. 2.0 seems to be a good value to pix_diag
         pix_diag = 2.0
-        volume_mapper.SetImageSampleDistance(0.25)
-        volume_mapper.SetSampleDistance(pix_diag / 5.0)
+        self.sample_distance = pix_diag / 5.0
+        volume_mapper.SetMinimumImageSampleDistance(const.RAYCASTING_IMAGE_SAMPLE_DISTANCE)
+        volume_mapper.SetMaximumImageSampleDistance(const.RAYCASTING_MAX_IMAGE_SAMPLE_DISTANCE)
+        if volume_mapper.IsA("vtkFixedPointVolumeRayCastMapper"):
+            volume_mapper.SetInteractiveSampleDistance(self.sample_distance
+                                                       * const.RAYCASTING_INTERACTIVE_SAMPLE_FACTOR)
         volume_properties.SetScalarOpacityUnitDistance(pix_diag)
 
         self.volume_properties = volume_properties
@@ -658,6 +998,8 @@ class Volume():
         colour = self.GetBackgroundColour()
 
         self.exist = 1
+        self.SetInteractiveQuality(False)
+        self.UpdateCropping()
 
         if self.plane:
             self.plane.SetVolumeMapper(volume_mapper)
@@ -665,9 +1007,6 @@ class Volume():
         Publisher.sendMessage('Load volume into viewer',
                                     (volume, colour, (self.ww, self.wl)))
 
-        del flip
-        del cast
-
     def OnEnableTool(self, pubsub_evt):
         tool_name, enable = pubsub_evt.data
         if tool_name == _("Cut plane"):
@@ -685,18 +1024,12 @@ class Volume():
                                       self.volume_mapper)
 
     def CalculateHistogram(self):
-        image = self.image
-        r = int(image.GetScalarRange()[1] - image.GetScalarRange()[0])
-        accumulate = vtk.vtkImageAccumulate()
-        accumulate.SetInputData(image)
-        accumulate.SetComponentExtent(0, r -1, 0, 0, 0, 0)
-        accumulate.SetComponentOrigin(image.GetScalarRange()[0], 0, 0)
-        #  accumulate.ReleaseDataFlagOn()
-        accumulate.Update()
-        n_image = numpy_support.vtk_to_numpy(accumulate.GetOutput().GetPointData().GetScalars())
-        del accumulate
-        Publisher.sendMessage('Load histogram', (n_image,
-                                                     image.GetScalarRange()))
+        # Computed from the slice matrix, the image given to the mapper may
+        # have been filtered.
+        slice_data = slice_.Slice()
+        histogram, scalar_range = hist.SliceHistogram().Get(slice_data.matrix,
+                                                            slice_data.matrix_generation)
+        Publisher.sendMessage('Load histogram', (histogram, scalar_range))
 
     def TranslateScale(self, scale, value):
         #if value < 0:
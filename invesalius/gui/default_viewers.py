@@ -31,7 +31,7 @@ import invesalius.gui.widgets.slice_menu as slice_menu_
 
 from invesalius.gui.widgets.clut_raycasting import CLUTRaycastingWidget, \
         EVT_CLUT_POINT_RELEASE, EVT_CLUT_CURVE_SELECT, \
-        EVT_CLUT_CURVE_WL_CHANGE
+        EVT_CLUT_CURVE_WL_CHANGE, EVT_CLUT_POINT_MOVE
 
 from invesalius.constants import ID_TO_BMP
 import invesalius.constants as const
@@ -207,6 +207,7 @@ class VolumeInteraction(wx.Panel):
     def __init__(self, parent, id):
         super(VolumeInteraction, self).__init__(parent, id)
         self.can_show_raycasting_widget = 0
+        self._render_timer = None
         self.__init_aui_manager()
         #sizer = wx.BoxSizer(wx.HORIZONTAL)
         #sizer.Add(volume_viewer.Viewer(self), 1, wx.EXPAND|wx.GROW)
@@ -238,6 +239,7 @@ class VolumeInteraction(wx.Panel):
         self.clut_raycasting.Bind(EVT_CLUT_CURVE_SELECT, self.OnCurveSelected)
         self.clut_raycasting.Bind(EVT_CLUT_CURVE_WL_CHANGE,
                                   self.OnChangeCurveWL)
+        self.clut_raycasting.Bind(EVT_CLUT_POINT_MOVE, self.OnPointMoved)
         #self.Bind(wx.EVT_SIZE, self.OnSize)
         #self.Bind(wx.EVT_MAXIMIZE, self.OnMaximize)
 
@@ -252,6 +254,8 @@ class VolumeInteraction(wx.Panel):
                                 'Refresh raycasting widget points')
         Publisher.subscribe(self.LoadHistogram,
                                 'Load histogram')
+        Publisher.subscribe(self.LoadHistogram,
+                                'Update histogram')
         Publisher.subscribe(self._Exit, 'Exit')
 
     def __update_curve_wwwl_text(self, curve):
@@ -272,10 +276,15 @@ class VolumeInteraction(wx.Panel):
         self.aui_manager.Update()
 
     def OnPointChanged(self, evt):
+        self._CancelRender()
         Publisher.sendMessage('Set raycasting refresh', None)
         Publisher.sendMessage('Set raycasting curve', evt.GetCurve())
         Publisher.sendMessage('Render volume viewer')
 
+    def OnPointMoved(self, evt):
+        Publisher.sendMessage('Update raycasting curve', evt.GetCurve())
+        self._RenderLater()
+
     def OnCurveSelected(self, evt):
         Publisher.sendMessage('Set raycasting curve', evt.GetCurve())
         Publisher.sendMessage('Render volume viewer')
@@ -283,6 +292,22 @@ class VolumeInteraction(wx.Panel):
     def OnChangeCurveWL(self, evt):
         curve = evt.GetCurve()
         self.__update_curve_wwwl_text(curve)
+        self._RenderLater()
+
+    def _RenderLater(self):
+        # The mouse events come faster than the volume is rendered, so
+        # while dragging it's rendered at most once per display frame.
+        if self._render_timer is None:
+            self._render_timer = wx.CallLater(const.CLUT_RENDER_INTERVAL,
+                                              self._Render)
+
+    def _CancelRender(self):
+        if self._render_timer is not None:
+            self._render_timer.Stop()
+            self._render_timer = None
+
+    def _Render(self):
+        self._render_timer = None
         Publisher.sendMessage('Render volume viewer')
 
     def OnSetRaycastPreset(self, evt_pubsub):
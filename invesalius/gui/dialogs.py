@@ -1877,6 +1877,7 @@ class ClutImagedataDialog(wx.Dialog):
 
     def bind_events(self):
         Publisher.subscribe(self._refresh_widget, 'Update clut imagedata widget')
+        Publisher.subscribe(self._update_histogram, 'Update histogram')
 
     def OnClutChange(self, evt):
         Publisher.sendMessage('Change colour table from background image from widget',
@@ -1888,6 +1889,11 @@ class ClutImagedataDialog(wx.Dialog):
     def _refresh_widget(self, pubsub_evt):
         self.clut_widget.Refresh()
 
+    def _update_histogram(self, pubsub_evt):
+        histogram, (init, end) = pubsub_evt.data
+        self.histogram = histogram
+        self.clut_widget.SetHistogram(histogram, init, end)
+
     def Show(self, gen_evt=True, show=True):
         super(wx.Dialog, self).Show(show)
         if gen_evt:
@@ -551,6 +551,7 @@ class Frame(wx.Frame):
             ses.Session().surface_interpolation = values[const.SURFACE_INTERPOLATION]
             ses.Session().language = values[const.LANGUAGE]
             ses.Session().slice_interpolation = values[const.SLICE_INTERPOLATION]
+            ses.Session().raycasting_frame_time = values[const.RAYCASTING_FRAME_TIME]
             ses.Session().WriteSessionFile()
 
             Publisher.sendMessage('Remove Volume')
@@ -559,6 +560,7 @@ class Frame(wx.Frame):
             Publisher.sendMessage('Update Slice Interpolation MenuBar')
             Publisher.sendMessage('Update Navigation Mode MenuBar')
             Publisher.sendMessage('Update Surface Interpolation')
+            Publisher.sendMessage('Update raycasting frame time')
 
     def ShowAbout(self):
         """
@@ -88,6 +88,7 @@ class Preferences(wx.Dialog):
                   const.SURFACE_INTERPOLATION:se.surface_interpolation,
                   const.LANGUAGE:se.language,
                   const.SLICE_INTERPOLATION: se.slice_interpolation,
+                  const.RAYCASTING_FRAME_TIME: se.raycasting_frame_time,
                 }
 
         self.pnl_viewer2d.LoadSelection(values)
@@ -124,6 +125,15 @@ class Viewer3D(wx.Panel):
                     ['CPU', _(u'GPU (NVidia video cards only)')], 2, wx.RA_SPECIFY_COLS | wx.NO_BORDER)
 
         bsizer_ren.Add(rb_rendering, 0, wx.TOP | wx.LEFT, 0)
+
+        lbl_frame_time = wx.StaticText(self, -1, _("Frame time while rotating (ms)"))
+        bsizer_ren.Add(lbl_frame_time, 0, wx.TOP | wx.LEFT, 10)
+
+        min_time, max_time = const.RAYCASTING_FRAME_TIME_RANGE
+        spin_frame_time = self.spin_frame_time = wx.SpinCtrl(self, -1, "",
+                                                             min=min_time,
+                                                             max=max_time)
+        bsizer_ren.Add(spin_frame_time, 0, wx.TOP | wx.LEFT, 10)
         border = wx.BoxSizer(wx.VERTICAL)
         border.Add(bsizer, 50, wx.EXPAND|wx.ALL, 10)
         border.Add(bsizer_ren, 50, wx.EXPAND|wx.ALL, 10)
@@ -135,7 +145,8 @@ class Viewer3D(wx.Panel):
     def GetSelection(self):
 
         options = {const.RENDERING:self.rb_rendering.GetSelection(),
-                    const.SURFACE_INTERPOLATION:self.rb_inter.GetSelection()}
+                    const.SURFACE_INTERPOLATION:self.rb_inter.GetSelection(),
+                    const.RAYCASTING_FRAME_TIME:self.spin_frame_time.GetValue()}
 
         return options
 
@@ -145,6 +156,7 @@ class Viewer3D(wx.Panel):
 
         self.rb_rendering.SetSelection(int(rendering))
         self.rb_inter.SetSelection(int(surface_interpolation))
+        self.spin_frame_time.SetValue(int(values[const.RAYCASTING_FRAME_TIME]))
 
 
 class Viewer2D(wx.Panel):
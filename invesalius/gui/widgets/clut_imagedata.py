@@ -107,6 +107,16 @@ class CLUTImageDataWidget(wx.Panel):
         self._build_drawn_hist()
         self.__bind_events_wx()
 
+    def SetHistogram(self, histogram, init, end):
+        """
+        Replaces the histogram shown, keeping the nodes and the range shown.
+        """
+        self.histogram = histogram
+        self.i_init = init
+        self.i_end = end
+        self._build_drawn_hist()
+        self.Refresh()
+
     @property
     def window_level(self):
         self.nodes.sort()
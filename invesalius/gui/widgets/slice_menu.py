@@ -30,6 +30,7 @@ import wx
 from wx.lib.pubsub import pub as Publisher
 
 import invesalius.constants as const
+import invesalius.data.histogram as hist
 import invesalius.data.slice_ as sl
 import invesalius.presets as presets
 from invesalius.gui.dialogs import ClutImagedataDialog
@@ -264,9 +265,8 @@ class SliceMenu(wx.Menu):
         elif key == _('Custom'):
             if self.cdialog is None:
                 slc = sl.Slice()
-                histogram = slc.histogram
-                init = slc.matrix.min()
-                end = slc.matrix.max()
+                histogram, (init, end) = hist.SliceHistogram().Get(slc.matrix,
+                                                                   slc.matrix_generation)
                 nodes = slc.nodes
                 self.cdialog = ClutImagedataDialog(histogram, init, end, nodes)
                 self.cdialog.Show()
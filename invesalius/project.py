@@ -84,6 +84,10 @@ class Project(with_metaclass(Singleton, object)):
 
         self.raycasting_preset = ''
 
+        # The image prepared for the raycasting (see volume.Volume), as a
+        # dict with its filename, convolution filters and scalar range.
+        self.prepared_volume = None
+
 
         #self.surface_quality_list = ["Low", "Medium", "High", "Optimal *",
         #                             "Custom"i]
@@ -239,6 +243,16 @@ class Project(with_metaclass(Singleton, object)):
         filelist[self.matrix_filename] = 'matrix.dat'
         #shutil.copyfile(self.matrix_filename, filename_tmp)
 
+        # Saving the image prepared for the raycasting, so it's not
+        # prepared again when the project is reopened.
+        if self.prepared_volume is not None:
+            filelist[self.prepared_volume['filename']] = 'volume.dat'
+            project['volume'] = {
+                'filename': u'volume.dat',
+                'filters': self.prepared_volume['filters'],
+                'scale': self.prepared_volume['scale'],
+            }
+
         # Saving the masks
         masks = {}
         for index in self.mask_dict:
@@ -322,6 +336,17 @@ class Project(with_metaclass(Singleton, object)):
         self.matrix_shape = project["matrix"]['shape']
         self.matrix_dtype = project["matrix"]['dtype']
 
+        # Opening the image prepared for the raycasting (if saved)
+        if 'volume' in project:
+            volume = project['volume']
+            self.prepared_volume = {
+                'filename': os.path.join(dirpath, volume['filename']),
+                'filters': volume['filters'],
+                'scale': volume['scale'],
+            }
+        else:
+            self.prepared_volume = None
+
         # Opening the masks
         self.mask_dict = {}
         for index in project["masks"]:
@@ -97,6 +97,8 @@ class Session(with_metaclass(Singleton, object)):
         self.surface_interpolation = 1
         self.slice_interpolation = 0
         self.rendering = 0
+        self.mask_storage = const.DEFAULT_MASK_STORAGE
+        self.raycasting_frame_time = const.DEFAULT_RAYCASTING_FRAME_TIME
         self.WriteSessionFile()
 
     def IsOpen(self):
@@ -189,6 +191,8 @@ class Session(with_metaclass(Singleton, object)):
         config.set('session', 'surface_interpolation', self.surface_interpolation)
         config.set('session', 'rendering', self.rendering)
         config.set('session', 'slice_interpolation', self.slice_interpolation)
+        config.set('session', 'mask_storage', self.mask_storage)
+        config.set('session', 'raycasting_frame_time', self.raycasting_frame_time)
 
         config.add_section('project')
         config.set('project', 'recent_projects', self.recent_projects)
@@ -302,6 +306,8 @@ class Session(with_metaclass(Singleton, object)):
 
             self.rendering = config.get('session', 'rendering')
             self.random_id = config.get('session','random_id')
+            self.mask_storage = self._read_mask_storage(config)
+            self.raycasting_frame_time = self._read_raycasting_frame_time(config)
             return True
 
         except IOError:
@@ -322,8 +328,25 @@ class Session(with_metaclass(Singleton, object)):
             self.slice_interpolation = 0
             self.rendering = 0
             self.random_id = randint(0,pow(10,16))  
+            self.mask_storage = self._read_mask_storage(config)
+            self.raycasting_frame_time = self._read_raycasting_frame_time(config)
             try:
                 self.WriteSessionFile()
             except AttributeError:
                 return False
             return True
+
+    def _read_mask_storage(self, config):
+        import invesalius.constants as const
+        try:
+            return config.get('session', 'mask_storage')
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            return const.DEFAULT_MASK_STORAGE
+
+    def _read_raycasting_frame_time(self, config):
+        import invesalius.constants as const
+        try:
+            return int(config.get('session', 'raycasting_frame_time'))
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError,
+                ValueError):
+            return const.DEFAULT_RAYCASTING_FRAME_TIME
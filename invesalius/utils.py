@@ -207,6 +207,18 @@ def frange(start, end=None, inc=None):
     return L
 
 
+def slabs(shape, slab_size):
+    """
+    Splits a volume of the given (dz, dy, dx) shape in slabs of whole
+    slices with about slab_size voxels each. Yields (zi, zf), the first
+    and the last + 1 slices of each slab.
+    """
+    dz, dy, dx = shape
+    depth = max(slab_size // max(dy * dx, 1), 1)
+    for zi in range(0, dz, depth):
+        yield zi, min(zi + depth, dz)
+
+
 
 def calculate_resizing_tofitmemory(x_size,y_size,n_slices,byte):
     """